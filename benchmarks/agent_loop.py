@@ -0,0 +1,83 @@
+'''
+Benchmark of the overhead of the terminal agent loop, with the LLM served by the local mock server.
+
+The mock answers every step with a shell action until the last one, which gives the final answer.
+The time spent on the mock latency is subtracted, so what remains is the cost of the loop itself:
+building the prompts, parsing the responses, running the graph and the tool.
+
+With --replay a run is recorded to a trace and replayed without the mock, checking that a recorded
+agent run is reproduced even though its prompt carries another date and time.
+
+Usage: python -m benchmarks.agent_loop --steps 10 --repeat 5 --latency 0.2 --streaming [--replay]
+'''
+from src.inference.mock import MockServer,MockConfig
+from src.agent.terminal import TerminalAgent
+from src.inference.groq import ChatGroq
+from src.inference.replay import ReplayInference
+from src.inference.limiter import RateLimit
+from tempfile import TemporaryDirectory
+from statistics import median
+from time import perf_counter,sleep
+from pathlib import Path
+import argparse
+
+ACTION='''<Option>
+  <Thought>Print a line to check the shell.</Thought>
+  <Action-Name>Shell Tool</Action-Name>
+  <Action-Input>{"command":"echo benchmark"}</Action-Input>
+  <Route>Action</Route>
+</Option>'''
+
+FINAL='''<Option>
+  <Thought>The shell works.</Thought>
+  <Final-Answer>The shell printed the line.</Final-Answer>
+  <Route>Final</Route>
+</Option>'''
+
+def main(steps:int,repeat:int,latency:float,streaming:bool):
+    responses=[ACTION]*(steps-1)+[FINAL]
+    config=MockConfig(latency=latency,responses=responses)
+    with MockServer(config) as server:
+        # The mock has no quota, so the limiter should not add waits of its own
+        llm=ChatGroq(model='mock',api_key='mock',base_url=f'{server.base_url}/v1/chat/completions',temperature=0,rate_limit=RateLimit(requests_per_minute=100000))
+        agent=TerminalAgent(llm=llm,max_iteration=steps+1,streaming=streaming)
+        overheads=[]
+        for _ in range(repeat):
+            start=perf_counter()
+            agent.invoke('Check that the shell works')
+            elapsed=perf_counter()-start
+            overheads.append((elapsed-steps*latency)/steps)
+        print(f'steps: {steps} latency: {latency*1000:.0f}ms streaming: {streaming}')
+        print(f'loop overhead per step: {median(overheads)*1000:.1f}ms (median of {repeat})')
+
+def replay(steps:int,latency:float,streaming:bool):
+    '''Record a run against the mock, then replay it once the mock is stopped and the clock has moved on'''
+    responses=[ACTION]*(steps-1)+[FINAL]
+    with TemporaryDirectory() as directory:
+        path=Path(directory)/'trace.jsonl'
+        with MockServer(MockConfig(latency=latency,responses=responses)) as server:
+            llm=ChatGroq(model='mock',api_key='mock',base_url=f'{server.base_url}/v1/chat/completions',temperature=0,rate_limit=RateLimit(requests_per_minute=100000))
+            recorder=ReplayInference(path,llm=llm,mode='record')
+            recorded=TerminalAgent(llm=recorder,max_iteration=steps+1,streaming=streaming).invoke('Check that the shell works')
+        # The task of the replayed run carries a later current date and time than the recorded one
+        sleep(1)
+        player=ReplayInference(path,mode='replay')
+        start=perf_counter()
+        replayed=TerminalAgent(llm=player,max_iteration=steps+1,streaming=streaming).invoke('Check that the shell works')
+        elapsed=perf_counter()-start
+    if replayed!=recorded:
+        raise AssertionError(f'The replayed run answered {replayed!r} instead of {recorded!r}')
+    print(f'replayed {steps} steps streaming: {streaming} in {elapsed*1000:.1f}ms, same answer as recorded')
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Overhead of the agent loop against a mock LLM')
+    parser.add_argument('--steps',type=int,default=10)
+    parser.add_argument('--repeat',type=int,default=5)
+    parser.add_argument('--latency',type=float,default=0.2)
+    parser.add_argument('--streaming',action='store_true')
+    parser.add_argument('--replay',action='store_true',help='Check that a recorded run replays without the mock')
+    args=parser.parse_args()
+    if args.replay:
+        replay(args.steps,args.latency,args.streaming)
+    else:
+        main(args.steps,args.repeat,args.latency,args.streaming)
@@ -0,0 +1,82 @@
+'''
+Benchmark of the observation time of the web agent versus the number of interactive elements.
+
+Each fixture page is generated locally with `page.set_content`, so no network is involved.
+For every element count three strategies are measured:
+    - eager: the previous selector map, one `evaluate_handle` round trip per element
+    - lazy: a full scan with the selector map holding ids, the handles are resolved on demand
+    - incremental: a rescan after a small mutation of the page, patching the previous state
+
+Usage: python -m benchmarks.selector_map --counts 50 200 1000 --repeat 5 --browser chrome
+'''
+from src.agent.web.browser import Browser,BrowserConfig
+from src.agent.web.context import Context,ContextConfig
+from src.agent.web.dom import DOM,SCRIPT
+from statistics import median
+from time import perf_counter
+import argparse
+import asyncio
+
+def fixture(count:int)->str:
+    '''A page with a mix of links, buttons, inputs and selects.'''
+    rows=[]
+    for i in range(count):
+        kind=i%4
+        if kind==0:
+            rows.append(f'<a href="#item-{i}">Link {i}</a>')
+        elif kind==1:
+            rows.append(f'<button type="button" onclick="void 0">Button {i}</button>')
+        elif kind==2:
+            rows.append(f'<input type="text" name="field-{i}" placeholder="Field {i}">')
+        else:
+            rows.append(f'<select name="select-{i}"><option>One</option><option>Two</option></select>')
+    body='\n'.join(f'<div class="row">{row}</div>' for row in rows)
+    return f'<html><head><style>.row{{display:inline-block;margin:2px}}</style></head><body>{body}</body></html>'
+
+async def eager(context:Context)->float:
+    '''The selector map as it was built before: one handle per element.'''
+    start=perf_counter()
+    await context.execute_script(SCRIPT)
+    await asyncio.sleep(0.2)
+    nodes=await context.execute_script('getInteractiveElements()')
+    handles=await asyncio.gather(*[context.execute_script('index => getElementByIndex(index)',index,enable_handle=True) for index in range(len(nodes))])
+    elapsed=perf_counter()-start
+    await asyncio.gather(*[handle.dispose() for handle in handles])
+    return elapsed
+
+async def lazy(context:Context)->float:
+    start=perf_counter()
+    await DOM(context).get_state()
+    return perf_counter()-start
+
+async def incremental(context:Context)->float:
+    dom=DOM(context)
+    _,state=await dom.get_state()
+    await context.execute_script("document.body.insertAdjacentHTML('afterbegin','<button>New</button>')")
+    start=perf_counter()
+    await dom.get_state(previous=state)
+    return perf_counter()-start
+
+async def main(counts:list[int],repeat:int,browser:str):
+    config=BrowserConfig(headless=True,browser=browser,user_data_dir=None,slow_mo=0)
+    async with Browser(config=config) as browser_instance:
+        async with Context(browser_instance,ContextConfig()) as context:
+            page=await context.get_current_page()
+            print(f'{"elements":>10}{"eager (ms)":>14}{"lazy (ms)":>14}{"incremental (ms)":>20}')
+            for count in counts:
+                html=fixture(count)
+                results={'eager':[],'lazy':[],'incremental':[]}
+                for _ in range(repeat):
+                    for name,strategy in [('eager',eager),('lazy',lazy),('incremental',incremental)]:
+                        # A fresh document for each run, so no state leaks between strategies
+                        await page.set_content(html)
+                        results[name].append(await strategy(context))
+                print(f'{count:>10}{median(results["eager"])*1000:>14.1f}{median(results["lazy"])*1000:>14.1f}{median(results["incremental"])*1000:>20.1f}')
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Observation time versus element count')
+    parser.add_argument('--counts',type=int,nargs='+',default=[50,200,500,1000])
+    parser.add_argument('--repeat',type=int,default=5)
+    parser.add_argument('--browser',choices=['chrome','firefox','edge'],default='chrome')
+    args=parser.parse_args()
+    asyncio.run(main(args.counts,args.repeat,args.browser))
@@ -1,20 +1,29 @@
 from src.agent.computer.utils import extract_agent_data,read_markdown_file
 from src.message import AIMessage,HumanMessage,SystemMessage
 from langgraph.graph import StateGraph,START,END
+from langgraph.types import Send
 from src.agent.web import WebAgent,BrowserConfig
 from src.agent.computer.state import AgentState
+from src.agent.stream import StreamParser
+from src.agent.decision import ActionMode
+from src.agent.encoder import BaseEncoder
+from src.agent.screenshot.config import ScreenshotConfig
 from src.agent.terminal import TerminalAgent
 from src.agent.system import SystemAgent
+from src.agent.loop import default_loop
+from src.metrics import scope
 from src.inference import BaseInference
 from src.agent import BaseAgent
+from typing import Generator,AsyncGenerator
 from termcolor import colored
 from datetime import datetime
 from getpass import getuser
 from pathlib import Path
 import platform
+import asyncio
 
 class ComputerAgent(BaseAgent):
-    def __init__(self,llm:BaseInference=None,use_vision:bool=False,max_iteration:int=10,token_usage:bool=False,verbose:bool=False):
+    def __init__(self,llm:BaseInference=None,use_vision:bool=False,max_iteration:int=10,token_usage:bool=False,verbose:bool=False,streaming:bool=False,encoder:BaseEncoder=None,screenshot_config:ScreenshotConfig=None,agent_timeout:float=None,action_mode:ActionMode='text'):
         self.name='Computer Agent'
         self.description='This agent tries to simulate a human using the computer'
         self.system_prompt=read_markdown_file('src/agent/computer/prompt/system.md')
@@ -25,56 +34,102 @@ class ComputerAgent(BaseAgent):
         self.verbose=verbose
         self.token_usage=token_usage
         self.use_vision=use_vision
+        self.streaming=streaming
+        self.encoder=encoder
+        self.screenshot_config=screenshot_config
+        # Maximum time in seconds each sub-agent gets for a request, None for no limit
+        self.agent_timeout=agent_timeout
+        # How the sub-agents get their actions from the llm, see `Decider`
+        self.action_mode=action_mode
+        self.agents=['web','terminal','system']
+        # The web agent opens a visible browser, so it shares the screen with the system agent
+        self.browser_config=BrowserConfig(browser='edge',headless=False)
         self.graph=self.create_graph()
 
-    def reason(self,state:AgentState):    
-        message=self.llm.invoke(state.get('messages'))
+    async def reason(self,state:AgentState):    
+        if self.streaming:
+            # Stop the generation once the route is known, all the requests come before it
+            parser=StreamParser(stop_tags={'Route':'Agent','Final-Answer':'Final'})
+            message=AIMessage(await parser.async_consume(self.llm.async_stream(state.get('messages'))))
+        else:
+            message=await self.llm.async_invoke(state.get('messages'))
         agent_data=extract_agent_data(message.content)
+        if self.streaming and not agent_data.get('Route'):
+            agent_data['Route']=parser.route
+        if not agent_data.get('Route'):
+            # A response without a route is taken as the final answer
+            agent_data.update({'Final Answer':message.content,'Route':'Final'})
         thought=agent_data.get('Thought')
         route=agent_data.get('Route')
         agent_name=agent_data.get('Agent Name')
         agent_request=agent_data.get('Request')
+        agent_requests=self.plan_requests(agent_data.get('Requests'))
         if self.verbose:
             print(colored(f'Thought: {thought}',color='light_magenta',attrs=['bold']))
-        return {**state,'agent_data': agent_data,'messages':[message],'route':route,'agent_name':agent_name,'agent_request':agent_request}
-    
-    def web(self,state:AgentState):
-        if self.verbose:
-            print(colored(f'Agent Name: Web Agent',color='yellow',attrs=['bold']))
-            print(colored(f'Agent Request: {state.get("agent_request")}',color='green',attrs=['bold']))
-        config=BrowserConfig(browser='edge',headless=False)
-        agent=WebAgent(config=config,llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage)
-        agent_response=agent.invoke(state.get('agent_request'))
-        human_prompt=self.human_prompt.format(agent='Web Agent',response=agent_response)
-        message=HumanMessage(human_prompt)
-        if self.verbose:
-            print(colored(f'Agent Response: {agent_response}',color='blue',attrs=['bold']))
-        return {**state,'messages':[message],'agent_response':agent_response}
+        return {**state,'agent_data': agent_data,'messages':[message],'route':route,'agent_name':agent_name,'agent_request':agent_request,'agent_requests':agent_requests,'agent_responses':None}
+
+    def plan_requests(self,requests:list[tuple[str,str]])->list[dict]:
+        '''Decide which of the requested sub-agents run in this step'''
+        agent_requests=[]
+        screen_users=[]
+        for index,(agent_name,request) in enumerate(requests):
+            node=agent_name.lower().removesuffix(' agent')
+            uses_screen=node=='system' or (node=='web' and not self.browser_config.headless)
+            if node not in self.agents:
+                skipped=f'There is no agent named {agent_name}.'
+            elif uses_screen and ('system' in screen_users or (node=='system' and screen_users)):
+                # There is a single screen, the system agent can't work beside another agent that takes the focus and the input
+                skipped='Not executed, a System Agent request can\'t run at the same time as another System Agent or Web Agent request. Request it again in the next step.'
+            else:
+                skipped=None
+                if uses_screen:
+                    screen_users.append(node)
+            agent_requests.append({'index':index,'node':node,'agent_name':agent_name,'agent_request':request,'skipped':skipped})
+        return agent_requests
 
-    def terminal(self,state:AgentState):
+    async def run_agent(self,agent:BaseAgent,name:str,state:AgentState)->dict:
+        '''Run a sub-agent to completion, or until the timeout after which it is cancelled'''
         if self.verbose:
-            print(colored(f'Agent Name: Terminal Agent',color='yellow',attrs=['bold']))
+            print(colored(f'Agent Name: {name}',color='yellow',attrs=['bold']))
             print(colored(f'Agent Request: {state.get("agent_request")}',color='green',attrs=['bold']))
-        agent=TerminalAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,token_usage=self.token_usage)
-        agent_response=agent.invoke(state.get('agent_request'))
-        human_prompt=self.human_prompt.format(agent='Terminal Agent',response=agent_response)
-        message=HumanMessage(human_prompt)
+        try:
+            agent_response=await asyncio.wait_for(agent.async_invoke(state.get('agent_request')),timeout=self.agent_timeout)
+            status='completed'
+        except asyncio.TimeoutError:
+            agent_response=f'The {name} did not finish within {self.agent_timeout}s and was stopped.'
+            status='timeout'
+        except Exception as e:
+            agent_response=f'The {name} failed: {e}'
+            status='failed'
         if self.verbose:
             print(colored(f'Agent Response: {agent_response}',color='blue',attrs=['bold']))
-        return {**state,'messages':[message],'agent_response':agent_response}
+        return {'agent_responses':[{'index':state.get('index'),'agent':name,'response':agent_response,'status':status}]}
 
-    def system(self,state:AgentState):
-        if self.verbose:
-            print(colored(f'Agent Name: System Agent',color='yellow',attrs=['bold']))
-            print(colored(f'Agent Request: {state.get("agent_request")}',color='green',attrs=['bold']))
+    async def web(self,state:AgentState):
+        agent=WebAgent(config=self.browser_config,llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage,streaming=self.streaming,encoder=self.encoder,screenshot_config=self.screenshot_config,action_mode=self.action_mode)
+        return await self.run_agent(agent,'Web Agent',state)
 
-        agent=SystemAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage)
-        agent_response=agent.invoke(state.get('agent_request'))
-        human_prompt=self.human_prompt.format(agent='System Agent',response=agent_response)
-        message=HumanMessage(human_prompt)
-        if self.verbose:
-            print(colored(f'Agent Response: {agent_response}',color='blue',attrs=['bold']))
-        return {**state,'messages':[message],'agent_response':agent_response}
+    async def terminal(self,state:AgentState):
+        agent=TerminalAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,token_usage=self.token_usage,streaming=self.streaming,action_mode=self.action_mode)
+        return await self.run_agent(agent,'Terminal Agent',state)
+
+    async def system(self,state:AgentState):
+        agent=SystemAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage,streaming=self.streaming,encoder=self.encoder,screenshot_config=self.screenshot_config,action_mode=self.action_mode)
+        return await self.run_agent(agent,'System Agent',state)
+
+    def merge(self,state:AgentState):
+        '''Combine the responses of the sub-agents of this step in the order they were requested'''
+        responses={response.get('index'):response for response in state.get('agent_responses')}
+        prompts=[]
+        for request in state.get('agent_requests'):
+            response=responses.get(request.get('index'))
+            if response is None:
+                agent,agent_response=request.get('agent_name'),request.get('skipped')
+            else:
+                agent,agent_response=response.get('agent'),response.get('response')
+            prompts.append(self.human_prompt.format(agent=agent,response=agent_response))
+        agent_response='\n\n'.join(prompts)
+        return {'messages':[HumanMessage(agent_response)],'agent_response':agent_response}
 
     def final(self,state:AgentState):
         agent_data=state.get('agent_data')
@@ -87,8 +142,10 @@ class ComputerAgent(BaseAgent):
         if self.iteration<self.max_iteration:
             self.iteration+=1
             if state.get('route').lower()=='agent':
-                agent_name=state.get('agent_name')
-                return agent_name.lower()
+                requests=state.get('agent_requests')
+                sends=[Send(request.get('node'),request) for request in requests if request.get('skipped') is None]
+                # Without any runnable request the notes about the skipped ones are passed back directly
+                return sends if sends else 'merge'
             else:
                 return 'final'
         else:
@@ -100,20 +157,21 @@ class ComputerAgent(BaseAgent):
         workflow.add_node('web',self.web)
         workflow.add_node('terminal',self.terminal)
         workflow.add_node('system',self.system)
+        workflow.add_node('merge',self.merge)
         workflow.add_node('final',self.final)
 
         workflow.add_edge(START,'reason')
-        workflow.add_conditional_edges('reason',self.controller)
-        workflow.add_edge('web','reason')
-        workflow.add_edge('terminal','reason')
-        workflow.add_edge('system','reason')
+        workflow.add_conditional_edges('reason',self.controller,[*self.agents,'merge','final'])
+        # The requested agents run in parallel and their responses are merged before reasoning again
+        workflow.add_edge('web','merge')
+        workflow.add_edge('terminal','merge')
+        workflow.add_edge('system','merge')
+        workflow.add_edge('merge','reason')
         workflow.add_edge('final',END)
 
         return workflow.compile(debug=False)
 
-    def invoke(self,input:str):
-       if self.verbose:
-            print(f'Entering '+colored(self.name,'black','on_white'))
+    def initial_state(self,input:str)->AgentState:
        parameters={
            'username': getuser(),
            'os': platform.platform(),
@@ -121,7 +179,7 @@ class ComputerAgent(BaseAgent):
            'home_dir': Path.home().as_posix(),
            'datetime': datetime.now().strftime('%Y-%m-%d'),
        }
-       state={
+       return {
            'input':input,
            'agent_data':{},
            'messages':[SystemMessage(self.system_prompt.format(**parameters)),HumanMessage(f'Task: {input}')],
@@ -129,10 +187,33 @@ class ComputerAgent(BaseAgent):
            'route':'',
            'agent_name':'',
            'agent_request':'',
-           'agent_response':''
+           'agent_response':'',
+           'agent_requests':[],
+           'agent_responses':[]
        }
-       agent_response=self.graph.invoke(state)
+
+    async def async_invoke(self,input:str):
+       self.iteration=0
+       with scope(agent=self.name):
+           state=self.initial_state(input)
+           agent_response=await self.graph.ainvoke(state)
        return agent_response.get('output')
 
-    def stream(self,input:str):
-        pass
\ No newline at end of file
+    def invoke(self,input:str):
+       if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+       # The whole orchestration, sub-agents included, runs on the shared loop
+       return default_loop.run(self.async_invoke(input))
+
+    async def async_stream(self,input:str)->AsyncGenerator[dict,None]:
+        '''Yield the update of each node of the graph as it finishes'''
+        self.iteration=0
+        with scope(agent=self.name):
+            state=self.initial_state(input)
+            async for chunk in self.graph.astream(state,stream_mode='updates'):
+                yield chunk
+
+    def stream(self,input:str)->Generator[dict,None,None]:
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        yield from default_loop.iterate(self.async_stream(input))
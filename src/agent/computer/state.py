@@ -2,6 +2,12 @@ from typing import TypedDict,Annotated
 from src.message import BaseMessage
 from operator import add
 
+def merge_responses(current:list[dict],new:list[dict]|None)->list[dict]:
+    '''Collect the responses of the sub-agents running in parallel, None starts a new step'''
+    if new is None:
+        return []
+    return current+new
+
 class AgentState(TypedDict):
     input:str
     messages:Annotated[list[BaseMessage],add]
@@ -10,4 +16,7 @@ class AgentState(TypedDict):
     agent_data:dict
     agent_request:str
     agent_response:str
-    output:str
\ No newline at end of file
+    # The sub-agent requests of the current step and their responses
+    agent_requests:list[dict]
+    agent_responses:Annotated[list[dict],merge_responses]
+    output:str
@@ -11,7 +11,8 @@ def extract_agent_data(response: str) -> dict:
         'Agent Name': None,
         'Request': None,
         'Final Answer': None,
-        'Route': None
+        'Route': None,
+        'Requests': []
     }
     
     # Regular expressions for different parts of the response
@@ -42,6 +43,11 @@ def extract_agent_data(response: str) -> dict:
     if request_match:
         result['Request'] = request_match.group(1).strip()
 
+    # Extract all the Agent-Name and Request pairs, several sub-agents can be requested at once
+    agent_names = [name.strip() for name in agent_name_regex.findall(response)]
+    requests = [request.strip() for request in request_regex.findall(response)]
+    result['Requests'] = list(zip(agent_names, requests))
+
     # Extract Final Answer (Option 3)
     final_answer_match = final_answer_regex.search(response)
     if final_answer_match:
@@ -0,0 +1,97 @@
+from src.message import AIMessage,BaseMessage,HumanMessage,ToolMessage
+from pydantic import BaseModel,Field,ValidationError,create_model
+from src.inference import BaseInference
+from typing import Callable,Literal
+from src.tool import Tool
+import json
+
+ActionMode=Literal['text','tools','json']
+
+TOOLS_PROMPT='''
+### Response Mode
+Do not write the <Option> format. To perform an action, call the right tool with its arguments. Once the task is done, reply with the final answer as plain text.
+'''
+
+JSON_PROMPT='''
+### Response Mode
+Do not write the <Option> format. Respond with a JSON object instead: `thought`, then `action_name` and `action_input` to perform an action, or `final_answer` once the task is done.
+'''
+
+def decision_model(tools:list[Tool])->type[BaseModel]:
+    '''The schema of a step of the agent, the action name is limited to the names of the tools'''
+    names=tuple(tool.name for tool in tools)
+    return create_model(
+        'Decision',
+        thought=(str,Field(description='Think step by step and explain the thought process of solving the task')),
+        action_name=(Literal[names]|None,Field(default=None,description='The tool to perform the action with')),
+        action_input=(dict|None,Field(default=None,description='The arguments of the tool')),
+        final_answer=(str|None,Field(default=None,description='The final answer once the task is done'))
+    )
+
+class Decider:
+    '''Gets the next step of an agent as structured data instead of parsing the tagged text of the response.
+
+    In `text` mode the response is parsed with `parse`, the agents' own tag parser. In `tools` mode the tools
+    are bound to the model and called natively, a plain text reply is the final answer. In `json` mode the
+    response is constrained to the schema of a step, with the `format` schema on Ollama and the JSON mode
+    of the other providers. Both give the action as arguments the tool can take, so malformed output is rare
+    and the response is only as long as the arguments. A response that still fails the schema is asked
+    again with the error, up to `retries` times, before it ends the task like an unparsed text.'''
+    def __init__(self,llm:BaseInference,tools:list[Tool],mode:ActionMode='text',parse:Callable[[str],dict]=None,retries:int=1):
+        self.mode=mode
+        self.retries=retries
+        self.parse=parse
+        self.names={tool.function_name:tool.name for tool in tools}
+        self.llm=llm.bind_tools(tools) if mode=='tools' and llm else llm
+        self.model=decision_model(tools) if mode=='json' else None
+
+    @property
+    def prompt(self)->str:
+        '''Added to the system prompt, replacing the tagged response format'''
+        return {'tools':TOOLS_PROMPT,'json':JSON_PROMPT}.get(self.mode,'')
+
+    async def async_decide(self,messages:list[BaseMessage])->tuple[AIMessage,dict]:
+        '''The response of the model and the agent data (Thought, Action Name, Action Input, Final Answer, Route)'''
+        if self.mode=='json':
+            feedback=[]
+            for _ in range(self.retries+1):
+                try:
+                    decision=await self.llm.async_invoke(messages+feedback,model=self.model)
+                    return AIMessage(decision.model_dump_json()),self.from_decision(decision)
+                except ValidationError as e:
+                    error=e
+                    feedback=[HumanMessage(f'The response does not follow the schema of a step:\n{error}\nRespond again with a valid JSON object.')]
+            message=f'The model could not produce a valid step: {error}'
+            return AIMessage(message),{'Thought':'','Final Answer':message,'Route':'Final'}
+        response=await self.llm.async_invoke(messages)
+        if isinstance(response,ToolMessage):
+            return AIMessage(json.dumps({'name':response.name,'args':response.args})),self.from_tool_call(response)
+        return response,self.from_text(response.content)
+
+    def from_tool_call(self,tool_call:ToolMessage)->dict:
+        return {
+            'Thought':'',
+            'Action Name':self.names.get(tool_call.name,tool_call.name),
+            'Action Input':tool_call.args or {},
+            'Route':'Action'
+        }
+
+    def from_decision(self,decision:BaseModel)->dict:
+        if decision.action_name:
+            return {
+                'Thought':decision.thought,
+                'Action Name':decision.action_name,
+                'Action Input':decision.action_input or {},
+                'Route':'Action'
+            }
+        return {'Thought':decision.thought,'Final Answer':decision.final_answer or '','Route':'Final'}
+
+    def from_text(self,text:str,route:str=None)->dict:
+        '''The agent data of a tagged response, `route` is the one implied by where a stream was cut'''
+        agent_data=self.parse(text) if self.parse else {}
+        if not agent_data.get('Route') and route:
+            agent_data['Route']=route
+        # A model can keep to the tagged format it sees in the earlier steps, otherwise the text is the answer
+        if agent_data.get('Route'):
+            return agent_data
+        return {'Thought':'','Final Answer':text,'Route':'Final'}
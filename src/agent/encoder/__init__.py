@@ -0,0 +1,151 @@
+from src.agent.encoder.views import Element,Encoding
+from abc import ABC,abstractmethod
+from itertools import groupby
+from math import ceil
+import re
+
+def estimate_tokens(text:str)->int:
+    '''Rough token count of the text, about four characters per token.'''
+    return ceil(len(text)/4)
+
+class BaseEncoder(ABC):
+    '''Turns the interactive elements of an observation into text for the prompt.'''
+    def __init__(self,token_budget:int=None):
+        self.token_budget=token_budget
+
+    @abstractmethod
+    def encode(self,elements:list[Element])->Encoding:
+        pass
+
+    @abstractmethod
+    def format_prompt(self)->str:
+        '''Describes the format of the encoded elements for the system prompt.'''
+        pass
+
+class CompactEncoder(BaseEncoder):
+    '''
+    Encodes the elements one per line within a token budget.
+
+    Names are whitespace-normalized and truncated, attributes of low value or repeating the name are dropped,
+    runs of similar consecutive elements (list items, nav links) are collapsed into an index range, and
+    elements inside the viewport are kept first when the budget is exceeded.
+    '''
+    def __init__(self,token_budget:int=2000,max_name_length:int=60,max_attribute_length:int=40,min_run_length:int=4,ignored_attributes:list[str]=None):
+        super().__init__(token_budget=token_budget)
+        self.max_name_length=max_name_length
+        self.max_attribute_length=max_attribute_length
+        self.min_run_length=min_run_length
+        self.ignored_attributes=set(ignored_attributes) if ignored_attributes is not None else {
+            'class','id','style','role','target','for','autocomplete','src',
+            'aria-labelledby','aria-describedby','data-testid','data-id','data-qa','data-cy'
+        }
+
+    def truncate(self,text:str,length:int)->str:
+        text=re.sub(r'\s+',' ',text or '').strip()
+        return text if len(text)<=length else f'{text[:length-3]}...'
+
+    def attributes(self,element:Element,name:str)->dict[str,str]:
+        '''The attributes worth showing, without the ones that repeat the name or each other.'''
+        seen={name.lower()}
+        attributes={}
+        for key,value in (element.attributes or {}).items():
+            if key in self.ignored_attributes:
+                continue
+            value=self.truncate(str(value),self.max_attribute_length)
+            if value.lower() in seen:
+                continue
+            seen.add(value.lower())
+            attributes[key]=value
+        return attributes
+
+    def head(self,element:Element)->str:
+        role=f'[{element.role}]' if element.role and element.role!=element.kind else ''
+        return f'{element.kind}{role}'
+
+    def signature(self,element:Element)->tuple:
+        return (self.head(element),element.in_viewport,tuple(sorted(self.attributes(element,self.truncate(element.name,self.max_name_length)).keys())))
+
+    def line(self,element:Element)->str:
+        name=self.truncate(element.name,self.max_name_length)
+        attributes=' '.join(f'{key}={value}' for key,value in self.attributes(element,name).items())
+        parts=[f'{element.index}: {self.head(element)}']
+        if name:
+            parts.append(f'"{name}"')
+        if attributes:
+            parts.append(attributes)
+        if not element.in_viewport:
+            parts.append('(offscreen)')
+        return ' '.join(parts)
+
+    def run_line(self,run:list[Element])->str:
+        first,last=run[0],run[-1]
+        names=[self.truncate(element.name,self.max_name_length//2) for element in run]
+        if len(set(names))==1:
+            names_text=f'"{names[0]}" x{len(run)}'
+        else:
+            names_text=' | '.join(f'"{name}"' for name in names)
+        line=f'{first.index}-{last.index}: {self.head(first)} {names_text}'
+        if not first.in_viewport:
+            line+=' (offscreen)'
+        return line
+
+    def entries(self,elements:list[Element])->list[tuple[str,list[Element]]]:
+        '''Lines of the encoding with the elements each covers, runs of similar elements sharing one line.'''
+        entries=[]
+        for _,group in groupby(elements,key=self.signature):
+            group=list(group)
+            # Only consecutive indexes are collapsed, so a range always maps back to its elements
+            runs=[[group[0]]]
+            for element in group[1:]:
+                if element.index==runs[-1][-1].index+1:
+                    runs[-1].append(element)
+                else:
+                    runs.append([element])
+            for run in runs:
+                if len(run)>=self.min_run_length:
+                    entries.append((self.run_line(run),run))
+                else:
+                    entries.extend((self.line(element),[element]) for element in run)
+        return entries
+
+    def encode(self,elements:list[Element])->Encoding:
+        entries=self.entries(elements)
+        if self.token_budget is None:
+            selected=set(range(len(entries)))
+        else:
+            # Elements in the viewport first, then in the order of the page
+            priority=sorted(range(len(entries)),key=lambda i:(not entries[i][1][0].in_viewport,i))
+            selected=set()
+            # Room is kept for the line telling how many elements were left out
+            tokens=estimate_tokens('... 0000 more elements not shown')+1
+            for i in priority:
+                cost=estimate_tokens(entries[i][0])+1
+                if tokens+cost>self.token_budget:
+                    continue
+                selected.add(i)
+                tokens+=cost
+        lines=[entries[i][0] for i in sorted(selected)]
+        shown=sum(len(entries[i][1]) for i in selected)
+        omitted=len(elements)-shown
+        if omitted:
+            lines.append(f'... {omitted} more elements not shown')
+        text='\n'.join(lines)
+        return Encoding(text=text,tokens=estimate_tokens(text),shown=shown,omitted=omitted)
+
+    def format_prompt(self)->str:
+        return '\n'.join([
+            'One element per line in the following format:',
+            '```',
+            '<element_index>: <element_type>[<element_role>] "<element_name>" <attribute>=<value> ...',
+            '```',
+            '    - element_index : Unique numerical Identifier for interacting with that element',
+            '    - element_type : The html tag or the control type of that element',
+            '    - element_role : The role for that element (omitted if it has none)',
+            '    - element_name : The name present for that element (long names are cut with ...)',
+            '    - attribute=value : Additional attributes conveying more information about that element',
+            'Similar consecutive elements are collapsed into one line: `<first_index>-<last_index>: <element_type> "<name>" | "<name>" | ...`,'
+            ' where the n-th name belongs to the index first_index+n, or `"<name>" xN` when all of them share the same name.',
+            'Elements outside the visible area are marked with (offscreen), and `... N more elements not shown` means the list was cut to save space.',
+            '',
+            '**Example:** 8: input "Google Search" type=submit'
+        ])
@@ -0,0 +1,22 @@
+from dataclasses import dataclass,field
+
+@dataclass
+class Element:
+    index:int
+    # The html tag or the control type of the element
+    kind:str
+    role:str|None=None
+    name:str=''
+    attributes:dict[str,str]=field(default_factory=dict)
+    in_viewport:bool=True
+
+@dataclass
+class Encoding:
+    text:str
+    tokens:int
+    # Number of elements present in the text and the number left out to stay within the budget
+    shown:int
+    omitted:int=0
+
+    def __str__(self):
+        return self.text
@@ -0,0 +1,123 @@
+from src.client import default_pool
+from threading import Thread,Lock,current_thread
+from concurrent.futures import Future
+from typing import Coroutine,Any,AsyncGenerator,Generator
+from queue import Queue
+import asyncio
+import atexit
+
+class LoopThread:
+    '''A long-lived event loop shared by the agents.
+
+    The sync entry points of the agents submit their coroutines to it instead of creating a new loop per call,
+    so the objects bound to a loop (browsers, async http clients) survive between calls. The loop runs in a
+    background thread, unless a thread of the application (e.g. the GUI worker) drives it with `drive`.'''
+    def __init__(self,name:str='agent-loop'):
+        self.name=name
+        self.loop:asyncio.AbstractEventLoop=None
+        self.thread:Thread=None
+        self.lock=Lock()
+        self.shutdown_callbacks:list=[]
+        atexit.register(self.stop)
+
+    def start(self)->asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None or self.loop.is_closed():
+                self.loop=asyncio.new_event_loop()
+                self.thread=Thread(target=self.run_forever,args=(self.loop,),name=self.name,daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def drive(self,on_ready=None):
+        '''Run the loop in the calling thread until it is stopped.'''
+        with self.lock:
+            if self.loop is not None and not self.loop.is_closed():
+                raise RuntimeError('The agent loop is already running')
+            self.loop=asyncio.new_event_loop()
+            self.thread=None
+            loop=self.loop
+        if on_ready is not None:
+            loop.call_soon(on_ready)
+        self.run_forever(loop)
+
+    def run_forever(self,loop:asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def submit(self,coroutine:Coroutine)->Future:
+        return asyncio.run_coroutine_threadsafe(coroutine,self.start())
+
+    def run(self,coroutine:Coroutine)->Any:
+        '''Run the coroutine on the loop and wait for its result.'''
+        loop=self.start()
+        try:
+            running=asyncio.get_running_loop()
+        except RuntimeError:
+            running=None
+        if running is loop:
+            coroutine.close()
+            raise RuntimeError('Waiting on the agent loop from inside it would deadlock, await the async method instead')
+        return self.submit(coroutine).result()
+
+    def iterate(self,stream:AsyncGenerator)->Generator:
+        '''Consume an async generator on the loop and yield its items in the calling thread.
+
+        The generator runs within a single task, so the context it sets up holds for all of its steps.'''
+        loop=self.start()
+        try:
+            running=asyncio.get_running_loop()
+        except RuntimeError:
+            running=None
+        if running is loop:
+            raise RuntimeError('Waiting on the agent loop from inside it would deadlock, iterate the async generator instead')
+        items=Queue()
+        end=object()
+        async def consume():
+            try:
+                async for item in stream:
+                    items.put((item,None))
+                items.put((end,None))
+            except BaseException as e:
+                items.put((end,e))
+                raise
+            finally:
+                await stream.aclose()
+        future=asyncio.run_coroutine_threadsafe(consume(),loop)
+        try:
+            while True:
+                item,error=items.get()
+                if item is end:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+    def on_shutdown(self,callback):
+        '''Register a coroutine function to be awaited on the loop before it stops.'''
+        self.shutdown_callbacks.append(callback)
+
+    def stop(self):
+        with self.lock:
+            loop,thread=self.loop,self.thread
+            self.loop,self.thread=None,None
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return
+        if current_thread() is not thread:
+            for callback in self.shutdown_callbacks:
+                try:
+                    asyncio.run_coroutine_threadsafe(callback(),loop).result(timeout=10)
+                except Exception:
+                    pass
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None and thread is not current_thread():
+            thread.join(timeout=10)
+
+default_loop=LoopThread()
+# The providers leave the shared pool open, its async client on this loop is closed with the loop
+default_loop.on_shutdown(default_pool.async_close)
@@ -0,0 +1,80 @@
+from src.agent.screenshot.config import ScreenshotConfig
+from src.agent.screenshot.views import Screenshot
+from src.message import BaseMessage,HumanMessage,ImageMessage
+from io import BytesIO
+from PIL import Image
+
+MIME_TYPES={'jpeg':'image/jpeg','webp':'image/webp','png':'image/png'}
+
+def perceptual_hash(image:Image.Image,size:int=8)->int:
+    '''Difference hash: 64 bits telling whether each pixel of a downscaled grayscale image is brighter than its right neighbour.'''
+    pixels=list(image.convert('L').resize((size+1,size),Image.Resampling.LANCZOS).getdata())
+    hash=0
+    for row in range(size):
+        for col in range(size):
+            left=pixels[row*(size+1)+col]
+            right=pixels[row*(size+1)+col+1]
+            hash=(hash<<1)|(left>right)
+    return hash
+
+def hamming_distance(a:int,b:int)->int:
+    return (a^b).bit_count()
+
+class ScreenshotPipeline:
+    '''Crops, downscales and encodes the screenshots of an agent, and tells when the screen is unchanged since the previous step.'''
+    def __init__(self,config:ScreenshotConfig=None):
+        self.config=config if config else ScreenshotConfig()
+        self.previous:Screenshot=None
+
+    def crop(self,image:Image.Image,region:tuple[int,int,int,int]|None)->Image.Image:
+        '''Crop the image to the region (left,top,right,bottom) with some padding around it.'''
+        if self.config.region!='focus' or region is None:
+            return image
+        padding=self.config.region_padding
+        left,top,right,bottom=region
+        box=(max(0,int(left)-padding),max(0,int(top)-padding),min(image.width,int(right)+padding),min(image.height,int(bottom)+padding))
+        if box[2]<=box[0] or box[3]<=box[1]:
+            return image
+        return image.crop(box)
+
+    def resize(self,image:Image.Image)->Image.Image:
+        scale=min(self.config.max_width/image.width,self.config.max_height/image.height)
+        if scale>=1:
+            return image
+        return image.resize((max(1,round(image.width*scale)),max(1,round(image.height*scale))),Image.Resampling.LANCZOS)
+
+    def encode(self,image:Image.Image)->bytes:
+        io=BytesIO()
+        format=self.config.format
+        if format=='png':
+            image.save(io,format='PNG',optimize=True)
+        else:
+            image.convert('RGB').save(io,format=format.upper(),quality=self.config.quality)
+        return io.getvalue()
+
+    def process(self,image:Image.Image|bytes,region:tuple[int,int,int,int]|None=None)->Screenshot:
+        '''Turn a captured screenshot into the image sent to the model.'''
+        if isinstance(image,bytes):
+            image=Image.open(BytesIO(image))
+        image=self.resize(self.crop(image,region))
+        hash=perceptual_hash(image)
+        previous=self.previous
+        threshold=self.config.change_threshold
+        if previous is not None and threshold is not None and (previous.width,previous.height)==image.size and hamming_distance(previous.hash,hash)<=threshold:
+            # Reuse the previous image as is, so identical observations stay byte-identical
+            screenshot=Screenshot(data=previous.data,mime_type=previous.mime_type,width=previous.width,height=previous.height,hash=previous.hash,unchanged=True)
+        else:
+            screenshot=Screenshot(data=self.encode(image),mime_type=MIME_TYPES[self.config.format],width=image.width,height=image.height,hash=hash)
+        self.previous=screenshot
+        return screenshot
+
+    def to_message(self,text:str,screenshot:Screenshot|None)->BaseMessage:
+        '''The observation message carrying the screenshot, without the image if it is unchanged and skipping is enabled.'''
+        if screenshot is None:
+            return HumanMessage(text)
+        if screenshot.unchanged and self.config.skip_unchanged:
+            return HumanMessage(f'{text}\nScreenshot: the screen looks the same as in the previous step.')
+        return ImageMessage(text=text,image_obj=screenshot.data,mime_type=screenshot.mime_type)
+
+    def reset(self):
+        self.previous=None
@@ -0,0 +1,21 @@
+from dataclasses import dataclass
+from typing import Literal
+
+@dataclass
+class ScreenshotConfig:
+    # The screenshot is downscaled to fit within these dimensions (aspect ratio is kept)
+    max_width:int=1280
+    max_height:int=1280
+    format:Literal['jpeg','webp','png']='jpeg'
+    # Quality of the lossy formats (1-100)
+    quality:int=75
+    # Maximum hamming distance between the 64 bit perceptual hashes of two screenshots for them to be considered the same.
+    # None (the default) always sends the new frame, small edits (typed text, a ticked checkbox) move the hash by only a few bits
+    # so a threshold above 0 can reuse a stale frame, 0 still reuses frames that look identical at hash resolution
+    change_threshold:int|None=None
+    # Leave the image out of the observation when the screen is unchanged since the last step
+    skip_unchanged:bool=False
+    # Crop to the active window (desktop) or the focused element (web) instead of the whole screen
+    region:Literal['full','focus']='full'
+    # Margin kept around the region of interest in pixels
+    region_padding:int=50
@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+
+@dataclass
+class Screenshot:
+    data:bytes
+    mime_type:str
+    width:int
+    height:int
+    # Perceptual hash of the screenshot
+    hash:int
+    # True if the screenshot is the same as the one of the previous step
+    unchanged:bool=False
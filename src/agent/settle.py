@@ -0,0 +1,9 @@
+from dataclasses import dataclass,field
+
+@dataclass
+class SettleRecord:
+    '''How long an agent waited for the page or the screen to settle after an action.'''
+    waited:float
+    # The signals that were waited on (e.g. network, dom, frames, screen) and whether the maximum wait was hit
+    signals:list[str]=field(default_factory=list)
+    timed_out:bool=False
@@ -0,0 +1,67 @@
+from typing import Generator,AsyncGenerator
+import re
+
+# The top level tags of a response, markup inside them (e.g. html in an Action-Input) is content
+TAGS=('Thought','Action-Name','Action-Input','Route','Final-Answer')
+
+class StreamParser:
+    '''Parses the tagged response of an agent while it is being generated.
+
+    Completed tags are collected in `fields` as soon as they close and the stream is
+    stopped once one of the `stop_tags` closes, so the rest of the generation is not waited for.
+    `stop_tags` maps each stop tag to the route implied when the response is cut there.'''
+    def __init__(self,stop_tags:dict[str,str]={}):
+        self.stop_tags=stop_tags
+        self.opening=re.compile('<({})>'.format('|'.join(map(re.escape,TAGS))))
+        self.fields:dict[str,str]={}
+        self.buffer=''
+        self.position=0
+        self.stop_tag=None
+
+    @property
+    def text(self)->str:
+        '''The response received till the stop tag'''
+        return self.buffer[:self.position] if self.stop_tag else self.buffer
+
+    @property
+    def route(self)->str|None:
+        return self.fields.get('Route') or self.stop_tags.get(self.stop_tag)
+
+    def feed(self,chunk:str)->bool:
+        '''Add a chunk of the response and return True once a stop tag is closed'''
+        self.buffer+=chunk
+        if '>' not in chunk:
+            return False
+        while opening:=self.opening.search(self.buffer,self.position):
+            tag=opening.group(1)
+            closing=self.buffer.find(f'</{tag}>',opening.end())
+            if closing==-1:
+                # Wait at the open tag for its closing tag to arrive
+                self.position=opening.start()
+                return False
+            self.fields[tag]=self.buffer[opening.end():closing].strip()
+            self.position=closing+len(f'</{tag}>')
+            if tag in self.stop_tags:
+                self.stop_tag=tag
+                return True
+        return False
+
+    def consume(self,stream:Generator[str,None,None])->str:
+        '''Read the stream till a stop tag closes and cancel the remaining generation'''
+        try:
+            for chunk in stream:
+                if self.feed(chunk):
+                    break
+        finally:
+            stream.close()
+        return self.text
+
+    async def async_consume(self,stream:AsyncGenerator[str,None])->str:
+        '''Read the stream till a stop tag closes and cancel the remaining generation'''
+        try:
+            async for chunk in stream:
+                if self.feed(chunk):
+                    break
+        finally:
+            await stream.aclose()
+        return self.text
@@ -3,21 +3,28 @@ from src.message import HumanMessage,SystemMessage,AIMessage,ImageMessage
 from src.agent.system.utils import read_markdown_file,extract_agent_data
 from langgraph.graph import StateGraph,START,END
 from src.agent.system.state import AgentState
+from src.agent.stream import StreamParser
+from src.agent.decision import Decider,ActionMode
+from src.agent.encoder import BaseEncoder,CompactEncoder
 from src.memory.episodic import EpisodicMemory
 from src.agent.system.registry import Registry
-from src.agent.system.desktop import Desktop
+from src.agent.system.desktop import Desktop,DesktopConfig
+from src.agent.screenshot.config import ScreenshotConfig
+from src.agent.loop import default_loop
+from src.metrics import scope,current_run,default_collector
 from src.inference import BaseInference
 from src.agent import BaseAgent
+from typing import Generator,AsyncGenerator
 from datetime import datetime
 from termcolor import colored
 from getpass import getuser
 from pathlib import Path
 import pyautogui
+import asyncio
 import platform
 import json
 
 pyautogui.FAILSAFE=False
-pyautogui.PAUSE=2.5
 
 tools=[
     click_tool,type_tool,
@@ -26,38 +33,53 @@ tools=[
 ]
 
 class SystemAgent(BaseAgent):
-    def __init__(self,instructions:list[str]=[],llm:BaseInference=None,episodic_memory:EpisodicMemory=None,use_vision:bool=False,max_iteration:int=10,verbose:bool=False,token_usage:bool=False) -> None:
+    def __init__(self,instructions:list[str]=[],llm:BaseInference=None,episodic_memory:EpisodicMemory=None,use_vision:bool=False,max_iteration:int=10,verbose:bool=False,token_usage:bool=False,streaming:bool=False,encoder:BaseEncoder=None,screenshot_config:ScreenshotConfig=None,desktop_config:DesktopConfig=None,action_mode:ActionMode='text') -> None:
         self.name='System Agent'
         self.description='The System Agent is an AI-powered automation tool designed to interact with the operating system. It simulates human actions, such as opening applications, clicking buttons, typing, scrolling, and performing other system-level tasks.'
         self.registry=Registry(tools)
-        self.desktop=Desktop()
+        self.action_mode=action_mode
+        self.decider=Decider(llm,self.registry.actions,action_mode,extract_agent_data)
+        # With native tool calling the tools are bound to a copy of the llm
+        self.llm=self.decider.llm
+        self.desktop=Desktop(config=desktop_config,screenshot_config=screenshot_config)
         self.instructions=self.format_instructions(instructions)
         self.system_prompt=read_markdown_file(f'./src/agent/system/prompt/system.md')
         self.observation_prompt=read_markdown_file(f'./src/agent/system/prompt/observation.md')
         self.action_prompt=read_markdown_file(f'./src/agent/system/prompt/action.md')
         self.answer_prompt=read_markdown_file(f'./src/agent/system/prompt/answer.md')
         self.episodic_memory=episodic_memory
+        self.encoder=encoder if encoder else CompactEncoder()
         self.graph=self.create_graph()
         self.max_iteration=max_iteration
         self.use_vision=use_vision
         self.token_usage=token_usage
         self.verbose=verbose
+        self.streaming=streaming
         self.iteration=0
-        self.llm=llm
 
     def format_instructions(self,instructions):
         return '\n'.join([f'{i+1}. {instruction}' for (i,instruction) in enumerate(instructions)])
 
-    def reason(self,state:AgentState):
-        ai_message=self.llm.invoke(state.get('messages'))
-        agent_data=extract_agent_data(ai_message.content)
+    async def reason(self,state:AgentState):
+        if self.action_mode!='text':
+            # The step comes back structured, there are no tags to stop a stream at
+            ai_message,agent_data=await self.decider.async_decide(state.get('messages'))
+        elif self.streaming:
+            # Stop the generation as soon as the action is known
+            parser=StreamParser(stop_tags={'Action-Input':'Action','Final-Answer':'Final'})
+            ai_message=AIMessage(await parser.async_consume(self.llm.async_stream(state.get('messages'))))
+            agent_data=self.decider.from_text(ai_message.content,parser.route)
+        else:
+            ai_message=await self.llm.async_invoke(state.get('messages'))
+            # A response without a route is taken as the final answer
+            agent_data=self.decider.from_text(ai_message.content)
         thought=agent_data.get('Thought')
         route=agent_data.get('Route')
         if self.verbose:
             print(colored(f'Thought: {thought}',color='light_magenta',attrs=['bold']))
         return {**state,'messages':[ai_message],'agent_data': agent_data,'route':route}
 
-    def action(self,state:AgentState):
+    async def action(self,state:AgentState):
         agent_data=state.get('agent_data')
         thought=agent_data.get('Thought')
         action_name=agent_data.get('Action Name')
@@ -66,7 +88,7 @@ class SystemAgent(BaseAgent):
         if self.verbose:
             print(colored(f'Action Name: {action_name}',color='blue',attrs=['bold']))
             print(colored(f'Action Input: {action_input}',color='blue',attrs=['bold']))
-        action_result=self.registry.execute(name=action_name,input=action_input,desktop=self.desktop)
+        action_result=await self.desktop.run(self.registry.execute,name=action_name,input=action_input,desktop=self.desktop)
         observation=action_result.content
         if self.verbose:
             print(colored(f'Observation: {observation}',color='green',attrs=['bold']))
@@ -75,13 +97,22 @@ class SystemAgent(BaseAgent):
         if isinstance(last_message,(ImageMessage,HumanMessage)):
             state['messages'][-1]=HumanMessage(f'<Observation>{state.get('prev_observation')}</Observation>')
         if self.verbose and self.token_usage:
-            print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total}')
-        desktop_state=self.desktop.get_state(use_vision=self.use_vision)
+            print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total} Cached Tokens: {self.llm.tokens.cached}')
+            run=default_collector.rollup(default_collector.filter(run=current_run()))
+            print(f'Run Tokens: {run.total_tokens} Calls: {run.calls} Cost: ${run.cost:.4f}')
+        # Wait for the screen to settle after the action
+        record=await self.desktop.run(self.desktop.settle)
+        if self.verbose:
+            print(colored(f'Settled in {record.waited:.2f}s'+(' (timed out)' if record.timed_out else ''),color='yellow'))
+        desktop_state=await self.desktop.run(self.desktop.get_state,use_vision=self.use_vision)
         image_obj=desktop_state.screenshot
         # print(desktop_state.tree_state.elements_to_string())
         ai_prompt=self.action_prompt.format(thought=thought,action_name=action_name,action_input=json.dumps(action_input,indent=2),route=route)
-        user_prompt=self.observation_prompt.format(observation=observation,active_app=desktop_state.active_app,apps=desktop_state.apps_to_string(),interactive_elements=desktop_state.tree_state.elements_to_string())
-        messages=[AIMessage(ai_prompt),ImageMessage(text=user_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(user_prompt)]
+        encoding=desktop_state.tree_state.encode(self.encoder)
+        if self.verbose and self.token_usage:
+            print(f'Observation Tokens: {encoding.tokens} Elements: {encoding.shown} Omitted: {encoding.omitted}')
+        user_prompt=self.observation_prompt.format(observation=observation,active_app=desktop_state.active_app,apps=desktop_state.apps_to_string(),interactive_elements=encoding.text)
+        messages=[AIMessage(ai_prompt),self.desktop.screenshot_pipeline.to_message(user_prompt,image_obj) if self.use_vision else HumanMessage(user_prompt)]
         return {**state,'agent_data':agent_data,'messages':messages,'prev_observation':observation}
 
     def final(self,state:AgentState):
@@ -122,36 +153,59 @@ class SystemAgent(BaseAgent):
 
         return graph.compile(debug=False)
 
-    def invoke(self,input:str):
-        if self.verbose:
-            print(f'Entering '+colored(self.name,'black','on_white'))
+    async def initial_state(self,input:str)->AgentState:
         system_prompt=self.system_prompt.format(**{
             'instructions':self.instructions,
-            'current_datetime':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'actions_prompt':self.registry.actions_prompt(),
+            'elements_format':self.encoder.format_prompt(),
             'os':platform.system(),
             'home_dir':Path.home().as_posix(),
             'user':getuser()
         })
-        # Attach episodic memory to the system prompt 
-        if self.episodic_memory and self.episodic_memory.retrieve(input):
+        system_prompt+=self.decider.prompt
+        # Attach episodic memory to the system prompt, the retrieval makes blocking embedding and llm requests so it runs off the shared loop
+        if self.episodic_memory and await asyncio.to_thread(self.episodic_memory.retrieve,input):
             system_prompt=self.episodic_memory.attach_memory(system_prompt)
-        desktop_state=self.desktop.get_state(use_vision=self.use_vision)
+        # A new task starts without a previous screenshot to compare with
+        self.desktop.screenshot_pipeline.reset()
+        desktop_state=await self.desktop.run(self.desktop.get_state,use_vision=self.use_vision)
         image_obj=desktop_state.screenshot
-        interactive_elements=desktop_state.tree_state.elements_to_string()
+        interactive_elements=desktop_state.tree_state.encode(self.encoder).text
         apps=desktop_state.apps_to_string()
         active_app=desktop_state.active_app
         human_prompt=self.observation_prompt.format(observation="No Action",active_app=active_app,apps=apps,interactive_elements=interactive_elements)
-        messages=[SystemMessage(system_prompt),HumanMessage(f'Task: {input}')]+[ImageMessage(text=human_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(human_prompt)]
-        state={
+        # The time goes with the task, so the system prompt stays the same from task to task for the prompt caches
+        current_datetime=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        messages=[SystemMessage(system_prompt),HumanMessage(f'Task: {input}\nCurrent date and time: {current_datetime}')]+[self.desktop.screenshot_pipeline.to_message(human_prompt,image_obj) if self.use_vision else HumanMessage(human_prompt)]
+        return {
             'input':input,
             'agent_data':{},
             'route':'',
             'output':'',
             'messages':messages
         }
-        graph_response=self.graph.invoke(state)
+
+    async def async_invoke(self,input:str):
+        self.iteration=0
+        with scope(agent=self.name):
+            state=await self.initial_state(input)
+            graph_response=await self.graph.ainvoke(state)
         return graph_response.get('output')
 
-    def stream(self,input:str):
-        pass
\ No newline at end of file
+    def invoke(self,input:str):
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        return default_loop.run(self.async_invoke(input))
+
+    async def async_stream(self,input:str)->AsyncGenerator[dict,None]:
+        '''Yield the update of each node of the graph as it finishes'''
+        self.iteration=0
+        with scope(agent=self.name):
+            state=await self.initial_state(input)
+            async for chunk in self.graph.astream(state,stream_mode='updates'):
+                yield chunk
+
+    def stream(self,input:str)->Generator[dict,None,None]:
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        yield from default_loop.iterate(self.async_stream(input))
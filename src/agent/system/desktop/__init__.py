@@ -1,27 +1,75 @@
 from src.agent.system.desktop.views import DesktopState,App
 from src.agent.system.tree import Tree,TreeElementNode
+from src.agent.screenshot import ScreenshotPipeline,ScreenshotConfig,perceptual_hash,hamming_distance
+from src.agent.system.desktop.config import DesktopConfig
+from src.agent.settle import SettleRecord
+from time import perf_counter,sleep
 from pygetwindow import getActiveWindow
-from uiautomation import GetRootControl
+from uiautomation import GetRootControl,InitializeUIAutomationInCurrentThread
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
 from os import getcwd
 import pyautogui
+import asyncio
+
+# UI Automation is bound to the thread that initialized it and there is a single screen,
+# so every desktop call of the async agents goes through this one worker
+executor=ThreadPoolExecutor(max_workers=1,thread_name_prefix='desktop',initializer=InitializeUIAutomationInCurrentThread)
 
 class Desktop:
-    def __init__(self):
+    def __init__(self,config:DesktopConfig=None,screenshot_config:ScreenshotConfig=None):
+        self.config=config if config else DesktopConfig()
         self.desktop_state=None
+        self.screenshot_pipeline=ScreenshotPipeline(screenshot_config)
+        # Time waited for the screen to settle at each step
+        self.settle_records:list[SettleRecord]=[]
+        pyautogui.PAUSE=self.config.pause
+
+    async def run(self,function,*args,**kwargs):
+        '''Run a blocking desktop call on the desktop worker without blocking the event loop.'''
+        loop=asyncio.get_running_loop()
+        return await loop.run_in_executor(executor,partial(function,*args,**kwargs))
+
     def get_state(self,use_vision:bool=False):
         tree=Tree(self)
         active_window=getActiveWindow()
         active_app=active_window.title
+        region=(active_window.left,active_window.top,active_window.right,active_window.bottom)
         windows=self.get_windows_in_z_order()
         apps=[App(name=window.Name,depth=depth,is_maximized=window.IsMaximize(),is_minimized=window.IsMinimize()) for depth,window in enumerate(windows) if window.ControlType in ['WindowControl','PaneControl'] and window.Name!=active_app]
-        screenshot,tree_state=tree.get_state(use_vision=use_vision)
+        screenshot,tree_state=tree.get_state(use_vision=use_vision,region=region)
         self.desktop_state=DesktopState(active_app=active_app,apps=apps,screenshot=screenshot,tree_state=tree_state)
         return self.desktop_state
     
+    def settle(self)->SettleRecord:
+        '''Wait until the screen stops changing after an action, bounded by the limits of the config.'''
+        config=self.config
+        start=perf_counter()
+        previous=None
+        stable_since=None
+        timed_out=False
+        while True:
+            hash=perceptual_hash(self.get_screenshot())
+            now=perf_counter()
+            if previous is not None and hamming_distance(previous,hash)<=1:
+                stable_since=stable_since if stable_since is not None else now
+            else:
+                stable_since=None
+            previous=hash
+            if stable_since is not None and now-stable_since>=config.stable_time and now-start>=config.minimum_wait:
+                break
+            if now-start>=config.maximum_wait:
+                timed_out=True
+                break
+            sleep(config.poll_interval)
+        record=SettleRecord(waited=perf_counter()-start,signals=['screen'],timed_out=timed_out)
+        self.settle_records.append(record)
+        return record
+
     def get_windows_in_z_order(self):
         return [w for w in GetRootControl().GetChildren()]
     
@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+
+@dataclass
+class DesktopConfig:
+    # Pause after every pyautogui call (in seconds)
+    pause:float=0.1
+    # Interval between the keystrokes of the type tool (in seconds)
+    typing_interval:float=0
+    # Bounds of the wait for the screen to settle after an action (in seconds)
+    minimum_wait:float=0.1
+    maximum_wait:float=3
+    # How long the screen must stay the same for it to be settled (in seconds)
+    stable_time:float=0.3
+    poll_interval:float=0.1
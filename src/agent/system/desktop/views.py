@@ -1,4 +1,5 @@
 from src.agent.system.tree.views import TreeState
+from src.agent.screenshot.views import Screenshot
 from dataclasses import dataclass
 
 @dataclass
@@ -12,7 +13,7 @@ class App:
 class DesktopState:
     active_app:str
     apps:list[App]
-    screenshot:bytes|None
+    screenshot:Screenshot|None
     tree_state:TreeState
 
     def apps_to_string(self):
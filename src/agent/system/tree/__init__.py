@@ -1,4 +1,5 @@
 from src.agent.system.tree.views import TreeElementNode,BoundingBox,CenterCord,TreeState
+from src.agent.screenshot.views import Screenshot
 from uiautomation import GetRootControl,Control,ControlFromPoint
 from src.agent.system.tree.config import INTERACTIVE_CONTROL_TYPE_NAMES
 from PIL import Image,ImageDraw,ImageFont
@@ -12,12 +13,16 @@ class Tree:
     def __init__(self,desktop:'Desktop'):
         self.desktop=desktop
 
-    def get_state(self,use_vision:bool=False)->tuple[bytes,TreeState]:
+    def get_state(self,use_vision:bool=False,region:tuple[int,int,int,int]|None=None)->tuple[Screenshot|None,TreeState]:
         root=GetRootControl()
         nodes=self.get_interactive_nodes(node=root)
         if use_vision:
-            annotate=self.annotate(nodes=nodes,save_screenshot=False)
-            screenshot=self.desktop.screenshot_in_bytes(screenshot=annotate)
+            padding=20
+            annotate=self.annotate(nodes=nodes,save_screenshot=False,padding=padding)
+            # Shift the region of interest into the padded screenshot
+            if region is not None:
+                region=tuple(value+padding for value in region)
+            screenshot=self.desktop.screenshot_pipeline.process(annotate,region=region)
         else:
             screenshot=None
         selector_map=self.build_selector_map(nodes=nodes)
@@ -71,10 +76,9 @@ class Tree:
     def get_random_color(self):
         return "#{:06x}".format(random.randint(0, 0xFFFFFF))
 
-    def annotate(self,nodes:list[TreeElementNode],save_screenshot:bool=False)->Image:
+    def annotate(self,nodes:list[TreeElementNode],save_screenshot:bool=False,padding:int=20)->Image:
         screenshot=self.desktop.get_screenshot()
         # Include padding to the screenshot
-        padding=20
         width=screenshot.width+(2*padding)
         height=screenshot.height+(2*padding)
         padded_screenshot=Image.new("RGB", (width, height), color=(255, 255, 255))
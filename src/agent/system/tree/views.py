@@ -1,14 +1,25 @@
 from dataclasses import dataclass,field
+from src.agent.encoder.views import Element,Encoding
 from uiautomation import Control
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.agent.encoder import BaseEncoder
 
 @dataclass
 class TreeState:
-    nodes:list['TreeElementNode']=field(default_factory=[])
-    selector_map:dict[int,'TreeElementNode']=field(default_factory={})
+    nodes:list['TreeElementNode']=field(default_factory=list)
+    selector_map:dict[int,'TreeElementNode']=field(default_factory=dict)
 
     def elements_to_string(self)->str:
         return '\n'.join([f'Label: {index} - ControlType: {node.control_type} Name: {node.name}' for index,node in enumerate(self.nodes)])
 
+    def to_elements(self)->list[Element]:
+        return [Element(index=index,kind=node.control_type.removesuffix('Control'),name=node.name,attributes={'shortcut':node.shortcut} if node.shortcut else {}) for index,node in enumerate(self.nodes)]
+
+    def encode(self,encoder:'BaseEncoder')->Encoding:
+        return encoder.encode(self.to_elements())
+
 @dataclass
 class BoundingBox:
     left:int
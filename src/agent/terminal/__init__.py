@@ -4,15 +4,21 @@ from src.agent.terminal.registry import Registry
 from langgraph.graph import StateGraph,START,END
 from src.agent.terminal.tools import shell_tool
 from src.agent.terminal.state import AgentState
+from src.agent.stream import StreamParser
+from src.agent.decision import Decider,ActionMode
 from src.memory.episodic import EpisodicMemory
+from src.agent.loop import default_loop
+from src.metrics import scope,current_run,default_collector
 from src.inference import BaseInference
 from src.agent import BaseAgent
+from typing import Generator,AsyncGenerator
 from termcolor import colored
 from platform import platform
 from datetime import datetime
 from getpass import getuser
 from src.tool import Tool
 from pathlib import Path
+import asyncio
 import json
 
 tools=[
@@ -20,15 +26,18 @@ tools=[
 ]
 
 class TerminalAgent(BaseAgent):
-    def __init__(self,instructions:list[str]=[],episodic_memory:EpisodicMemory=None,additional_tools:list[Tool]=[],llm:BaseInference=None,verbose:bool=False,max_iteration:int=10,token_usage:bool=False):
+    def __init__(self,instructions:list[str]=[],episodic_memory:EpisodicMemory=None,additional_tools:list[Tool]=[],llm:BaseInference=None,verbose:bool=False,max_iteration:int=10,token_usage:bool=False,streaming:bool=False,action_mode:ActionMode='text'):
         self.name='Terminal Agent'
         self.description='The Terminal Agent is an AI-powered automation tool designed to interact with the terminal. It simulates human actions, such as running shell commands, executing scripts, and performing other terminal-level tasks.'
-        self.llm=llm
         self.verbose=verbose
         self.max_iteration=max_iteration
         self.iteration=0
         self.instructions=self.format_instructions(instructions)
         self.registry=Registry(tools+additional_tools)
+        self.action_mode=action_mode
+        self.decider=Decider(llm,self.registry.actions,action_mode,extract_agent_data)
+        # With native tool calling the tools are bound to a copy of the llm
+        self.llm=self.decider.llm
         self.system_prompt=read_markdown_file('./src/agent/terminal/prompt/system.md')
         self.observation_prompt=read_markdown_file('./src/agent/terminal/prompt/observation.md')
         self.action_prompt=read_markdown_file('./src/agent/terminal/prompt/action.md')
@@ -36,21 +45,31 @@ class TerminalAgent(BaseAgent):
         self.graph=self.create_graph()
         self.episodic_memory=episodic_memory
         self.token_usage=token_usage
+        self.streaming=streaming
 
     def format_instructions(self,instructions):
         return '\n'.join([f'{i+1}. {instruction}' for (i,instruction) in enumerate(instructions)])
 
-    def reason(self,state:AgentState):
-        llm_response=self.llm.invoke(state.get('messages'))
-        # print(llm_response.content)
-        agent_data=extract_agent_data(llm_response.content)
+    async def reason(self,state:AgentState):
+        if self.action_mode!='text':
+            # The step comes back structured, there are no tags to stop a stream at
+            llm_response,agent_data=await self.decider.async_decide(state.get('messages'))
+        elif self.streaming:
+            # Stop the generation as soon as the action is known
+            parser=StreamParser(stop_tags={'Action-Input':'Action','Final-Answer':'Final'})
+            llm_response=AIMessage(await parser.async_consume(self.llm.async_stream(state.get('messages'))))
+            agent_data=self.decider.from_text(llm_response.content,parser.route)
+        else:
+            llm_response=await self.llm.async_invoke(state.get('messages'))
+            # A response without a route is taken as the final answer
+            agent_data=self.decider.from_text(llm_response.content)
         thought=agent_data.get('Thought')
         route=agent_data.get('Route')
         if self.verbose:
             print(colored(f'Thought: {thought}',color='light_magenta',attrs=['bold']))
-        return {**state,'agent_data': agent_data,'route':route}
+        return {**state,'agent_data': agent_data,'messages':[llm_response],'route':route}
 
-    def action(self,state:AgentState):
+    async def action(self,state:AgentState):
         agent_data=state.get('agent_data')
         thought=agent_data.get('Thought')
         action_name=agent_data.get('Action Name')
@@ -59,12 +78,15 @@ class TerminalAgent(BaseAgent):
         if self.verbose:
             print(colored(f'Action Name: {action_name}',color='blue',attrs=['bold']))
             print(colored(f'Action Input: {action_input}',color='blue',attrs=['bold']))
-        action_result=self.registry.execute(name=action_name,params=action_input)
+        # The shell commands block, so they run in a worker thread to keep the loop free
+        action_result=await asyncio.to_thread(self.registry.execute,name=action_name,params=action_input)
         observation=action_result.content
         if self.verbose:
             print(colored(f'Observation: {observation}',color='green',attrs=['bold']))
         if self.verbose and self.token_usage:
-            print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total}')
+            print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total} Cached Tokens: {self.llm.tokens.cached}')
+            run=default_collector.rollup(default_collector.filter(run=current_run()))
+            print(f'Run Tokens: {run.total_tokens} Calls: {run.calls} Cost: ${run.cost:.4f}')
         # Delete the last message
         state.get('messages').pop()
         action_prompt=self.action_prompt.format(thought=thought,action_name=action_name,action_input=json.dumps(action_input,indent=2),route=route)
@@ -107,35 +129,59 @@ class TerminalAgent(BaseAgent):
 
         return workflow.compile(debug=False)
 
-    def invoke(self,input:str):
-        if self.verbose:
-            print(f'Entering '+colored(self.name,'black','on_white'))
+    async def initial_state(self,input:str)->AgentState:
         parameters={
             'instructions':self.instructions,
-            'current_datetime':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'actions_prompt':self.registry.actions_prompt(),
             'os':platform(),
             'home_dir':Path.home().as_posix(),
             'user':getuser(),
         }
         system_prompt=self.system_prompt.format(**parameters)
-        # Attach episodic memory to the system prompt 
-        if self.episodic_memory and self.episodic_memory.retrieve(input):
+        system_prompt+=self.decider.prompt
+        # Attach episodic memory to the system prompt, the retrieval makes blocking embedding and llm requests so it runs off the shared loop
+        if self.episodic_memory and await asyncio.to_thread(self.episodic_memory.retrieve,input):
             system_prompt=self.episodic_memory.attach_memory(system_prompt)
-        human_prompt=f'Task: {input}'
-        state={
+        # The time goes with the task, so the system prompt stays the same from task to task for the prompt caches
+        human_prompt=f'Task: {input}\nCurrent date and time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
+        return {
             'input':input,
             'messages':[SystemMessage(system_prompt),HumanMessage(human_prompt)],
             'agent_data':{},
-            'router':'',
+            'route':'',
             'output':''
         }
-        response=self.graph.invoke(state)
-        # Extract and store the key takeaways of the task performed by the agent
-        if self.episodic_memory:
-            self.episodic_memory.store(response.get('messages'))
+
+    async def async_invoke(self,input:str):
+        self.iteration=0
+        with scope(agent=self.name):
+            state=await self.initial_state(input)
+            response=await self.graph.ainvoke(state)
+            # Queue the task for the memory to extract its key takeaways, off the path of the answer
+            if self.episodic_memory:
+                await asyncio.to_thread(self.episodic_memory.submit,response.get('messages'),self.iteration<self.max_iteration)
         return response.get('output')
 
-    def stream(self,input:str):
-        pass
-        
\ No newline at end of file
+    def invoke(self,input:str):
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        return default_loop.run(self.async_invoke(input))
+
+    async def async_stream(self,input:str)->AsyncGenerator[dict,None]:
+        '''Yield the update of each node of the graph as it finishes'''
+        self.iteration=0
+        with scope(agent=self.name):
+            state=await self.initial_state(input)
+            async for mode,chunk in self.graph.astream(state,stream_mode=['updates','values']):
+                if mode=='updates':
+                    yield chunk
+                else:
+                    state=chunk
+            # Queue the task for the memory to extract its key takeaways, off the path of the answer
+            if self.episodic_memory:
+                await asyncio.to_thread(self.episodic_memory.submit,state.get('messages'),self.iteration<self.max_iteration)
+
+    def stream(self,input:str)->Generator[dict,None,None]:
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        yield from default_loop.iterate(self.async_stream(input))
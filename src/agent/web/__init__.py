@@ -2,17 +2,25 @@ from src.agent.web.tools import click_tool,goto_tool,type_tool,scroll_tool,wait_
 from src.message import SystemMessage,HumanMessage,ImageMessage,AIMessage
 from src.agent.web.utils import read_markdown_file,extract_agent_data
 from src.agent.web.browser import Browser,BrowserConfig
+from src.agent.web.browser.pool import BrowserPool,default_pool
+from src.agent.loop import default_loop
+from src.metrics import scope,current_run,default_collector
 from src.agent.web.context import Context,ContextConfig
 from langgraph.graph import StateGraph,END,START
 from src.memory.episodic import EpisodicMemory
 from src.agent.web.registry import Registry
 from src.agent.web.state import AgentState
+from src.agent.stream import StreamParser
+from src.agent.decision import Decider,ActionMode
+from src.agent.encoder import BaseEncoder,CompactEncoder
+from src.agent.screenshot.config import ScreenshotConfig
 from src.inference import BaseInference
+from typing import Generator,AsyncGenerator
 from src.agent import BaseAgent
+from dataclasses import replace
 from datetime import datetime
 from termcolor import colored
 from src.tool import Tool
-import nest_asyncio
 import asyncio
 import json
 
@@ -22,7 +30,7 @@ main_tools=[
 ]
 
 class WebAgent(BaseAgent):
-    def __init__(self,config:BrowserConfig=None,additional_tools:list[Tool]=[],instructions:list=[],episodic_memory:EpisodicMemory=None,llm:BaseInference=None,max_iteration:int=10,use_vision:bool=False,verbose:bool=False,token_usage:bool=False) -> None:
+    def __init__(self,config:BrowserConfig=None,additional_tools:list[Tool]=[],instructions:list=[],episodic_memory:EpisodicMemory=None,llm:BaseInference=None,max_iteration:int=10,use_vision:bool=False,verbose:bool=False,token_usage:bool=False,streaming:bool=False,encoder:BaseEncoder=None,screenshot_config:ScreenshotConfig=None,pool:BrowserPool=None,action_mode:ActionMode='text',context_config:ContextConfig=None) -> None:
         self.name='Web Agent'
         self.description='The web agent is designed to automate the process of gathering information from the internet, such as to navigate websites, perform searches, and retrieve data.'
         self.observation_prompt=read_markdown_file('./src/agent/web/prompt/observation.md')
@@ -31,15 +39,26 @@ class WebAgent(BaseAgent):
         self.answer_prompt=read_markdown_file('./src/agent/web/prompt/answer.md')
         self.instructions=self.format_instructions(instructions)
         self.registry=Registry(main_tools+additional_tools)
-        self.browser=Browser(config=config)
-        self.context=Context(self.browser,ContextConfig())
+        self.action_mode=action_mode
+        self.decider=Decider(llm,self.registry.actions,action_mode,extract_agent_data)
+        # With native tool calling the tools are bound to a copy of the llm
+        self.llm=self.decider.llm
+        self.config=config if config else BrowserConfig()
+        context_config=context_config if context_config else ContextConfig()
+        # The images, fonts and media are only blocked when the agent doesn't look at the page
+        self.context_config=replace(context_config,screenshot=screenshot_config if screenshot_config else context_config.screenshot,use_vision=use_vision)
+        self.pool=pool if pool else default_pool
+        # Leased from the pool for the duration of a task
+        self.browser:Browser=None
+        self.context:Context=None
         self.episodic_memory=episodic_memory
+        self.encoder=encoder if encoder else CompactEncoder()
         self.max_iteration=max_iteration
         self.token_usage=token_usage
         self.use_vision=use_vision
+        self.streaming=streaming
         self.verbose=verbose
         self.iteration=0
-        self.llm=llm
         self.graph=self.create_graph()
 
     def format_instructions(self,instructions):
@@ -47,9 +66,18 @@ class WebAgent(BaseAgent):
 
     async def reason(self,state:AgentState):
         "Call LLM to make decision"
-        ai_message=await self.llm.async_invoke(state.get('messages'))
-        # print(ai_message.content)
-        agent_data=extract_agent_data(ai_message.content)
+        if self.action_mode!='text':
+            # The step comes back structured, there are no tags to stop a stream at
+            ai_message,agent_data=await self.decider.async_decide(state.get('messages'))
+        elif self.streaming:
+            # Stop the generation as soon as the action is known
+            parser=StreamParser(stop_tags={'Action-Input':'Action','Final-Answer':'Final'})
+            ai_message=AIMessage(await parser.async_consume(self.llm.async_stream(state.get('messages'))))
+            agent_data=self.decider.from_text(ai_message.content,parser.route)
+        else:
+            ai_message=await self.llm.async_invoke(state.get('messages'))
+            # A response without a route is taken as the final answer
+            agent_data=self.decider.from_text(ai_message.content)
         thought=agent_data.get('Thought')
         route=agent_data.get('Route')
         if self.verbose:
@@ -76,15 +104,23 @@ class WebAgent(BaseAgent):
         if isinstance(last_message,(ImageMessage,HumanMessage)):
             state['messages'][-1]=HumanMessage(f'<Observation>{state.get('prev_observation')}</Observation>')
         if self.verbose and self.token_usage:
-            print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total}')
+            print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total} Cached Tokens: {self.llm.tokens.cached}')
+            run=default_collector.rollup(default_collector.filter(run=current_run()))
+            print(f'Run Tokens: {run.total_tokens} Calls: {run.calls} Cost: ${run.cost:.4f}')
         # Get the current browser state
         browser_state=await self.context.get_state(use_vision=self.use_vision)
         image_obj=browser_state.screenshot
+        if self.verbose:
+            record=self.context.settle_records[-1]
+            print(colored(f'Settled in {record.waited:.2f}s'+(' (timed out)' if record.timed_out else ''),color='yellow'))
         # print('Tabs',browser_state.tabs_to_string())
         # Redefining the AIMessage and adding the new observation
         action_prompt=self.action_prompt.format(thought=thought,action_name=action_name,action_input=json.dumps(action_input,indent=2),route=route)
-        observation_prompt=self.observation_prompt.format(observation=observation,current_url=browser_state.url,tabs=browser_state.tabs_to_string(),interactive_elements=browser_state.dom_state.elements_to_string())
-        messages=[AIMessage(action_prompt),ImageMessage(text=observation_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(observation_prompt)]
+        encoding=browser_state.dom_state.encode(self.encoder)
+        if self.verbose and self.token_usage:
+            print(f'Observation Tokens: {encoding.tokens} Elements: {encoding.shown} Omitted: {encoding.omitted}')
+        observation_prompt=self.observation_prompt.format(observation=observation,current_url=browser_state.url,tabs=browser_state.tabs_to_string(),interactive_elements=encoding.text)
+        messages=[AIMessage(action_prompt),self.context.screenshot_pipeline.to_message(observation_prompt,image_obj) if self.use_vision else HumanMessage(observation_prompt)]
         return {**state,'agent_data':agent_data,'messages':messages,'prev_observation':observation}
 
     def final(self,state:AgentState):
@@ -128,55 +164,82 @@ class WebAgent(BaseAgent):
 
         return graph.compile(debug=False)
     
-    async def async_invoke(self, input: str):
+    async def initial_state(self, input: str)->AgentState:
         actions_prompt=self.registry.actions_prompt()
         current_datetime=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         system_prompt=self.system_prompt.format(**{
             'instructions':self.instructions,
-            'current_datetime':current_datetime,
-            'actions_prompt':actions_prompt
+            'actions_prompt':actions_prompt,
+            'elements_format':self.encoder.format_prompt()
         })
-        # Attach episodic memory to the system prompt 
-        if self.episodic_memory and self.episodic_memory.retrieve(input):
+        system_prompt+=self.decider.prompt
+        # Attach episodic memory to the system prompt, the retrieval makes blocking embedding and llm requests so it runs off the shared loop
+        if self.episodic_memory and await asyncio.to_thread(self.episodic_memory.retrieve,input):
             system_prompt=self.episodic_memory.attach_memory(system_prompt)
-        human_prompt=f'Task: {input}'
+        # The time goes with the task, so the system prompt stays the same from task to task for the prompt caches
+        human_prompt=f'Task: {input}\nCurrent date and time: {current_datetime}'
         messages=[SystemMessage(system_prompt),HumanMessage(human_prompt)]
-        state={
+        return {
             'input':input,
             'agent_data':{},
             'output':'',
             'route':'',
             'messages':messages
         }
-        response=await self.graph.ainvoke(state)
-        await self.close()
-        # Extract and store the key takeaways of the task performed by the agent
-        if self.episodic_memory:
-            self.episodic_memory.store(response.get('messages'))
+
+    async def async_invoke(self, input: str):
+        with scope(agent=self.name):
+            await self.open()
+            try:
+                state=await self.initial_state(input)
+                response=await self.graph.ainvoke(state)
+            finally:
+                await self.close()
+            # Queue the task for the memory to extract its key takeaways, off the path of the answer
+            if self.episodic_memory:
+                await asyncio.to_thread(self.episodic_memory.submit,response.get('messages'),self.iteration<self.max_iteration)
         return response.get('output')
         
     def invoke(self, input: str)->str:
         if self.verbose:
             print(f'Entering '+colored(self.name,'black','on_white'))
-        try:
-            # If there's no running event loop, use asyncio.run
-            return asyncio.run(self.async_invoke(input))
-        except RuntimeError:
-            nest_asyncio.apply()  # Allow nested event loops in notebooks
-            loop = asyncio.get_event_loop()
-            return loop.run_until_complete(self.async_invoke(input))
+        # Run on the shared loop, so the pooled browser outlives this call
+        return default_loop.run(self.async_invoke(input))
 
-    def stream(self, input:str):
-        pass
+    async def async_stream(self, input:str)->AsyncGenerator[dict,None]:
+        '''Yield the update of each node of the graph as it finishes'''
+        with scope(agent=self.name):
+            await self.open()
+            try:
+                state=await self.initial_state(input)
+                async for mode,chunk in self.graph.astream(state,stream_mode=['updates','values']):
+                    if mode=='updates':
+                        yield chunk
+                    else:
+                        state=chunk
+            finally:
+                await self.close()
+            # Queue the task for the memory to extract its key takeaways, off the path of the answer
+            if self.episodic_memory:
+                await asyncio.to_thread(self.episodic_memory.submit,state.get('messages'),self.iteration<self.max_iteration)
+
+    def stream(self, input:str)->Generator[dict,None,None]:
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        yield from default_loop.iterate(self.async_stream(input))
+
+    async def open(self):
+        '''Lease a warm browser context from the pool'''
+        self.iteration=0
+        self.context=await self.pool.lease(self.config,self.context_config)
+        self.browser=self.context.browser
 
     async def close(self):
-        '''Close the browser and context followed by clean up'''
+        '''Return the browser context to the pool followed by clean up'''
         try:
-            await self.context.close_session()
-            await self.browser.close_browser()
+            await self.pool.release(self.context)
         except Exception as e:
             print('Failed to finish clean up')
         finally:
             self.context=None
             self.browser=None
-
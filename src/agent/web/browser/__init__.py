@@ -23,7 +23,8 @@ class Browser:
         self.playwright_browser = await self.setup_browser(self.config.browser)
     
     async def get_playwright_browser(self)->PlaywrightBrowser:
-        if self.playwright_browser is None:
+        # The browser stays None for a persistent context, so playwright tells whether it was initialized
+        if self.playwright is None:
             await self.init_browser()
         return self.playwright_browser
 
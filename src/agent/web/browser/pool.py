@@ -0,0 +1,197 @@
+from src.agent.web.context import Context,ContextConfig
+from src.agent.web.browser import Browser,BrowserConfig
+from src.agent.loop import default_loop
+from dataclasses import dataclass,field
+from weakref import WeakKeyDictionary
+from time import monotonic
+import logging
+import asyncio
+
+logger=logging.getLogger(__name__)
+
+@dataclass
+class Slot:
+    '''Warm contexts of one browser and context configuration.'''
+    browser:Browser
+    context_config:ContextConfig
+    # A persistent context (user data directory) can't be opened twice, so it is leased exclusively
+    persistent:bool
+    idle:list[tuple[Context,float]]=field(default_factory=list)
+    leased:int=0
+    last_used:float=field(default_factory=monotonic)
+    semaphore:asyncio.Semaphore=None
+
+class BrowserPool:
+    '''
+    Process-wide pool of browsers and warm contexts leased to the web agents.
+
+    A leased context has its session initialized (init script added, page opened). On release it is replaced
+    by a fresh one and kept warm for the next lease, so the browser isn't launched again for every delegation.
+    Playwright objects are bound to the event loop they were created on, hence a pool is kept per loop.
+    The browsers of a loop are closed when it shuts down (`default_loop` stopping, or `asyncio.run` returning),
+    `await pool.close()` closes them earlier from the loop they run on.
+    '''
+    def __init__(self,min_idle:int=1,max_idle:int=4,idle_timeout:float=300,health_check_timeout:float=5):
+        self.min_idle=min_idle
+        self.max_idle=max_idle
+        self.idle_timeout=idle_timeout
+        self.health_check_timeout=health_check_timeout
+        self.slots:WeakKeyDictionary[asyncio.AbstractEventLoop,dict[tuple[str,str],Slot]]=WeakKeyDictionary()
+        self.leases:dict[Context,tuple[str,str]]={}
+        self.reapers:WeakKeyDictionary[asyncio.AbstractEventLoop,asyncio.Task]=WeakKeyDictionary()
+        # The event loop only keeps weak references to its tasks
+        self.tasks:set[asyncio.Task]=set()
+        default_loop.on_shutdown(self.close)
+
+    def get_slot(self,config:BrowserConfig,context_config:ContextConfig)->tuple[tuple[str,str],Slot]:
+        loop=asyncio.get_running_loop()
+        slots=self.slots.setdefault(loop,{})
+        key=(repr(config),repr(context_config))
+        if key not in slots:
+            # Contexts of different configurations share the browser of the same configuration
+            browser=next((slot.browser for (browser_key,_),slot in slots.items() if browser_key==key[0]),None) or Browser(config=config)
+            persistent=config.wss_url is None and config.user_data_dir is not None
+            slots[key]=Slot(browser=browser,context_config=context_config,persistent=persistent,semaphore=asyncio.Semaphore(1) if persistent else None)
+        if loop not in self.reapers:
+            self.reapers[loop]=loop.create_task(self.reap())
+        return key,slots[key]
+
+    async def lease(self,config:BrowserConfig=None,context_config:ContextConfig=None)->Context:
+        '''Get a context with an initialized session, warm if one is available.'''
+        config=config if config else BrowserConfig()
+        context_config=context_config if context_config else ContextConfig()
+        key,slot=self.get_slot(config,context_config)
+        if slot.semaphore:
+            await slot.semaphore.acquire()
+        try:
+            context=None
+            while slot.idle and context is None:
+                candidate,_=slot.idle.pop()
+                if await self.is_healthy(candidate):
+                    context=candidate
+                else:
+                    await self.discard(candidate)
+            if context is None:
+                context=Context(slot.browser,slot.context_config)
+                await context.init_session()
+        except BaseException:
+            if slot.semaphore:
+                slot.semaphore.release()
+            raise
+        slot.leased+=1
+        slot.last_used=monotonic()
+        self.leases[context]=key
+        if not slot.persistent and len(slot.idle)<self.min_idle:
+            task=asyncio.get_running_loop().create_task(self.warm(config,context_config,self.min_idle))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return context
+
+    async def release(self,context:Context):
+        '''Return a leased context, it is reset and kept warm unless it is unhealthy or the pool is full.'''
+        key=self.leases.pop(context,None)
+        slots=self.slots.get(asyncio.get_running_loop(),{})
+        slot=slots.get(key)
+        if slot is None:
+            # Not leased from this pool
+            await context.close_session()
+            return
+        slot.leased-=1
+        slot.last_used=monotonic()
+        try:
+            if len(slot.idle)<self.max_idle and await self.is_healthy(context):
+                await context.reset_session()
+                slot.idle.append((context,monotonic()))
+            else:
+                await self.discard(context)
+        except Exception:
+            await self.discard(context)
+        finally:
+            if slot.semaphore:
+                slot.semaphore.release()
+
+    async def warm(self,config:BrowserConfig=None,context_config:ContextConfig=None,count:int=1):
+        '''Pre-initialize contexts so the next leases don't wait for the browser to start.'''
+        config=config if config else BrowserConfig()
+        context_config=context_config if context_config else ContextConfig()
+        _,slot=self.get_slot(config,context_config)
+        if slot.persistent:
+            count=0 if slot.leased else min(count,1)
+        while len(slot.idle)<count:
+            context=Context(slot.browser,slot.context_config)
+            try:
+                await context.init_session()
+            except Exception:
+                logger.exception('Failed to warm up a browser context')
+                return
+            slot.idle.append((context,monotonic()))
+
+    async def is_healthy(self,context:Context)->bool:
+        session=context.session
+        if session is None or session.current_page.is_closed():
+            return False
+        browser=context.browser.playwright_browser
+        if browser is not None and not browser.is_connected():
+            return False
+        try:
+            await asyncio.wait_for(session.current_page.evaluate('1'),timeout=self.health_check_timeout)
+        except Exception:
+            return False
+        return True
+
+    async def discard(self,context:Context):
+        try:
+            await context.close_session()
+        except Exception:
+            pass
+
+    async def evict_idle(self):
+        '''Close the contexts idle for longer than the timeout, and the browsers left without any context.'''
+        now=monotonic()
+        slots=self.slots.get(asyncio.get_running_loop(),{})
+        for slot in slots.values():
+            expired=[context for context,released_at in slot.idle if now-released_at>self.idle_timeout]
+            slot.idle=[(context,released_at) for context,released_at in slot.idle if context not in expired]
+            for context in expired:
+                await self.discard(context)
+        for key in [key for key,slot in slots.items() if not slot.idle and not slot.leased and now-slot.last_used>self.idle_timeout]:
+            slot=slots.pop(key)
+            if not any(other.browser is slot.browser for other in slots.values()):
+                await slot.browser.close_browser()
+
+    async def reap(self):
+        try:
+            while True:
+                await asyncio.sleep(self.idle_timeout/2)
+                try:
+                    await self.evict_idle()
+                except Exception:
+                    logger.exception('Failed to evict idle browser contexts')
+        except asyncio.CancelledError:
+            # Cancelled by `close`, or by `asyncio.run` cancelling the remaining tasks before the loop closes
+            try:
+                await self.close()
+            except Exception:
+                logger.exception('Failed to close the browser pool')
+            raise
+
+    async def close(self):
+        '''Close every context and browser of the current loop.'''
+        loop=asyncio.get_running_loop()
+        reaper=self.reapers.pop(loop,None)
+        current=asyncio.current_task()
+        if reaper and reaper is not current:
+            reaper.cancel()
+        for task in [task for task in self.tasks if task.get_loop() is loop and task is not current]:
+            task.cancel()
+        slots=self.slots.pop(loop,{})
+        browsers=[]
+        for slot in slots.values():
+            for context,_ in slot.idle:
+                await self.discard(context)
+            if slot.browser not in browsers:
+                browsers.append(slot.browser)
+        for browser in browsers:
+            await browser.close_browser()
+
+default_pool=BrowserPool()
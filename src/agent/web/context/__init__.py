@@ -2,7 +2,11 @@ from playwright.async_api import Page,Browser as PlaywrightBrowser, Frame,Elemen
 from src.agent.web.context.views import BrowserSession,BrowserState,Tab
 from src.agent.web.browser.config import BROWSER_ARGS,SECURITY_ARGS
 from src.agent.web.context.config import ContextConfig
-from src.agent.web.dom.views import DOMElementNode
+from src.agent.screenshot import ScreenshotPipeline
+from src.agent.web.context.settle import Settle,NetworkTracker
+from src.agent.web.context.blocker import ResourceBlocker
+from src.agent.settle import SettleRecord
+from src.agent.web.dom.views import DOMElementNode,DOMState
 from src.agent.web.browser import Browser
 from src.agent.web.dom import DOM
 from datetime import datetime
@@ -15,6 +19,13 @@ class Context:
         self.browser=browser
         self.config=config
         self.context_id=str(uuid4())
+        self.screenshot_pipeline=ScreenshotPipeline(config.screenshot)
+        self.network=NetworkTracker()
+        self.settle=Settle(config,self.network)
+        # Counts the requests and bytes saved even when blocking is off, they stay at zero then
+        self.blocker=ResourceBlocker(config)
+        # Time waited for the page to settle at each step
+        self.settle_records:list[SettleRecord]=[]
         self.session:BrowserSession=None
 
     async def __aenter__(self):
@@ -33,8 +44,10 @@ class Context:
             self.browser_context=None
 
     async def init_session(self):
+        self.screenshot_pipeline.reset()
         browser=await self.browser.get_playwright_browser()
         context=await self.setup_context(browser)
+        self.network.attach(context)
         if browser is not None: # The case whether is no user_data provided
             page=await context.new_page()
         else: # The case where the user_data is provided
@@ -42,8 +55,27 @@ class Context:
         state=await self.initial_state(page)
         self.session=BrowserSession(context,page,state)
         
+    async def reset_session(self):
+        '''Bring the session back to a blank page so the context can be reused for another task.'''
+        session=await self.get_session()
+        if self.browser.playwright_browser is not None:
+            # An ephemeral context is replaced by a fresh one, so no cookies, storage or cache leak into the next task
+            await self.close_session()
+            self.network.pending.clear()
+            await self.init_session()
+        else:
+            # The storage of a persistent context belongs to the user profile, a new page still drops the session storage
+            pages=session.context.pages
+            page=await session.context.new_page()
+            for old_page in pages:
+                await old_page.close()
+            session.current_page=page
+            session.state=await self.initial_state(page)
+            self.screenshot_pipeline.reset()
+        self.settle_records.clear()
+
     async def initial_state(self,page:Page):
-        dom_state=[]
+        dom_state=DOMState()
         tabs=[]
         screenshot=None
         state=BrowserState(url=page.url,title=await page.title(),tabs=tabs,screenshot=screenshot,dom_state=dom_state)
@@ -52,7 +84,11 @@ class Context:
     async def update_state(self,use_vision:bool=False):
         page=await self.get_current_page()
         dom=DOM(self)
-        screenshot,dom_state=await dom.get_state(use_vision=use_vision)
+        previous=self.session.state.dom_state
+        if not self.config.incremental_dom:
+            # Only the handles of the previous state are carried over (and disposed)
+            previous=DOMState(handles=previous.handles)
+        screenshot,dom_state=await dom.get_state(use_vision=use_vision,previous=previous)
         # print(dom_state.elements_to_string())
         tabs=await self.get_tabs()
         state=BrowserState(url=page.url,title=await page.title(),tabs=tabs,screenshot=screenshot,dom_state=dom_state)
@@ -60,6 +96,9 @@ class Context:
     
     async def get_state(self,use_vision=False)->BrowserState:
         session=await self.get_session()
+        # Wait for the page to settle after the last action
+        record=await self.settle.wait(session.current_page)
+        self.settle_records.append(record)
         state=await self.update_state(use_vision=use_vision)
         session.state=state
         return session.state
@@ -82,6 +121,11 @@ class Context:
             'bypass_csp':self.config.disable_security,
             'accept_downloads':True
         }
+        if self.config.block_resources:
+            # The requests of service workers bypass the routes
+            parameters['service_workers']='block'
+        if self.config.lite:
+            parameters['reduced_motion']='reduce'
 
         if browser is not None:
            context=await browser.new_context(**parameters)
@@ -109,6 +153,10 @@ class Context:
         with open('./src/agent/web/context/script.js') as f:
             script=f.read()
         await context.add_init_script(script)
+        if self.config.lite:
+            await context.add_init_script(path='./src/agent/web/context/lite.js')
+        if self.config.block_resources:
+            await self.blocker.attach(context)
         return context
     
     async def get_selector_map(self)->dict[int,DOMElementNode]:
@@ -119,7 +167,9 @@ class Context:
         selector_map=await self.get_selector_map()
         if index not in selector_map.keys():
             raise Exception('Index not found')
-        element,handle=selector_map.get(index)
+        session=await self.get_session()
+        element=selector_map.get(index)
+        handle=await DOM(self).get_handle(session.state.dom_state,element)
         return element,handle
     
     async def get_tabs(self)->list[Tab]:
@@ -140,11 +190,11 @@ class Context:
             date_time=datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
             folder_path=Path(getcwd()).joinpath('./screenshots')
             folder_path.mkdir(parents=True,exist_ok=True)
-            path=folder_path.joinpath(f'screenshot_{date_time}.jpeg')
+            path=folder_path.joinpath(f'screenshot_{date_time}.png')
         else:
             path=None
-        await page.wait_for_timeout(2*1000)
-        screenshot=await page.screenshot(path=path,full_page=full_page,animations='disabled',type='jpeg')
+        # Captured lossless at css scale, the pipeline does the downscaling and the only lossy encoding
+        screenshot=await page.screenshot(path=path,full_page=full_page,animations='disabled',type='png',scale='css')
         return screenshot
     
     async def get_parent_iframe(self,node:ElementHandle)->Frame|None:
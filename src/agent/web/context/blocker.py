@@ -0,0 +1,97 @@
+from src.agent.web.context.config import ContextConfig
+from playwright.async_api import Route,Request,Response,BrowserContext as PlaywrightBrowserContext
+from dataclasses import dataclass,field
+from urllib.parse import urlparse
+from collections import Counter
+
+# Typical transfer sizes (bytes) used until the responses of a type have been seen
+DEFAULT_RESOURCE_SIZES={
+    'script':30000,
+    'image':25000,
+    'font':40000,
+    'media':500000,
+    'stylesheet':15000,
+    'xhr':2000,
+    'fetch':2000,
+    'ping':500,
+    'other':5000,
+}
+
+@dataclass
+class BlockerMetrics:
+    requests_seen:int=0
+    requests_blocked:int=0
+    # Estimated from the sizes of the responses of the same type that were let through
+    bytes_saved:int=0
+    blocked_by_reason:Counter=field(default_factory=Counter)
+
+    @property
+    def block_rate(self)->float:
+        return self.requests_blocked/self.requests_seen if self.requests_seen else 0.0
+
+def host_matches(host:str,domains:list[str])->bool:
+    return any(host==domain or host.endswith(f'.{domain}') for domain in domains)
+
+class ResourceBlocker:
+    '''Aborts the requests of a browser context that don't matter to the agent: analytics, ads and
+    trackers, the blocked domains and, when the agent does not use vision, the media, fonts and images.
+    The allowed domains win over every other rule.'''
+    def __init__(self,config:ContextConfig):
+        self.config=config
+        self.patterns=[pattern.lower() for pattern in config.blocked_url_patterns]
+        self.blocked_types=set() if config.use_vision else set(config.blocked_resource_types)
+        self.metrics=BlockerMetrics()
+        # Running totals of the transfer sizes per resource type
+        self.sizes:dict[str,tuple[int,int]]={}
+
+    async def attach(self,context:PlaywrightBrowserContext):
+        await context.route('**/*',self.handle)
+        context.on('response',self.on_response)
+
+    def reason(self,request:Request)->str|None:
+        '''Why the request is blocked, None to let it through'''
+        url=request.url.lower()
+        if not url.startswith(('http://','https://')):
+            return None
+        host=urlparse(url).hostname or ''
+        try:
+            page_host=urlparse(request.frame.page.url).hostname or ''
+        except Exception:
+            page_host=''
+        if host_matches(host,self.config.allowed_domains) or host_matches(page_host,self.config.allowed_domains):
+            return None
+        if host_matches(host,self.config.blocked_domains):
+            return 'domain'
+        # The page itself is never blocked
+        if request.is_navigation_request() and request.frame.parent_frame is None:
+            return None
+        if request.resource_type in self.blocked_types:
+            return request.resource_type
+        if any(pattern in url for pattern in self.patterns):
+            return 'tracker'
+        return None
+
+    def estimated_size(self,resource_type:str)->int:
+        total,count=self.sizes.get(resource_type,(0,0))
+        return total//count if count else DEFAULT_RESOURCE_SIZES.get(resource_type,DEFAULT_RESOURCE_SIZES['other'])
+
+    async def handle(self,route:Route):
+        request=route.request
+        self.metrics.requests_seen+=1
+        reason=self.reason(request)
+        if reason is None:
+            await route.fallback()
+            return
+        self.metrics.requests_blocked+=1
+        self.metrics.bytes_saved+=self.estimated_size(request.resource_type)
+        self.metrics.blocked_by_reason[reason]+=1
+        await route.abort('blockedbyclient')
+
+    def on_response(self,response:Response):
+        length=response.headers.get('content-length')
+        if length and length.isdigit():
+            total,count=self.sizes.get(response.request.resource_type,(0,0))
+            self.sizes[response.request.resource_type]=(total+int(length),count+1)
+
+    def reset(self):
+        self.metrics=BlockerMetrics()
@@ -1,12 +1,33 @@
-from dataclasses import dataclass
+from src.agent.screenshot.config import ScreenshotConfig
+from dataclasses import dataclass,field
 from typing import Optional
 
 @dataclass
 class ContextConfig:
-    minimum_wait_page_load_time:float=0.5
-    wait_for_network_idle_page_load_time:float=1
+    # Bounds of the wait for the page to settle after an action (in seconds)
+    minimum_wait_page_load_time:float=0.1
     maximum_wait_page_load_time:float=5
+    # How long the network and the DOM must stay quiet for the page to be settled (in seconds)
+    wait_for_network_idle_page_load_time:float=0.5
+    dom_quiet_time:float=0.1
+    # Delay between the keystrokes of the type tool (in milliseconds)
+    typing_delay:float=0
     disable_security:bool=False
+    # Re-evaluate only the elements changed since the last state instead of rescanning the page
+    incremental_dom:bool=True
+    screenshot:ScreenshotConfig=field(default_factory=ScreenshotConfig)
+    # Abort the requests to analytics, ads and trackers (BLOCKED_URL_PATTERNS) at the network level.
+    # Routing turns off the http cache of Chromium, so it is only worth it on pages heavy with third parties
+    block_resources:bool=False
+    blocked_url_patterns:list[str]=field(default_factory=lambda:list(BLOCKED_URL_PATTERNS))
+    # Also aborted when the agent does not look at screenshots
+    blocked_resource_types:list[str]=field(default_factory=lambda:['media','font','image'])
+    use_vision:bool=False
+    # Requests to these domains (or made by their pages) are never blocked, requests to blocked domains always are
+    allowed_domains:list[str]=field(default_factory=list)
+    blocked_domains:list[str]=field(default_factory=list)
+    # Turn off animations, transitions and autoplay, the pages settle sooner and burn less cpu
+    lite:bool=False
     user_agent:str='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.102 Safari/537.36'
 
 
@@ -65,4 +86,46 @@ IGNORED_URL_PATTERNS = [
 	# Common CDNs for dynamic content
 	'cloudfront.net',
 	'fastly.net',
-]
\ No newline at end of file
+]
+
+# Third parties that never matter to the task, unlike IGNORED_URL_PATTERNS these are safe to abort
+BLOCKED_URL_PATTERNS = [
+	# Analytics and session recording
+	'google-analytics.com',
+	'googletagmanager.com',
+	'analytics.google.com',
+	'stats.g.doubleclick.net',
+	'cdn.segment.com',
+	'api.segment.io',
+	'mixpanel.com',
+	'amplitude.com',
+	'hotjar.com',
+	'clarity.ms',
+	'fullstory.com',
+	'mouseflow.com',
+	'nr-data.net',
+	'scorecardresearch.com',
+	'quantserve.com',
+	'bat.bing.com',
+	'connect.facebook.net',
+	'facebook.com/tr?',
+	'facebook.com/tr/',
+	# Ads
+	'doubleclick.net',
+	'googlesyndication.com',
+	'googleadservices.com',
+	'adservice.google.',
+	'amazon-adsystem.com',
+	'adnxs.com',
+	'criteo.com',
+	'criteo.net',
+	'taboola.com',
+	'outbrain.com',
+	'moatads.com',
+	'pubmatic.com',
+	'rubiconproject.com',
+	'casalemedia.com',
+	# Push notifications
+	'onesignal.com',
+	'pushwoosh.com',
+]
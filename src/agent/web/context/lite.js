@@ -0,0 +1,29 @@
+(() => {
+  const style = document.createElement('style');
+  style.textContent = `
+    *, *::before, *::after {
+      animation-duration: 0s !important;
+      animation-delay: 0s !important;
+      animation-iteration-count: 1 !important;
+      transition-duration: 0s !important;
+      transition-delay: 0s !important;
+      scroll-behavior: auto !important;
+      caret-color: auto !important;
+    }
+  `;
+  const attach = () => (document.head || document.documentElement).appendChild(style);
+  if (document.documentElement) {
+    attach();
+  } else {
+    document.addEventListener('DOMContentLoaded', attach, { once: true });
+  }
+
+  // Media only plays after a user gesture, the clicks of the agent count as one
+  document.addEventListener('play', (event) => {
+    const media = event.target;
+    if (media instanceof HTMLMediaElement && !(navigator.userActivation && navigator.userActivation.isActive)) {
+      media.pause();
+      media.autoplay = false;
+    }
+  }, true);
+})();
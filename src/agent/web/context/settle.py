@@ -0,0 +1,90 @@
+from src.agent.web.context.config import ContextConfig,RELEVANT_RESOURCE_TYPES,IGNORED_URL_PATTERNS
+from playwright.async_api import Page,Request,BrowserContext as PlaywrightBrowserContext
+from src.agent.settle import SettleRecord
+from time import perf_counter
+import asyncio
+
+# Resolves once the document had no mutation for `quiet` ms, followed by two animation frames so pending layout and paint are done
+DOM_QUIET_SCRIPT='''([quiet,timeout])=>new Promise(resolve=>{
+    const start=performance.now();
+    let last=start;
+    const observer=new MutationObserver(()=>{last=performance.now();});
+    observer.observe(document,{childList:true,subtree:true,attributes:true,characterData:true});
+    const check=()=>{
+        const now=performance.now();
+        if(now-last>=quiet||now-start>=timeout){
+            observer.disconnect();
+            requestAnimationFrame(()=>requestAnimationFrame(()=>resolve(now-start<timeout)));
+        }else{
+            setTimeout(check,Math.min(50,quiet));
+        }
+    };
+    setTimeout(check,Math.min(50,quiet));
+})'''
+
+class NetworkTracker:
+    '''Tracks the in-flight requests of a browser context that matter for the page to be considered loaded.'''
+    def __init__(self):
+        self.pending:dict[Request,float]={}
+        self.last_activity=perf_counter()
+
+    def attach(self,context:PlaywrightBrowserContext):
+        context.on('request',self.on_request)
+        context.on('requestfinished',self.on_request_done)
+        context.on('requestfailed',self.on_request_done)
+
+    def is_relevant(self,request:Request)->bool:
+        if request.resource_type not in RELEVANT_RESOURCE_TYPES:
+            return False
+        url=request.url.lower()
+        return not any(pattern in url for pattern in IGNORED_URL_PATTERNS)
+
+    def on_request(self,request:Request):
+        if self.is_relevant(request):
+            self.pending[request]=perf_counter()
+            self.last_activity=perf_counter()
+
+    def on_request_done(self,request:Request):
+        if self.pending.pop(request,None) is not None:
+            self.last_activity=perf_counter()
+
+    def in_flight(self,stale_after:float)->int:
+        '''Number of pending requests, leaving out long-lived ones (streams, long polling) that would never let the network go idle.'''
+        now=perf_counter()
+        return sum(1 for started in self.pending.values() if now-started<stale_after)
+
+    async def wait_for_idle(self,idle_time:float,stale_after:float,interval:float=0.05):
+        while self.in_flight(stale_after) or perf_counter()-self.last_activity<idle_time:
+            await asyncio.sleep(interval)
+
+class Settle:
+    '''Waits for the page to settle after an action: network idle, no DOM mutations and rendered frames, bounded by the limits of the config.'''
+    def __init__(self,config:ContextConfig,network:NetworkTracker):
+        self.config=config
+        self.network=network
+
+    async def wait_for_dom(self,page:Page)->bool:
+        quiet=self.config.dom_quiet_time*1000
+        timeout=self.config.maximum_wait_page_load_time*1000
+        try:
+            return await page.evaluate(DOM_QUIET_SCRIPT,[quiet,timeout])
+        except Exception:
+            # The page navigated while waiting, so the load state is awaited instead
+            await page.wait_for_load_state('domcontentloaded')
+            return True
+
+    async def wait(self,page:Page)->SettleRecord:
+        start=perf_counter()
+        config=self.config
+        try:
+            _,dom_settled=await asyncio.wait_for(asyncio.gather(
+                self.network.wait_for_idle(config.wait_for_network_idle_page_load_time,config.maximum_wait_page_load_time),
+                self.wait_for_dom(page)
+            ),timeout=config.maximum_wait_page_load_time)
+            timed_out=not dom_settled
+        except asyncio.TimeoutError:
+            timed_out=True
+        remaining=config.minimum_wait_page_load_time-(perf_counter()-start)
+        if remaining>0:
+            await asyncio.sleep(remaining)
+        return SettleRecord(waited=perf_counter()-start,signals=['network','dom','frames'],timed_out=timed_out)
@@ -1,6 +1,7 @@
 from dataclasses import dataclass,field
 from playwright.async_api import Page,BrowserContext as PlaywrightBrowserContext
 from src.agent.web.dom.views import DOMState
+from src.agent.screenshot.views import Screenshot
 from typing import Optional
 
 @dataclass 
@@ -14,8 +15,8 @@ class BrowserState:
 	url:str=''
 	title:str=''
 	tabs:list[Tab]=field(default_factory=list)
-	screenshot:Optional[str]=None
-	dom_state:DOMState=field(default_factory=DOMState([],{}))
+	screenshot:Optional[Screenshot]=None
+	dom_state:DOMState=field(default_factory=DOMState)
 	
 	def tabs_to_string(self)->str:
 		return '\n'.join([f'{tab.id} - Title: {tab.title} - URL: {tab.url}' for tab in self.tabs])
@@ -1,56 +1,95 @@
 from src.agent.web.dom.views import DOMElementNode, DOMState
+from src.agent.screenshot.views import Screenshot
 from playwright.async_api import ElementHandle
 from typing import TYPE_CHECKING
+from pathlib import Path
 import asyncio
 
 if TYPE_CHECKING:
     from src.agent.web.context import Context
 
+SCRIPT=Path(__file__).parent.joinpath('script.js').read_text()
+
 class DOM:
     def __init__(self, context:'Context'):
         self.context=context
 
-    async def get_state(self,use_vision:bool=False)->tuple[str|None,DOMState]:
-        '''Get the state of the webpage.'''
-        with open('./src/agent/web/dom/script.js') as f:
-                script=f.read()
-        # Loading the script
-        await self.context.execute_script(script)
+    async def get_state(self,use_vision:bool=False,previous:DOMState|None=None)->tuple[Screenshot|None,DOMState]:
+        '''Get the state of the webpage. If the previous state is given only the elements changed since then are re-evaluated.'''
+        # Loading the script (only once per document, so the mutation observer keeps its index)
+        if not await self.context.execute_script("typeof getInteractiveElementsDiff === 'function'"):
+            await self.context.execute_script(SCRIPT)
         # Get interactive elements
-        await asyncio.sleep(0.2)
-        nodes=await self.context.execute_script('getInteractiveElements()')
-        # print(nodes)
+        token=previous.token if previous is not None else None
+        diff=await self.context.execute_script('token=>getInteractiveElementsDiff(token)',token)
+        elements=self.apply_diff(diff,previous)
+        nodes=[elements[id] for id in diff.get('order')]
         # Add bounding boxes to the interactive elements
         if use_vision:
-            await self.context.execute_script('nodes=>{mark_page(nodes)}',nodes)
-            screenshot=await self.context.get_screenshot(save_screenshot=False)
+            await self.context.execute_script('nodes=>{mark_page(nodes)}',[{'box':node.bounding_box} for node in nodes])
+            image=await self.context.get_screenshot(save_screenshot=False)
+            # Remove bounding boxes
             await self.context.execute_script('unmark_page()')
+            region=await self.get_focus_region() if self.context.config.screenshot.region=='focus' else None
+            screenshot=self.context.screenshot_pipeline.process(image,region=region)
         else:
             screenshot=None
-        # Remove bounding boxes
-        selector_map=await self.build_selector_map(nodes)
-        # print(selector_map)
-        return (screenshot,DOMState(nodes=list(selector_map.values()),selector_map=selector_map))
-
-
-    async def build_selector_map(self, nodes: list[dict]) -> dict[int, tuple[DOMElementNode, ElementHandle]]:
-        """Build a map from element index to node."""
-        async def process_node(index: int, node: dict):
-            handle = await self.context.execute_script(
-                'index => getElementByIndex(index)', 
-                index, 
-                enable_handle=True
-            )
-            element_handle = handle.as_element()
-            element_node = DOMElementNode(
+        selector_map=self.build_selector_map(nodes)
+        handles=await self.carry_handles(diff,previous)
+        return (screenshot,DOMState(nodes=nodes,selector_map=selector_map,handles=handles,token=diff.get('token')))
+
+    async def get_focus_region(self)->tuple[float,float,float,float]|None:
+        '''Bounding box of the focused element, None if nothing is focused.'''
+        return await self.context.execute_script('''()=>{
+            const element=document.activeElement;
+            if(!element||element===document.body||element===document.documentElement) return null;
+            const box=element.getBoundingClientRect();
+            return [box.left,box.top,box.right,box.bottom];
+        }''')
+
+    def apply_diff(self,diff:dict,previous:DOMState|None=None)->dict[int,DOMElementNode]:
+        '''Patch the elements of the previous state with the diff.'''
+        if diff.get('full') or previous is None:
+            elements={}
+        else:
+            elements={node.id:node for node in previous.nodes}
+        for id in diff.get('removed'):
+            elements.pop(id,None)
+        for node in diff.get('added')+diff.get('changed'):
+            elements[node.get('id')]=DOMElementNode(
+                id=node.get('id'),
                 tag=node.get('tag'),
                 role=node.get('role'),
                 name=node.get('name'),
                 attributes=node.get('attributes'),
-                bounding_box=node.get('box')
+                bounding_box=node.get('box'),
+                in_viewport=node.get('viewport',True)
             )
-            return index, (element_node, element_handle)
+        return elements
+
+    def build_selector_map(self, nodes: list[DOMElementNode]) -> dict[int, DOMElementNode]:
+        """Build a map from element index to node. The element handles are resolved lazily by their id."""
+        return dict(enumerate(nodes))
+
+    async def carry_handles(self, diff: dict, previous: DOMState|None=None) -> dict[int, ElementHandle]:
+        """Keep the resolved handles of the elements that still exist and dispose the rest."""
+        if previous is None:
+            return {}
+        stale=set() if not diff.get('full') else set(previous.handles.keys())
+        stale.update(diff.get('removed'))
+        stale.update(node.get('id') for node in diff.get('changed'))
+        handles={id:handle for id,handle in previous.handles.items() if id not in stale}
+        await asyncio.gather(*[handle.dispose() for id,handle in previous.handles.items() if id in stale],return_exceptions=True)
+        return handles
 
-        tasks = [process_node(index, node) for index, node in enumerate(nodes)]
-        results = await asyncio.gather(*tasks)
-        return dict(results)
\ No newline at end of file
+    async def get_handle(self, state: DOMState, node: DOMElementNode) -> ElementHandle:
+        """Resolve the element handle of a node in a single round trip and cache it in the state."""
+        handle=state.handles.get(node.id)
+        if handle is None:
+            js_handle=await self.context.execute_script('id => getElementById(id)',node.id,enable_handle=True)
+            handle=js_handle.as_element()
+            if handle is None:
+                await js_handle.dispose()
+                raise Exception('Element is no longer attached to the page')
+            state.handles[node.id]=handle
+        return handle
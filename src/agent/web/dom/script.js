@@ -39,6 +39,8 @@ const SAFE_ATTRIBUTES = [
 ];
 
     const labels = [];
+    // The overlay nodes of mark_page, their mutations are not changes of the page
+    const markers = new WeakSet();
     const selectorMap = {};
 
     // Function to get a random color
@@ -62,100 +64,275 @@ const SAFE_ATTRIBUTES = [
         });
     }
 
+    // Index of the interactive elements kept up to date by a MutationObserver
+    const domIndex = {
+        token: null,              // Identifies the document the index belongs to
+        nextId: 0,
+        ids: new WeakMap(),       // element -> stable id
+        candidates: new Map(),    // id -> element having an interactive tag, role or click handler
+        snapshot: new Map(),      // id -> serialized node that was last reported
+        order: [],                // ids of the reported nodes in document order
+        boxes: new Map(),         // id -> bounding box of every candidate when it was last evaluated
+        dirty: new Set(),         // roots of the subtrees mutated since the last diff
+        layoutChanged: false,     // set when the layout may have changed (mutation, scroll, resize)
+        observer: null,
+        observedRoots: new WeakSet()
+    };
+
+    function isVisible(element) {
+        let type = element.getAttribute('type');
+        // The radio and checkbox elements are all ready invisible so we can skip them
+        if(['radio', 'checkbox'].includes(type)) return true;
+        const style = window.getComputedStyle(element);
+        const hasBoundingBox = element.offsetWidth > 0 && element.offsetHeight > 0;
+        const visible =
+            style.display !== 'none' &&
+            style.visibility !== 'hidden' &&
+            style.opacity !== '0' &&
+            hasBoundingBox;
+
+        return visible;
+    }
+
+    function isClickable(element) {
+        return element.hasAttribute('onclick') || element.hasAttribute('@click')||
+        element.getAttribute('role') === 'button' || window.getComputedStyle(element).cursor === 'pointer'
+    }
+
+    function isElementCovered(element) {
+        let type = element.getAttribute('type');
+        // The radio and checkbox elements are all ready covered so we can skip them
+        if(['radio', 'checkbox'].includes(type)) return false;
+        // Get the bounding box of the element to find its center point
+        const boundingBox = element.getBoundingClientRect();
+        const x = boundingBox.left + boundingBox.width / 2;
+        const y = boundingBox.top + boundingBox.height / 2;
+    
+        // Get the top element under the center of the current element
+        const topElement = element.ownerDocument.elementFromPoint(x, y);
+    
+        // If no element is found at the point, return false (no element is covering it)
+        if (!topElement) return false;
+    
+        // Compare if topElement is inside the current element
+        const isInside = element.contains(topElement);
+    
+        // If topElement is inside the current element, it means it's not covered by it
+        if (isInside) return false;        
+        return true;  // If no coverage, return true
+    }
+
+    function isCandidate(element) {
+        const tagName = element.tagName.toLowerCase();
+        const role = element.getAttribute('role');
+        const hasInteractiveTag = INTERACTIVE_TAGS.includes(tagName);
+        const hasInteractiveRole = role && INTERACTIVE_ROLES.includes(role);
+        return hasInteractiveTag || hasInteractiveRole || isClickable(element);
+    }
+
+    function getElementId(element) {
+        let id = domIndex.ids.get(element);
+        if (id === undefined) {
+            id = domIndex.nextId++;
+            domIndex.ids.set(element, id);
+        }
+        return id;
+    }
+
+    function boxKey(box) {
+        return `${box.left},${box.top},${box.width},${box.height}`;
+    }
+
+    // Serialize the element if it is visible and not covered, otherwise null
+    function describeElement(element) {
+        if (!element.isConnected) return null;
+        const box = element.getBoundingClientRect();
+        domIndex.boxes.set(getElementId(element), boxKey(box));
+        if (!isCandidate(element) || !isVisible(element) || isElementCovered(element)) return null;
+        const view = element.ownerDocument.defaultView;
+        return {
+            id: getElementId(element),
+            tag: element.tagName.toLowerCase(),
+            role: element.getAttribute('role'),
+            name: element.getAttribute('name')||element.getAttribute('aria-label')||element.getAttribute('aria-labelledby')||element.getAttribute('aria-describedby')||element?.textContent,
+            attributes: Object.fromEntries(
+                Array.from(element.attributes).filter(attr => SAFE_ATTRIBUTES.includes(attr.name)).map(attr => [attr.name, attr.value])
+            ),
+            box: box.toJSON(),
+            viewport: box.bottom > 0 && box.right > 0 && box.top < view.innerHeight && box.left < view.innerWidth
+        };
+    }
+
+    // Watch a document or shadow root for changes
+    function observeRoot(root) {
+        if (!domIndex.observer || domIndex.observedRoots.has(root)) return;
+        domIndex.observedRoots.add(root);
+        domIndex.observer.observe(root, {childList: true, subtree: true, attributes: true, characterData: true});
+        if (root.defaultView) {
+            root.defaultView.addEventListener('scroll', () => { domIndex.layoutChanged = true; }, {capture: true, passive: true});
+            root.defaultView.addEventListener('resize', () => { domIndex.layoutChanged = true; }, {passive: true});
+        }
+    }
+
+    // Collect the candidate elements of a subtree, descending into shadow roots and iframes
+    function collectCandidates(node, candidates = []) {
+        if (node.nodeType !== Node.ELEMENT_NODE) return candidates;
+        const tagName = node.tagName.toLowerCase();
+        if (isCandidate(node)) {
+            candidates.push(node);
+        }
+        const shadowRoot=node.shadowRoot
+        if(shadowRoot){
+            observeRoot(shadowRoot);
+            shadowRoot.childNodes.forEach(child => collectCandidates(child, candidates));
+        }
+        if(tagName === 'iframe') {
+            try{
+                const iframeDocument = node.contentDocument || node.contentWindow.document;
+                observeRoot(iframeDocument);
+                collectCandidates(iframeDocument.body, candidates);
+            }
+            catch (e) {
+                console.log('The iframe is not accessable');
+            }
+        }
+        if(!isClickable(node)) {
+            node.childNodes.forEach(child => collectCandidates(child, candidates)); // Go deeper if the current node is not interactive
+        }
+        return candidates;
+    }
+
+    function isMarkerRecord(record) {
+        let node = record.target;
+        while (node) {
+            if (markers.has(node)) return true;
+            node = node.parentNode;
+        }
+        const nodes = [...record.addedNodes, ...record.removedNodes];
+        return nodes.length > 0 && nodes.every(node => markers.has(node));
+    }
+
+    function onMutations(records) {
+        for (const record of records) {
+            if (isMarkerRecord(record)) continue;
+            const target = record.target.nodeType === Node.ELEMENT_NODE ? record.target : record.target.parentElement;
+            if (target) domIndex.dirty.add(target);
+            domIndex.layoutChanged = true;
+        }
+    }
+
+    // The outermost connected roots among the mutated subtrees
+    function dirtyRoots() {
+        const roots = [...domIndex.dirty].filter(root => root.isConnected);
+        return roots.filter(root => !roots.some(other => other !== root && other.contains(root)));
+    }
+
+    function intersects(a, b) {
+        return a.left < b.right && b.left < a.right && a.top < b.bottom && b.top < a.bottom;
+    }
+
+    // Whether an element has to be evaluated again: it is inside a mutated subtree, it moved or
+    // resized, or a mutated subtree overlaps it (e.g. a dialog opened over it)
+    function needsEvaluation(id, element, roots, rootBoxes) {
+        if (roots.some(root => root.contains(element))) return true;
+        const box = element.getBoundingClientRect();
+        if (domIndex.boxes.get(id) !== boxKey(box)) return true;
+        return rootBoxes.some(([root, rootBox]) => root.ownerDocument === element.ownerDocument && intersects(box, rootBox));
+    }
+
     // Extract visible interactive elements
     async function getInteractiveElements(node=document.body) {
-
-        const interactiveElements = [];  
         await waitForPageToLoad()
-        function isVisible(element) {
-            let type = element.getAttribute('type');
-            // The radio and checkbox elements are all ready invisible so we can skip them
-            if(['radio', 'checkbox'].includes(type)) return true;
-            const style = window.getComputedStyle(element);
-            const hasBoundingBox = element.offsetWidth > 0 && element.offsetHeight > 0;
-            const visible =
-                style.display !== 'none' &&
-                style.visibility !== 'hidden' &&
-                style.opacity !== '0' &&
-                hasBoundingBox;
-
-            return visible;
+        if (domIndex.observer) domIndex.observer.disconnect();
+        domIndex.token = Math.random().toString(36).slice(2);
+        domIndex.observer = new MutationObserver(onMutations);
+        domIndex.observedRoots = new WeakSet();
+        observeRoot(document);
+        domIndex.candidates.clear();
+        domIndex.snapshot.clear();
+        domIndex.boxes.clear();
+        const interactiveElements = [];
+        for (const element of collectCandidates(node)) {
+            const id = getElementId(element);
+            domIndex.candidates.set(id, element);
+            const description = describeElement(element);
+            if (description) {
+                domIndex.snapshot.set(id, JSON.stringify(description));
+                interactiveElements.push(description);
+            }
         }
+        domIndex.order = interactiveElements.map(element => element.id);
+        domIndex.dirty.clear();
+        domIndex.layoutChanged = false;
+        selectorMapping(domIndex.order.map(id => domIndex.candidates.get(id)));
+        return interactiveElements;
+    }
 
-        function isClickable(element) {
-            return element.hasAttribute('onclick') || element.hasAttribute('@click')||
-            element.getAttribute('role') === 'button' || window.getComputedStyle(element).cursor === 'pointer'
+    // Position of an element among the ordered elements, by document order where comparable
+    function insertionIndex(order, element) {
+        for (let i = 0; i < order.length; i++) {
+            const other = domIndex.candidates.get(order[i]);
+            if (other.getRootNode() === element.getRootNode() && (element.compareDocumentPosition(other) & Node.DOCUMENT_POSITION_FOLLOWING)) {
+                return i;
+            }
         }
+        return order.length;
+    }
 
-        function isElementCovered(element) {
-            let type = element.getAttribute('type');
-            // The radio and checkbox elements are all ready covered so we can skip them
-            if(['radio', 'checkbox'].includes(type)) return false;
-            // Get the bounding box of the element to find its center point
-            const boundingBox = element.getBoundingClientRect();
-            const x = boundingBox.left + boundingBox.width / 2;
-            const y = boundingBox.top + boundingBox.height / 2;
-        
-            // Get the top element under the center of the current element
-            const topElement = document.elementFromPoint(x, y);
-        
-            // If no element is found at the point, return false (no element is covering it)
-            if (!topElement) return false;
-        
-            // Compare if topElement is inside the current element
-            const isInside = element.contains(topElement);
-        
-            // If topElement is inside the current element, it means it's not covered by it
-            if (isInside) return false;        
-            return true;  // If no coverage, return true
+    // Changes of the interactive elements since the last call, re-evaluating only what may have changed
+    async function getInteractiveElementsDiff(token) {
+        if (token !== domIndex.token || !domIndex.observer) {
+            const nodes = await getInteractiveElements();
+            return {token: domIndex.token, full: true, added: nodes, changed: [], removed: [], order: domIndex.order};
         }
-
-        function traverseDom(currentNode) {
-            if (currentNode.nodeType !== Node.ELEMENT_NODE) return;
-
-            const tagName = currentNode.tagName.toLowerCase();
-            const role = currentNode.getAttribute('role');
-
-            const hasInteractiveTag = INTERACTIVE_TAGS.includes(tagName);
-            const hasInteractiveRole = role && INTERACTIVE_ROLES.includes(role);
-
-            if ((hasInteractiveTag || hasInteractiveRole || isClickable(currentNode)) && isVisible(currentNode)) {
-                // Check if the element is covered by another element
-                const isCovered = isElementCovered(currentNode);
-                if (!isCovered) {
-                    interactiveElements.push({
-                        tag: currentNode.tagName.toLowerCase(),
-                        role: currentNode.getAttribute('role'),
-                        name: currentNode.getAttribute('name')||currentNode.getAttribute('aria-label')||currentNode.getAttribute('aria-labelledby')||currentNode.getAttribute('aria-describedby')||currentNode?.textContent,
-                        attributes: Object.fromEntries(
-                            Array.from(currentNode.attributes).filter(attr => SAFE_ATTRIBUTES.includes(attr.name)).map(attr => [attr.name, attr.value])
-                        ),
-                        box: currentNode.getBoundingClientRect(),
-                        handle: currentNode
-                    });
+        await waitForPageToLoad()
+        onMutations(domIndex.observer.takeRecords());
+        const added = [], changed = [], removed = [];
+        if (domIndex.layoutChanged) {
+            // Discover the candidates inside the mutated subtrees only
+            const roots = dirtyRoots();
+            for (const root of roots) {
+                for (const element of collectCandidates(root)) {
+                    domIndex.candidates.set(getElementId(element), element);
                 }
             }
-            const shadowRoot=currentNode.shadowRoot
-            if(shadowRoot){
-                shadowRoot.childNodes.forEach(child => traverseDom(child));
-            }
-            if(tagName === 'iframe') {
-                try{
-                    const iframeDocument = currentNode.contentDocument || currentNode.contentWindow.document;
-                    traverseDom(iframeDocument.body);
+            const rootBoxes = roots.map(root => [root, root.getBoundingClientRect()]);
+            // Visibility and coverage are re-evaluated only for the elements that may have changed
+            for (const [id, element] of domIndex.candidates) {
+                const previous = domIndex.snapshot.get(id);
+                if (!element.isConnected) {
+                    domIndex.candidates.delete(id);
+                    domIndex.boxes.delete(id);
+                } else if (!needsEvaluation(id, element, roots, rootBoxes)) {
+                    continue;
                 }
-                catch (e) {
-                    console.log('The iframe is not accessable');
+                const description = describeElement(element);
+                if (description === null) {
+                    if (previous !== undefined) {
+                        domIndex.snapshot.delete(id);
+                        removed.push(id);
+                    }
+                    continue;
                 }
+                const serialized = JSON.stringify(description);
+                if (previous === undefined) {
+                    added.push(description);
+                } else if (previous !== serialized) {
+                    changed.push(description);
+                }
+                domIndex.snapshot.set(id, serialized);
             }
-            if(!isClickable(currentNode)) {
-                currentNode.childNodes.forEach(child => traverseDom(child)); // Go deeper if the current node is not interactive
+            const removedIds = new Set(removed);
+            const order = domIndex.order.filter(id => !removedIds.has(id));
+            for (const description of added) {
+                order.splice(insertionIndex(order, domIndex.candidates.get(description.id)), 0, description.id);
             }
+            domIndex.order = order;
+            domIndex.dirty.clear();
+            domIndex.layoutChanged = false;
         }
-
-        traverseDom(node);
-        selectorMapping(interactiveElements);
-        return interactiveElements;
+        selectorMapping(domIndex.order.map(id => domIndex.candidates.get(id)));
+        return {token: domIndex.token, full: false, added, changed, removed, order: domIndex.order};
     }
 
     // Mark page by placing bounding boxes and labels
@@ -194,6 +371,7 @@ const SAFE_ATTRIBUTES = [
 
             // Append label and bounding box
             boundingBox.appendChild(label);
+            markers.add(boundingBox);
             labels.push(boundingBox);
             document.body.appendChild(boundingBox);
             index++;
@@ -211,12 +389,18 @@ const SAFE_ATTRIBUTES = [
 
     // Function to populate the registry with interactive elements
     function selectorMapping(elements) {
+        for (const index in selectorMap) delete selectorMap[index];
         elements.forEach((element, index) => {
-            selectorMap[index] = element.handle;  // Store the element object directly
+            selectorMap[index] = element;  // Store the element object directly
         });
     }
 
     // Function to get element by index
     function getElementByIndex(index) {
         return selectorMap[index] || null;
-    }
\ No newline at end of file
+    }
+
+    // Function to get element by its stable id
+    function getElementById(id) {
+        return domIndex.candidates.get(id) || null;
+    }
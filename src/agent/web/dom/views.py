@@ -1,5 +1,10 @@
 from dataclasses import dataclass,field
+from src.agent.encoder.views import Element,Encoding
 from playwright.async_api import ElementHandle
+from typing import Optional,TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.agent.encoder import BaseEncoder
 
 @dataclass
 class DOMElementNode:
@@ -8,6 +13,8 @@ class DOMElementNode:
     name: str
     bounding_box: dict
     attributes: dict[str,str] = field(default_factory=dict)
+    id: Optional[int] = None
+    in_viewport: bool = True
 
     def __repr__(self):
         return f"DOMElementNode(tag='{self.tag}', role='{self.role}', name='{self.name}', attributes={self.attributes})"
@@ -17,8 +24,18 @@ class DOMElementNode:
     
 @dataclass
 class DOMState:
-    nodes: list[tuple[DOMElementNode,ElementHandle]]=field(default_factory=list)
-    selector_map:dict[int,tuple[DOMElementNode,ElementHandle]]=field(default_factory=dict)
+    nodes: list[DOMElementNode]=field(default_factory=list)
+    selector_map:dict[int,DOMElementNode]=field(default_factory=dict)
+    # Element handles resolved on demand, keyed by the id of the node
+    handles:dict[int,ElementHandle]=field(default_factory=dict)
+    # Identifies the index of the page script, used to request only the changes on the next update
+    token:Optional[str]=None
 
     def elements_to_string(self)->str:
-        return '\n'.join([f'{index} - Tag: {node.tag} Role: {node.role} Name: {node.name} attributes: {node.attributes}' for index,(node,_) in enumerate(self.nodes)])
\ No newline at end of file
+        return '\n'.join([f'{index} - Tag: {node.tag} Role: {node.role} Name: {node.name} attributes: {node.attributes}' for index,node in enumerate(self.nodes)])
+
+    def to_elements(self)->list[Element]:
+        return [Element(index=index,kind=node.tag,role=node.role,name=node.name,attributes=node.attributes,in_viewport=node.in_viewport) for index,node in enumerate(self.nodes)]
+
+    def encode(self,encoder:'BaseEncoder')->Encoding:
+        return encoder.encode(self.to_elements())
\ No newline at end of file
@@ -30,7 +30,7 @@ async def type_tool(index:int,text:str,context:Context=None):
     _,handle=await context.get_element_by_index(index)
     await page.wait_for_load_state('load')
     await handle.scroll_into_view_if_needed()
-    await handle.type(text,delay=80)
+    await handle.type(text,delay=context.config.typing_delay)
     return f'Typed {text} in element {index}'
 
 @Tool('Wait Tool',params=Wait)
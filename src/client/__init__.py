@@ -0,0 +1,74 @@
+from httpx import Client,AsyncClient,Limits,Timeout,HTTPTransport,AsyncHTTPTransport
+from src.client.config import ClientConfig
+from src.metrics import on_response,async_on_response
+from asyncio import AbstractEventLoop,get_running_loop
+from weakref import WeakKeyDictionary
+from threading import Lock
+import atexit
+
+class ClientPool:
+    '''Long-lived HTTP clients shared by every inference and embedding provider.
+
+    One sync client is kept for the process and one async client per event loop,
+    since an `AsyncClient` cannot be used outside the loop it was created on.'''
+    def __init__(self,config:ClientConfig=None):
+        self.config=config if config else ClientConfig()
+        self.sync_client:Client=None
+        self.async_clients:WeakKeyDictionary[AbstractEventLoop,AsyncClient]=WeakKeyDictionary()
+        self.lock=Lock()
+        atexit.register(self.close)
+
+    def limits(self,max_connections:int=None)->Limits:
+        return Limits(
+            max_connections=max_connections or self.config.max_connections,
+            max_keepalive_connections=self.config.max_keepalive_connections,
+            keepalive_expiry=self.config.keepalive_expiry
+        )
+
+    def timeout(self)->Timeout:
+        return Timeout(
+            connect=self.config.connect_timeout,
+            read=self.config.read_timeout,
+            write=self.config.write_timeout,
+            pool=self.config.pool_timeout
+        )
+
+    def get_client(self)->Client:
+        with self.lock:
+            if self.sync_client is None or self.sync_client.is_closed:
+                mounts={f'all://{host}':HTTPTransport(http2=self.config.http2,limits=self.limits(limit)) for host,limit in self.config.host_limits.items()}
+                self.sync_client=Client(http2=self.config.http2,limits=self.limits(),timeout=self.timeout(),mounts=mounts,event_hooks={'response':[on_response]})
+            return self.sync_client
+
+    def get_async_client(self)->AsyncClient:
+        loop=get_running_loop()
+        with self.lock:
+            client=self.async_clients.get(loop)
+            if client is None or client.is_closed:
+                mounts={f'all://{host}':AsyncHTTPTransport(http2=self.config.http2,limits=self.limits(limit)) for host,limit in self.config.host_limits.items()}
+                client=AsyncClient(http2=self.config.http2,limits=self.limits(),timeout=self.timeout(),mounts=mounts,event_hooks={'response':[async_on_response]})
+                self.async_clients[loop]=client
+            return client
+
+    def close(self):
+        '''Close the sync client and the async clients whose loop is still usable.'''
+        with self.lock:
+            if self.sync_client is not None:
+                self.sync_client.close()
+                self.sync_client=None
+            clients=list(self.async_clients.items())
+            self.async_clients.clear()
+        for loop,client in clients:
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(client.aclose())
+
+    async def async_close(self):
+        '''Close the async client bound to the running loop.'''
+        loop=get_running_loop()
+        with self.lock:
+            client=self.async_clients.pop(loop,None)
+        if client is not None:
+            await client.aclose()
+
+# Process wide pool used when a provider is not given its own
+default_pool=ClientPool()
@@ -0,0 +1,18 @@
+from dataclasses import dataclass,field
+from importlib.util import find_spec
+
+@dataclass
+class ClientConfig:
+    http2:bool=find_spec('h2') is not None
+    max_connections:int=100
+    max_keepalive_connections:int=20
+    keepalive_expiry:float=60
+    # Seconds to open a connection, to wait for each read of the response, to send the request
+    # and to get a connection from the pool, so a stalled provider fails instead of hanging the agent.
+    # The local providers (Ollama) wait for their reads without a limit, a long generation there is not a stall
+    connect_timeout:float=10
+    read_timeout:float=60
+    write_timeout:float=30
+    pool_timeout:float=30
+    # Maximum number of connections per host, e.g. {'api.groq.com':10}
+    host_limits:dict[str,int]=field(default_factory=dict)
@@ -1,12 +1,115 @@
+from src.inference import check_response,retried
+from src.embedding.cache import EmbeddingCache
+from src.client import ClientPool,default_pool
+from concurrent.futures import ThreadPoolExecutor
+from httpx import Client,AsyncClient
 from abc import ABC,abstractmethod
+from hashlib import sha256
+import numpy as np
+import asyncio
 
 class BaseEmbedding(ABC):
-    def __init__(self,model:str='',api_key:str='',base_url:str=''):
+    '''An embedding provider, the texts are sent in batches of `batch_size` with up to `max_concurrency`
+    requests in flight. With a `cache` the vectors of the texts embedded before are read from disk.'''
+    def __init__(self,model:str='',api_key:str='',base_url:str='',client_pool:ClientPool=None,batch_size:int=100,max_concurrency:int=4,cache:EmbeddingCache=None):
         self.api_key=api_key
         self.model=model
         self.base_url=base_url
         self.headers={'Content-Type': 'application/json'}
-        
+        self.client_pool=client_pool if client_pool else default_pool
+        self.batch_size=batch_size
+        self.max_concurrency=max_concurrency
+        self.cache=cache
+
+    @property
+    def client(self)->Client:
+        return self.client_pool.get_client()
+
+    @property
+    def async_client(self)->AsyncClient:
+        return self.client_pool.get_async_client()
+
+    def close(self):
+        '''Release the connections of a pool given to this provider, the shared `default_pool` is left to
+        the other providers and closed once at exit'''
+        if self.client_pool is not default_pool:
+            self.client_pool.close()
+
     @abstractmethod
-    def embed(self,text:str):
-        pass
\ No newline at end of file
+    def request(self,texts:list[str])->tuple[str,dict,dict]:
+        '''The url, payload and query parameters of the request that embeds a batch of texts'''
+        pass
+
+    @abstractmethod
+    def parse(self,json_object:dict)->list[list[float]]:
+        '''The vectors in a response, in the order of the texts'''
+        pass
+
+    def options(self)->dict:
+        '''The settings besides the model that change the vectors, they are part of the cache key'''
+        return {}
+
+    def key(self,text:str)->str:
+        return sha256(f'{type(self).__name__}\0{self.model}\0{sorted(self.options().items())}\0{text}'.encode()).hexdigest()
+
+    @retried
+    def embed_many(self,texts:list[str])->np.ndarray:
+        '''Embed a batch of texts in a single request'''
+        url,payload,params=self.request(texts)
+        response=self.client.post(url=url,json=payload,headers=self.headers,params=params)
+        return np.asarray(self.parse(check_response(response,type(self).__name__)),dtype=np.float32)
+
+    @retried
+    async def async_embed_many(self,texts:list[str])->np.ndarray:
+        '''Embed a batch of texts in a single request'''
+        url,payload,params=self.request(texts)
+        response=await self.async_client.post(url=url,json=payload,headers=self.headers,params=params)
+        return np.asarray(self.parse(check_response(response,type(self).__name__)),dtype=np.float32)
+
+    def pending(self,texts:list[str])->tuple[list[str],dict[str,np.ndarray],list[str]]:
+        '''The keys of the texts, their cached vectors and the distinct texts still to embed'''
+        keys=[self.key(text) for text in texts]
+        found=self.cache.get(keys) if self.cache is not None else {}
+        missing=list({key:text for key,text in zip(keys,texts) if key not in found}.values())
+        return keys,found,missing
+
+    def batches(self,texts:list[str])->list[list[str]]:
+        return [texts[i:i+self.batch_size] for i in range(0,len(texts),self.batch_size)]
+
+    def collect(self,keys:list[str],found:dict[str,np.ndarray],missing:list[str],vectors:list[np.ndarray])->np.ndarray:
+        if missing:
+            embedded=np.concatenate(vectors)
+            missing_keys=[self.key(text) for text in missing]
+            if self.cache is not None:
+                self.cache.put(missing_keys,embedded)
+            found.update(zip(missing_keys,embedded))
+        if not keys:
+            return np.empty((0,0),dtype=np.float32)
+        return np.stack([found[key] for key in keys]).astype(np.float32,copy=False)
+
+    def embed_batch(self,texts:list[str])->np.ndarray:
+        '''Embed the texts into a (len(texts), dim) float32 array, repeated and cached texts are not sent'''
+        keys,found,missing=self.pending(texts)
+        batches=self.batches(missing)
+        if len(batches)>1:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency,thread_name_prefix='embedding') as executor:
+                vectors=list(executor.map(self.embed_many,batches))
+        else:
+            vectors=[self.embed_many(batch) for batch in batches]
+        return self.collect(keys,found,missing,vectors)
+
+    async def async_embed_batch(self,texts:list[str])->np.ndarray:
+        '''Embed the texts into a (len(texts), dim) float32 array, repeated and cached texts are not sent'''
+        keys,found,missing=self.pending(texts)
+        semaphore=asyncio.Semaphore(self.max_concurrency)
+        async def embed(batch:list[str])->np.ndarray:
+            async with semaphore:
+                return await self.async_embed_many(batch)
+        vectors=await asyncio.gather(*(embed(batch) for batch in self.batches(missing)))
+        return self.collect(keys,found,missing,list(vectors))
+
+    def embed(self,text:str)->list[float]:
+        return self.embed_batch([text])[0].tolist()
+
+    async def async_embed(self,text:str)->list[float]:
+        return (await self.async_embed_batch([text]))[0].tolist()
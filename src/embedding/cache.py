@@ -0,0 +1,96 @@
+from threading import Lock
+from pathlib import Path
+import numpy as np
+
+class EmbeddingCache:
+    '''Embeddings on disk keyed by the hash of their content, model and options.
+
+    The vectors of each dimension are appended to a raw float32 file that is read through a memory map,
+    so a large cache costs no memory until its rows are used, and a sidecar file holds the key of each
+    row. A row counts only once its key is written, so a write cut short is ignored on the next load.'''
+    def __init__(self,path:str='./.cache/embeddings'):
+        self.path=Path(path)
+        self.path.mkdir(parents=True,exist_ok=True)
+        self.lock=Lock()
+        # key -> (dimension, row)
+        self.index:dict[str,tuple[int,int]]={}
+        self.rows:dict[int,int]={}
+        self.maps:dict[int,np.memmap]={}
+        self.load()
+
+    def vectors_path(self,dim:int)->Path:
+        return self.path/f'vectors-{dim}.f32'
+
+    def keys_path(self,dim:int)->Path:
+        return self.path/f'keys-{dim}.txt'
+
+    def load(self):
+        for keys_path in self.path.glob('keys-*.txt'):
+            dim=int(keys_path.stem.removeprefix('keys-'))
+            size=self.vectors_path(dim).stat().st_size if self.vectors_path(dim).exists() else 0
+            complete=size//(dim*4)
+            with keys_path.open('r',encoding='utf-8') as file:
+                keys=file.read().split()
+            if len(keys)>complete:
+                # Keys without their vector are from an interrupted write
+                keys=keys[:complete]
+                keys_path.write_text(''.join(f'{key}\n' for key in keys),encoding='utf-8')
+            for row,key in enumerate(keys):
+                self.index[key]=(dim,row)
+            self.rows[dim]=len(keys)
+            if complete>len(keys):
+                # Vectors without their key, cut back so the next row lines up
+                with self.vectors_path(dim).open('r+b') as file:
+                    file.truncate(len(keys)*dim*4)
+
+    def vectors(self,dim:int)->np.memmap:
+        '''The memory map of the vectors of a dimension, remapped when rows were added since'''
+        vectors=self.maps.get(dim)
+        rows=self.rows.get(dim,0)
+        if vectors is None or len(vectors)<rows:
+            vectors=self.maps[dim]=np.memmap(self.vectors_path(dim),dtype=np.float32,mode='r',shape=(rows,dim))
+        return vectors
+
+    def get(self,keys:list[str])->dict[str,np.ndarray]:
+        '''The cached vectors of the keys that are in the cache'''
+        found={}
+        with self.lock:
+            for key in keys:
+                entry=self.index.get(key)
+                if entry is None:
+                    continue
+                dim,row=entry
+                found[key]=np.array(self.vectors(dim)[row])
+        return found
+
+    def put(self,keys:list[str],vectors:np.ndarray):
+        vectors=np.ascontiguousarray(vectors,dtype=np.float32)
+        if not len(keys):
+            return
+        dim=vectors.shape[1]
+        with self.lock:
+            new=[(key,vector) for key,vector in zip(keys,vectors) if key not in self.index]
+            if not new:
+                return
+            rows=self.rows.get(dim,0)
+            with self.vectors_path(dim).open('ab') as file:
+                file.write(np.stack([vector for _,vector in new]).tobytes())
+            with self.keys_path(dim).open('a',encoding='utf-8') as file:
+                file.write(''.join(f'{key}\n' for key,_ in new))
+            for offset,(key,_) in enumerate(new):
+                self.index[key]=(dim,rows+offset)
+            self.rows[dim]=rows+len(new)
+
+    def __len__(self)->int:
+        return len(self.index)
+
+    def __contains__(self,key:str)->bool:
+        return key in self.index
+
+    def clear(self):
+        with self.lock:
+            self.maps.clear()
+            for path in list(self.path.glob('vectors-*.f32'))+list(self.path.glob('keys-*.txt')):
+                path.unlink()
+            self.index.clear()
+            self.rows.clear()
@@ -1,21 +1,20 @@
-from requests import HTTPError,ConnectionError
 from src.embedding import BaseEmbedding
-from httpx import Client
+from src.inference import check_response
+from src.embedding.cache import EmbeddingCache
+from src.client import ClientPool
 from typing import Literal
 
 class GeminiEmbedding(BaseEmbedding):
-    def __init__(self,model:str='',output_dimensionality:int=None,task_type:Literal['TASK_TYPE_UNSPECIFIED','RETRIEVAL_QUERY','RETRIEVAL_DOCUMENT','SEMANTIC_SIMILARITY','CLASSIFICATION','CLUSTERING']='',api_key:str='',base_url:str=''):
-        self.api_key=api_key
-        self.model=model
-        self.base_url=base_url
+    def __init__(self,model:str='',output_dimensionality:int=None,task_type:Literal['TASK_TYPE_UNSPECIFIED','RETRIEVAL_QUERY','RETRIEVAL_DOCUMENT','SEMANTIC_SIMILARITY','CLASSIFICATION','CLUSTERING']='',api_key:str='',base_url:str='',client_pool:ClientPool=None,batch_size:int=100,max_concurrency:int=4,cache:EmbeddingCache=None):
+        super().__init__(model=model,api_key=api_key,base_url=base_url,client_pool=client_pool,batch_size=batch_size,max_concurrency=max_concurrency,cache=cache)
         self.output_dimensionality=output_dimensionality
         self.task_type=task_type
-        self.headers={'Content-Type': 'application/json'}
-    def embed(self,text:str='',title:str=''):
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:embedContent"
-        headers=self.headers
-        params={'key':self.api_key}
-        payload={
+
+    def options(self)->dict:
+        return {'task_type':self.task_type,'output_dimensionality':self.output_dimensionality}
+
+    def content(self,text:str,title:str='')->dict:
+        content={
             'model':f'models/{self.model}',
             'content':{
                 'parts':[
@@ -26,17 +25,26 @@ class GeminiEmbedding(BaseEmbedding):
             }
         }
         if self.task_type:
-            payload['task_type']=self.task_type
+            content['task_type']=self.task_type
         if self.output_dimensionality:
-            payload['output_dimensionality']=self.output_dimensionality
+            content['output_dimensionality']=self.output_dimensionality
         if title:
-            payload['title']=title
-        try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,params=params)
-            response.raise_for_status()
-            return response.json()['embedding']['values']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
\ No newline at end of file
+            content['title']=title
+        return content
+
+    def request(self,texts:list[str])->tuple[str,dict,dict]:
+        # The batch endpoint takes up to 100 texts per request
+        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:batchEmbedContents"
+        payload={'requests':[self.content(text) for text in texts]}
+        return url,payload,{'key':self.api_key}
+
+    def parse(self,json_object:dict)->list[list[float]]:
+        return [embedding['values'] for embedding in json_object['embeddings']]
+
+    def embed(self,text:str='',title:str='')->list[float]:
+        if not title:
+            return super().embed(text)
+        # The title only applies to a single document, so it is embedded on its own
+        url=f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:embedContent"
+        response=self.client.post(url=url,json=self.content(text,title),headers=self.headers,params={'key':self.api_key})
+        return check_response(response,type(self).__name__)['embedding']['values']
@@ -1,23 +1,16 @@
 from src.embedding import BaseEmbedding
-from httpx import Client
-from requests import HTTPError,ConnectionError
 
 class MistralEmbedding(BaseEmbedding):
-    def embed(self, text):
+    def request(self,texts:list[str])->tuple[str,dict,dict]:
         url=self.base_url or 'https://api.mistral.ai/v1/embeddings'
         self.headers['Authorization'] = f'Bearer {self.api_key}'
-        headers=self.headers
         payload={
             'model':self.model,
-            'input':text,
+            'input':texts,
             'encoding_format':'float'
         }
-        try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers)
-            response.raise_for_status()
-            return response.json()['data']['embedding']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
+        return url,payload,{}
+
+    def parse(self,json_object:dict)->list[list[float]]:
+        data=sorted(json_object['data'],key=lambda item:item.get('index',0))
+        return [item['embedding'] for item in data]
@@ -1,21 +1,13 @@
-from requests import HTTPError,ConnectionError
 from src.embedding import BaseEmbedding
-from httpx import Client
 
 class OllamaEmbedding(BaseEmbedding):
-    def embed(self, text):
+    def request(self,texts:list[str])->tuple[str,dict,dict]:
         url=self.base_url or f'http://localhost:11434/api/embed'
-        headers=self.headers
         payload={
             'model':self.model,
-            'input':text
+            'input':texts
         }
-        try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers)
-            response.raise_for_status()
-            return response.json()['embeddings'][0]
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
\ No newline at end of file
+        return url,payload,{}
+
+    def parse(self,json_object:dict)->list[list[float]]:
+        return json_object['embeddings']
@@ -1,12 +1,72 @@
-from src.message import AIMessage,SystemMessage
+from src.message import AIMessage,SystemMessage,ToolMessage
+from src.client import ClientPool,default_pool
+from src.inference.limiter import RateLimit,RateLimiter,get_limiter
+from src.metrics import record_usage
+from tenacity import retry,stop_after_attempt,wait_random_exponential,retry_if_exception
+from httpx import Client,AsyncClient,Response,HTTPStatusError,TransportError,Timeout
 from abc import ABC,abstractmethod
+from typing import Generator,AsyncGenerator
 from pydantic import BaseModel
 from src.tool import Tool
+from copy import copy
+from uuid import uuid4
+import json
+
+class InferenceError(Exception):
+    '''An error reported by an inference provider, with the HTTP status when there was one.'''
+    def __init__(self,message:str,status_code:int|None=None,provider:str=''):
+        super().__init__(message)
+        self.status_code=status_code
+        self.provider=provider
+
+def is_retryable(error:BaseException)->bool:
+    '''Rate limits, server errors, timeouts and dropped connections are worth another attempt'''
+    if isinstance(error,InferenceError):
+        return error.status_code is not None and (error.status_code==429 or error.status_code>=500)
+    if isinstance(error,HTTPStatusError):
+        status_code=error.response.status_code
+        return status_code==429 or status_code>=500
+    return isinstance(error,TransportError)
+
+def check_response(response:Response,provider:str)->dict:
+    '''The JSON body of a response, raising `InferenceError` when the provider reported an error'''
+    try:
+        json_object=response.json()
+    except ValueError:
+        json_object={}
+    error=json_object.get('error') if isinstance(json_object,dict) else None
+    if response.is_error or error:
+        if isinstance(error,dict):
+            message=error.get('message',str(error))
+        else:
+            message=error or response.text or response.reason_phrase
+        raise InferenceError(f'{provider}: {message}',status_code=response.status_code,provider=provider)
+    return json_object
+
+# Up to three attempts with jittered exponential backoff, the last error is raised as is
+retried=retry(stop=stop_after_attempt(3),wait=wait_random_exponential(multiplier=0.5,max=8),retry=retry_if_exception(is_retryable),reraise=True)
 
 class Token(BaseModel):
     input: int
     output: int
     total: int
+    # The input tokens served from the provider's prompt cache, billed at a discount
+    cached: int=0
+
+def openai_usage(usage:dict)->Token:
+    '''The token usage reported by the OpenAI compatible APIs'''
+    details=usage.get('prompt_tokens_details') or {}
+    return Token(input=usage['prompt_tokens'],output=usage['completion_tokens'],total=usage['total_tokens'],cached=details.get('cached_tokens') or 0)
+
+def tool_message(message:dict)->ToolMessage|None:
+    '''The first tool call of a chat message returned by the provider, None when the model answered in text'''
+    if not message.get('tool_calls'):
+        return None
+    tool_call=message.get('tool_calls')[0]
+    function=tool_call['function']
+    # The arguments come as a JSON string from the OpenAI compatible APIs and as an object from Ollama
+    args=json.loads(function['arguments']) if isinstance(function['arguments'],str) else function['arguments']
+    return ToolMessage(id=tool_call.get('id') or str(uuid4()),name=function['name'],args=args)
 
 structured_output_prompt='''
 ### JSON Response Format:
@@ -22,16 +82,75 @@ Validate all fields, use `null` or empty values for missing data, and format the
 '''
 
 class BaseInference(ABC):
-    def __init__(self,model:str,api_key:str='',base_url:str='',tools:list[Tool]=[],temperature:float=0.5):
+    # A local provider generates at the speed of the machine, a long response is not a stalled one
+    local:bool=False
+
+    def __init__(self,model:str,api_key:str='',base_url:str='',tools:list[Tool]=[],temperature:float=0.5,client_pool:ClientPool=None,rate_limit:RateLimit=None):
         self.model=model
         self.api_key=api_key
         self.base_url=base_url
         self.tools=tools
         self.temperature=temperature
+        self.client_pool=client_pool if client_pool else default_pool
+        self.rate_limit=rate_limit
         self.headers={'Content-Type': 'application/json'}
         self.structured_output_prompt=structured_output_prompt
         self.tokens:Token=Token(input=0,output=0,total=0)
 
+    @property
+    def tokens(self)->Token:
+        '''The usage of the last call, every call is also recorded to the metrics collector'''
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self,tokens:Token):
+        self._tokens=tokens
+        record_usage(tokens.input,tokens.output,tokens.total,tokens.cached)
+
+    @property
+    def client(self)->Client:
+        return self.client_pool.get_client()
+
+    @property
+    def timeout(self)->Timeout:
+        '''The timeouts of the pool, without the read timeout for a local provider'''
+        timeout=self.client_pool.timeout()
+        if self.local:
+            return Timeout(connect=timeout.connect,read=None,write=timeout.write,pool=timeout.pool)
+        return timeout
+
+    @property
+    def limiter(self)->RateLimiter:
+        '''Shared by the instances of the provider with the same API key'''
+        return get_limiter(type(self).__name__,self.api_key,self.rate_limit)
+
+    @property
+    def async_client(self)->AsyncClient:
+        return self.client_pool.get_async_client()
+
+    def bind_tools(self,tools:list[Tool])->'BaseInference':
+        '''A copy of the provider that offers the tools to the model for native function calling.
+
+        The copy shares the clients and the rate limiter of the provider.'''
+        bound=copy(self)
+        bound.tools=tools
+        return bound
+
+    def close(self):
+        '''Release the connections of a pool given to this provider, the shared `default_pool` is left to
+        the other providers and closed once at exit'''
+        if self.client_pool is not default_pool:
+            self.client_pool.close()
+
+    async def async_close(self):
+        '''Release the connections of the running event loop, from a pool given to this provider only'''
+        if self.client_pool is not default_pool:
+            await self.client_pool.async_close()
+
+    def check(self,response:Response)->dict:
+        '''The JSON body of a response, raising `InferenceError` when the provider reported an error'''
+        return check_response(response,type(self).__name__)
+
     @abstractmethod
     def invoke(self,messages:list[dict],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
         pass
@@ -41,8 +160,13 @@ class BaseInference(ABC):
         pass
 
     @abstractmethod
-    def stream(self,messages:list[dict],json:bool=False)->AIMessage:
+    def stream(self,messages:list[dict],json:bool=False)->Generator[str,None,None]:
+        pass
+
+    @abstractmethod
+    async def async_stream(self,messages:list[dict],json:bool=False)->AsyncGenerator[str,None]:
         pass
 
     def structured(self,message:SystemMessage,model:BaseModel):
+        '''The system prompt with the schema of the model, the message is left as is since it is reused on every step'''
         return f'{message.content}\n{structured_output_prompt.format(json_schema=model.model_json_schema())}'
\ No newline at end of file
@@ -0,0 +1,291 @@
+from src.message import AIMessage,BaseMessage,ImageMessage,ToolMessage
+from src.inference import BaseInference,Token
+from src.tool import Tool
+from copy import copy
+from typing import Generator,AsyncGenerator
+from dataclasses import dataclass
+from pydantic import BaseModel
+from threading import Lock
+from hashlib import sha256
+from pathlib import Path
+from time import time
+import sqlite3
+import json
+import re
+
+@dataclass
+class CacheConfig:
+    path:str='./.cache/inference.sqlite'
+    max_entries:int=10000
+    # Seconds an entry stays valid, None to keep it until it is evicted
+    ttl:float|None=None
+    # Also match prompts that only differ in the current date and time the agents add to them, any other
+    # difference (a date in the task, the whitespace of an observation) still makes a different request
+    normalize:bool=False
+    # Sampled responses (temperature above 0) are not reused
+    deterministic_only:bool=True
+
+@dataclass
+class CacheMetrics:
+    hits:int=0
+    misses:int=0
+    # Calls that could not be cached, e.g. sampled or cut short streams
+    bypassed:int=0
+    bytes_saved:int=0
+    tokens_saved:int=0
+
+    @property
+    def hit_rate(self)->float:
+        lookups=self.hits+self.misses
+        return self.hits/lookups if lookups else 0.0
+
+# The lines with the current date and time added by the agents, the rest of the prompt is kept as is
+CURRENT_DATETIME_PATTERN=re.compile(r'^(- )?Current (date and time|DateTime): .*$',re.MULTILINE)
+
+class CachedInference(BaseInference):
+    '''Serves repeated requests to an inference provider from a SQLite cache on disk.
+
+    A request is keyed on the model, temperature, messages and output mode. Each entry has an exact key and a
+    normalized one, where the current date and time added by the agents is ignored, so with `normalize` the
+    same task started at another time still matches. The images are keyed by the hash of their data, so a
+    request with an image only hits when the same image was sent. The entries are evicted by least recent use and by age.
+
+    Only complete responses are stored: every `invoke`, and the streams read to the end. A stream the agent
+    cuts short once the action is known (see `StreamParser`) is not stored, so with streaming the cache only
+    serves the requests whose stream was read to the end before.'''
+    def __init__(self,llm:BaseInference,config:CacheConfig=None):
+        super().__init__(llm.model,api_key=llm.api_key,base_url=llm.base_url,tools=llm.tools,temperature=llm.temperature,client_pool=llm.client_pool,rate_limit=llm.rate_limit)
+        self.llm=llm
+        self.config=config if config else CacheConfig()
+        self.metrics=CacheMetrics()
+        self.lock=Lock()
+        path=Path(self.config.path)
+        path.parent.mkdir(parents=True,exist_ok=True)
+        self.connection=sqlite3.connect(path,check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS entries(
+                key TEXT PRIMARY KEY,
+                normalized TEXT,
+                value TEXT,
+                size INTEGER,
+                tokens INTEGER,
+                created REAL,
+                accessed REAL
+            );
+            CREATE INDEX IF NOT EXISTS entries_normalized ON entries(normalized);
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed);
+        ''')
+
+    def keys(self,messages:list[BaseMessage],mode:str)->tuple[str,str]:
+        '''The exact and the normalized key of a request'''
+        return tuple(request_key(self.llm.model,self.llm.temperature,messages,mode,normalize,self.llm.tools) for normalize in (False,True))
+
+    def cacheable(self)->bool:
+        return not self.config.deterministic_only or self.llm.temperature==0
+
+    def lookup(self,key:str,normalized:str)->tuple[str,int,int]|None:
+        now=time()
+        with self.lock:
+            row=self.connection.execute('SELECT key,value,size,tokens,created FROM entries WHERE key=?',(key,)).fetchone()
+            if row is None and self.config.normalize:
+                row=self.connection.execute('SELECT key,value,size,tokens,created FROM entries WHERE normalized=? ORDER BY accessed DESC LIMIT 1',(normalized,)).fetchone()
+            if row is None:
+                return None
+            entry_key,value,size,tokens,created=row
+            if self.config.ttl is not None and now-created>self.config.ttl:
+                self.connection.execute('DELETE FROM entries WHERE key=?',(entry_key,))
+                self.connection.commit()
+                return None
+            self.connection.execute('UPDATE entries SET accessed=? WHERE key=?',(now,entry_key))
+            self.connection.commit()
+            return value,size,tokens
+
+    def store(self,key:str,normalized:str,value:str,tokens:int):
+        now=time()
+        size=len(value.encode())
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?)',(key,normalized,value,size,tokens,now,now))
+            if self.config.ttl is not None:
+                self.connection.execute('DELETE FROM entries WHERE created<?',(now-self.config.ttl,))
+            # Least recently used entries above the limit are evicted
+            self.connection.execute('''
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )''',(self.config.max_entries,))
+            self.connection.commit()
+
+    def hit(self,size:int,tokens:int):
+        with self.lock:
+            self.metrics.hits+=1
+            self.metrics.bytes_saved+=size
+            self.metrics.tokens_saved+=tokens
+        self.tokens=Token(input=0,output=0,total=0)
+
+    def miss(self,key:str,normalized:str,value:str):
+        with self.lock:
+            self.metrics.misses+=1
+        self.tokens=self.llm.tokens
+        self.store(key,normalized,value,self.tokens.total)
+
+    def bypass(self):
+        with self.lock:
+            self.metrics.bypassed+=1
+
+    def invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        if not self.cacheable():
+            self.bypass()
+            response=self.llm.invoke(messages,json=json,model=model)
+            self.tokens=self.llm.tokens
+            return response
+        key,normalized=self.keys(messages,output_mode(json,model))
+        if entry:=self.lookup(key,normalized):
+            value,size,tokens=entry
+            self.hit(size,tokens)
+            return decode_response(value,model)
+        response=self.llm.invoke(messages,json=json,model=model)
+        if response is not None:
+            self.miss(key,normalized,encode_response(response))
+        return response
+
+    async def async_invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        if not self.cacheable():
+            self.bypass()
+            response=await self.llm.async_invoke(messages,json=json,model=model)
+            self.tokens=self.llm.tokens
+            return response
+        key,normalized=self.keys(messages,output_mode(json,model))
+        if entry:=self.lookup(key,normalized):
+            value,size,tokens=entry
+            self.hit(size,tokens)
+            return decode_response(value,model)
+        response=await self.llm.async_invoke(messages,json=json,model=model)
+        if response is not None:
+            self.miss(key,normalized,encode_response(response))
+        return response
+
+    def stream(self,messages:list[BaseMessage],json:bool=False)->Generator[str,None,None]:
+        '''A cached response is replayed as a single chunk, only the streams read to the end are stored'''
+        if not self.cacheable():
+            self.bypass()
+            yield from self.llm.stream(messages,json=json)
+            self.tokens=self.llm.tokens
+            return
+        key,normalized=self.keys(messages,output_mode(json,stream=True))
+        if entry:=self.lookup(key,normalized):
+            value,size,tokens=entry
+            self.hit(size,tokens)
+            yield decode_response(value).content
+            return
+        chunks=[]
+        completed=False
+        try:
+            for chunk in self.llm.stream(messages,json=json):
+                chunks.append(chunk)
+                yield chunk
+            completed=True
+        finally:
+            if completed:
+                self.miss(key,normalized,encode_response(AIMessage(''.join(chunks))))
+            else:
+                self.bypass()
+
+    async def async_stream(self,messages:list[BaseMessage],json:bool=False)->AsyncGenerator[str,None]:
+        '''A cached response is replayed as a single chunk, only the streams read to the end are stored'''
+        if not self.cacheable():
+            self.bypass()
+            async for chunk in self.llm.async_stream(messages,json=json):
+                yield chunk
+            self.tokens=self.llm.tokens
+            return
+        key,normalized=self.keys(messages,output_mode(json,stream=True))
+        if entry:=self.lookup(key,normalized):
+            value,size,tokens=entry
+            self.hit(size,tokens)
+            yield decode_response(value).content
+            return
+        chunks=[]
+        completed=False
+        stream=self.llm.async_stream(messages,json=json)
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+            completed=True
+        finally:
+            await stream.aclose()
+            if completed:
+                self.miss(key,normalized,encode_response(AIMessage(''.join(chunks))))
+            else:
+                self.bypass()
+
+    def bind_tools(self,tools:list[Tool])->'CachedInference':
+        '''The tools are bound to the provider and are part of the key, the copy shares the cache'''
+        bound=copy(self)
+        bound.llm=self.llm.bind_tools(tools)
+        bound.tools=tools
+        return bound
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM entries')
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        self.llm.close()
+
+def json_dumps(obj)->str:
+    return json.dumps(obj,sort_keys=True,default=str)
+
+def normalize_content(content):
+    if isinstance(content,str):
+        return CURRENT_DATETIME_PATTERN.sub(r'\1Current \2: <now>',content)
+    if isinstance(content,dict):
+        return {key:normalize_content(value) if key!='image' else value for key,value in content.items()}
+    return content
+
+def serialize_message(message:BaseMessage,normalize:bool=False)->dict:
+    if isinstance(message,ImageMessage):
+        text,image=message.content
+        content={'text':text,'image':sha256(image.encode()).hexdigest()}
+    elif isinstance(message,ToolMessage):
+        content={'name':message.name,'args':message.args}
+    else:
+        content=message.content
+    if normalize:
+        content=normalize_content(content)
+    return {'role':message.role,'content':content}
+
+def output_mode(json:bool=False,model:BaseModel=None,stream:bool=False)->str:
+    if model:
+        return f'model:{sha256(json_dumps(model.model_json_schema()).encode()).hexdigest()}'
+    return 'stream' if stream else ('json' if json else 'text')
+
+def request_key(model:str,temperature:float,messages:list[BaseMessage],mode:str,normalize:bool=False,tools:list[Tool]=None)->str:
+    '''Hash of everything that decides the response of a request'''
+    request={
+        'model':model,
+        'temperature':temperature,
+        'mode':mode,
+        'messages':[serialize_message(message,normalize) for message in messages]
+    }
+    # Left out without tools, so the keys of the requests without them stay the same
+    if tools:
+        request['tools']=[{'name':tool.function_name,'parameters':tool.json_schema()} for tool in tools]
+    return sha256(json_dumps(request).encode()).hexdigest()
+
+def encode_response(response)->str:
+    if isinstance(response,BaseModel):
+        return json_dumps({'type':'model','content':response.model_dump(mode='json')})
+    if isinstance(response,ToolMessage):
+        return json_dumps({'type':'tool','id':response.id,'name':response.name,'args':response.args})
+    return json_dumps({'type':'ai','content':response.content})
+
+def decode_response(value:str,model:BaseModel=None):
+    data=json.loads(value)
+    if data['type']=='model':
+        return model.model_validate(data['content'])
+    if data['type']=='tool':
+        return ToolMessage(id=data['id'],name=data['name'],args=data['args'])
+    return AIMessage(data['content'])
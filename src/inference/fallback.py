@@ -0,0 +1,314 @@
+from concurrent.futures import ThreadPoolExecutor,Future,wait,FIRST_COMPLETED
+from src.message import AIMessage,BaseMessage,ToolMessage
+from src.inference import BaseInference,InferenceError,is_retryable
+from src.tool import Tool
+from typing import Generator,AsyncGenerator,Literal
+from dataclasses import dataclass
+from src.metrics import percentiles
+from contextvars import copy_context
+from time import monotonic,perf_counter
+from collections import deque
+from copy import copy
+from pydantic import BaseModel
+from threading import Lock
+import asyncio
+
+@dataclass
+class FallbackConfig:
+    # Send the request to the next provider too when the current one is slower than usual
+    hedge:bool=True
+    # The usual latency of a provider, as a percentile of its recent calls
+    percentile:int=90
+    # Calls needed before the percentile is trusted, until then `hedge_after` is used
+    min_samples:int=20
+    # Seconds before hedging while the history is too short, None to not hedge until then
+    hedge_after:float|None=None
+    # Extra requests in flight at most, on top of the first one
+    max_hedges:int=1
+    # Latencies kept per provider
+    history:int=100
+    # Consecutive failures that open the circuit of a provider
+    failure_threshold:int=3
+    # Seconds an open circuit waits before letting a trial request through
+    recovery_time:float=30.0
+
+class CircuitBreaker:
+    '''Stops sending requests to a provider that keeps failing.
+
+    The circuit opens after `failure_threshold` consecutive failures and the provider is skipped. Only the
+    failures of the provider count (dropped connections, timeouts, 429 and 5xx), not those of the request.
+    After `recovery_time` it is half-open and a single trial request goes through, which closes
+    the circuit when it succeeds and opens it again when it fails.'''
+    def __init__(self,failure_threshold:int=3,recovery_time:float=30.0):
+        self.failure_threshold=failure_threshold
+        self.recovery_time=recovery_time
+        self.failures=0
+        self.opened:float|None=None
+        self.trial=False
+        self.lock=Lock()
+
+    @property
+    def state(self)->Literal['closed','open','half-open']:
+        with self.lock:
+            if self.opened is None:
+                return 'closed'
+            return 'half-open' if monotonic()-self.opened>=self.recovery_time else 'open'
+
+    def allow(self)->bool:
+        '''Whether a request can be sent now, a half-open circuit lets one trial through at a time'''
+        with self.lock:
+            if self.opened is None:
+                return True
+            if monotonic()-self.opened<self.recovery_time or self.trial:
+                return False
+            self.trial=True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures=0
+            self.opened=None
+            self.trial=False
+
+    def failure(self,error:BaseException):
+        if not is_retryable(error):
+            # A rejected request (400, 422) or an invalid response says nothing about the health of the provider
+            self.release()
+            return
+        with self.lock:
+            self.failures+=1
+            if self.trial or self.failures>=self.failure_threshold:
+                self.opened=monotonic()
+            self.trial=False
+
+    def release(self):
+        '''A request that ended without an outcome, e.g. a cancelled hedge, frees the trial'''
+        with self.lock:
+            self.trial=False
+
+class FallbackInference(BaseInference):
+    '''Tries a chain of inference providers in order, e.g. Gemini, then Groq, then a local Ollama.
+
+    A provider that fails is followed by the next one and a provider whose circuit is open is skipped.
+    With hedging, when a provider has not answered within its usual latency the request is also sent
+    to the next one, the first response wins and the other request is cancelled. Streams fall back
+    only before their first chunk, since the chunks already yielded cannot be taken back.'''
+    def __init__(self,llms:list[BaseInference],config:FallbackConfig=None):
+        if not llms:
+            raise ValueError('The fallback chain needs at least one provider')
+        primary=llms[0]
+        super().__init__(primary.model,api_key=primary.api_key,base_url=primary.base_url,tools=primary.tools,temperature=primary.temperature,client_pool=primary.client_pool,rate_limit=primary.rate_limit)
+        self.llms=llms
+        self.config=config if config else FallbackConfig()
+        self.breakers=[CircuitBreaker(self.config.failure_threshold,self.config.recovery_time) for _ in llms]
+        self.latencies=[deque(maxlen=self.config.history) for _ in llms]
+        # The sync hedges run on threads, a thread cannot be cancelled so the slower call is left to finish
+        # and the pool has room for the calls still running behind the ones that won
+        self.executor=ThreadPoolExecutor(max_workers=32,thread_name_prefix='fallback')
+
+    def candidates(self)->Generator[int,None,None]:
+        '''The providers in order, the circuit is checked only when the next one is needed'''
+        for index,breaker in enumerate(self.breakers):
+            if breaker.allow():
+                yield index
+
+    def hedge_delay(self,index:int,hedges:int)->float|None:
+        '''Seconds to wait on a provider before hedging, None to wait for it'''
+        if not self.config.hedge or hedges>=self.config.max_hedges:
+            return None
+        latencies=self.latencies[index]
+        if len(latencies)<self.config.min_samples:
+            return self.config.hedge_after
+        point=self.config.percentile
+        return percentiles(list(latencies),(point,))[f'p{point}']
+
+    def succeeded(self,index:int,latency:float):
+        self.breakers[index].success()
+        self.latencies[index].append(latency)
+
+    def exhausted(self,errors:list[Exception]):
+        if errors:
+            raise errors[-1]
+        raise InferenceError('Every provider in the fallback chain has an open circuit',provider=type(self).__name__)
+
+    def attempt(self,index:int,messages:list[BaseMessage],json:bool,model:BaseModel):
+        start=perf_counter()
+        try:
+            response=self.llms[index].invoke(messages,json=json,model=model)
+        except Exception as error:
+            self.breakers[index].failure(error)
+            raise
+        self.succeeded(index,perf_counter()-start)
+        return response
+
+    async def async_attempt(self,index:int,messages:list[BaseMessage],json:bool,model:BaseModel):
+        start=perf_counter()
+        try:
+            response=await self.llms[index].async_invoke(messages,json=json,model=model)
+        except asyncio.CancelledError:
+            self.breakers[index].release()
+            raise
+        except Exception as error:
+            self.breakers[index].failure(error)
+            raise
+        self.succeeded(index,perf_counter()-start)
+        return response
+
+    def invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        candidates=self.candidates()
+        pending:dict[Future,int]={}
+        errors:list[Exception]=[]
+        hedges=0
+
+        def launch()->bool:
+            index=next(candidates,None)
+            if index is None:
+                return False
+            # The metrics labels of the caller go along to the thread
+            context=copy_context()
+            pending[self.executor.submit(context.run,self.attempt,index,messages,json,model)]=index
+            return True
+
+        launch()
+        while pending:
+            delay=self.hedge_delay(next(iter(pending.values())),hedges) if len(pending)==1 else None
+            done,_=wait(pending,timeout=delay,return_when=FIRST_COMPLETED)
+            if not done:
+                # Too slow, race the next provider, or stop hedging when there is none
+                hedges=hedges+1 if launch() else self.config.max_hedges
+                continue
+            for future in done:
+                index=pending.pop(future)
+                try:
+                    response=future.result()
+                except Exception as error:
+                    errors.append(error)
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                self.tokens=self.llms[index].tokens
+                return response
+            if not pending:
+                launch()
+        self.exhausted(errors)
+
+    async def async_invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        candidates=self.candidates()
+        pending:dict[asyncio.Task,int]={}
+        errors:list[Exception]=[]
+        hedges=0
+
+        def launch()->bool:
+            index=next(candidates,None)
+            if index is None:
+                return False
+            pending[asyncio.create_task(self.async_attempt(index,messages,json,model))]=index
+            return True
+
+        launch()
+        try:
+            while pending:
+                delay=self.hedge_delay(next(iter(pending.values())),hedges) if len(pending)==1 else None
+                done,_=await asyncio.wait(pending,timeout=delay,return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedges=hedges+1 if launch() else self.config.max_hedges
+                    continue
+                for task in done:
+                    index=pending.pop(task)
+                    try:
+                        response=task.result()
+                    except Exception as error:
+                        errors.append(error)
+                        continue
+                    self.tokens=self.llms[index].tokens
+                    return response
+                if not pending:
+                    launch()
+        finally:
+            # The slower request is cancelled, which closes its connection and stops the generation
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending,return_exceptions=True)
+        self.exhausted(errors)
+
+    def stream(self,messages:list[BaseMessage],json:bool=False)->Generator[str,None,None]:
+        errors:list[Exception]=[]
+        for index in self.candidates():
+            llm,breaker=self.llms[index],self.breakers[index]
+            start=perf_counter()
+            started=False
+            stream=llm.stream(messages,json=json)
+            try:
+                for chunk in stream:
+                    started=True
+                    yield chunk
+            except Exception as error:
+                breaker.failure(error)
+                if started:
+                    raise
+                errors.append(error)
+                continue
+            except (GeneratorExit,asyncio.CancelledError):
+                # Closed by the consumer before the end, e.g. once the StreamParser has the action
+                if started:
+                    self.succeeded(index,perf_counter()-start)
+                    self.tokens=llm.tokens
+                else:
+                    breaker.release()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            finally:
+                stream.close()
+            self.succeeded(index,perf_counter()-start)
+            self.tokens=llm.tokens
+            return
+        self.exhausted(errors)
+
+    async def async_stream(self,messages:list[BaseMessage],json:bool=False)->AsyncGenerator[str,None]:
+        errors:list[Exception]=[]
+        for index in self.candidates():
+            llm,breaker=self.llms[index],self.breakers[index]
+            start=perf_counter()
+            started=False
+            stream=llm.async_stream(messages,json=json)
+            try:
+                async for chunk in stream:
+                    started=True
+                    yield chunk
+            except Exception as error:
+                breaker.failure(error)
+                if started:
+                    raise
+                errors.append(error)
+                continue
+            except (GeneratorExit,asyncio.CancelledError):
+                if started:
+                    self.succeeded(index,perf_counter()-start)
+                    self.tokens=llm.tokens
+                else:
+                    breaker.release()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            finally:
+                await stream.aclose()
+            self.succeeded(index,perf_counter()-start)
+            self.tokens=llm.tokens
+            return
+        self.exhausted(errors)
+
+    def bind_tools(self,tools:list[Tool])->'FallbackInference':
+        '''The copy binds the tools to every provider and shares their circuits and latencies'''
+        bound=copy(self)
+        bound.llms=[llm.bind_tools(tools) for llm in self.llms]
+        bound.tools=tools
+        return bound
+
+    def close(self):
+        self.executor.shutdown(wait=False,cancel_futures=True)
+        for llm in self.llms:
+            llm.close()
@@ -1,128 +1,34 @@
 from src.message import AIMessage,BaseMessage,HumanMessage,ImageMessage,SystemMessage,ToolMessage
-from tenacity import retry,stop_after_attempt,retry_if_exception_type
-from requests import get,RequestException,ConnectionError
-from ratelimit import limits,sleep_and_retry
-from src.inference import BaseInference,Token
-from httpx import Client,AsyncClient,HTTPError
+from src.metrics import tracked
+from src.inference.limiter import limited,RateLimit
+from src.inference import BaseInference,Token,InferenceError,retried
+from src.client import ClientPool
 from pydantic import BaseModel
-from typing import Literal
-from json import loads
+from typing import Literal,Generator,AsyncGenerator
+from json import loads,dumps
+from time import monotonic
+from hashlib import sha256
+from httpx import HTTPError,Response
 from uuid import uuid4
 
+# Gemini does not cache a prefix shorter than this, estimated at four characters per token
+MIN_CACHE_TOKENS=1024
+# Seconds before its expiry that a cached content is no longer used, so a request never refers to an expired one
+CACHE_RENEW_MARGIN=30
+
 class ChatGemini(BaseInference):
-    def __init__(self,model:str,api_version:Literal['v1','v1beta','v1alpha']='v1beta',modality:Literal['text','audio']='text',api_key:str='',base_url:str='',tools:list=[],temperature:float=0.5):
-        super().__init__(model,api_key=api_key,base_url=base_url,tools=tools,temperature=temperature)
+    def __init__(self,model:str,api_version:Literal['v1','v1beta','v1alpha']='v1beta',modality:Literal['text','audio']='text',api_key:str='',base_url:str='',tools:list=[],temperature:float=0.5,client_pool:ClientPool=None,rate_limit:RateLimit=None,prompt_cache:bool=False,prompt_cache_ttl:int=600):
+        super().__init__(model,api_key=api_key,base_url=base_url,tools=tools,temperature=temperature,client_pool=client_pool,rate_limit=rate_limit)
         self.api_version=api_version
         self.modality=modality
+        # Cache the system instruction and the tools with the cachedContents API, billed at a discount on every step
+        self.prompt_cache=prompt_cache
+        self.prompt_cache_ttl=prompt_cache_ttl
+        # The cached contents by the hash of their prefix and the prefixes that Gemini refused to cache
+        self.cached_contents:dict[str,tuple[str,float]]={}
+        self.uncacheable:set[str]=set()
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json=False,model:BaseModel|None=None) -> AIMessage|ToolMessage|BaseModel:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:generateContent"
-        params={'key':self.api_key}
-        contents=[]
-        system_instruct=None
-        for message in messages:
-            if isinstance(message,HumanMessage):
-                contents.append({
-                    'role':'user',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,AIMessage):
-                contents.append({
-                    'role':'model',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append({
-                        'role':'user',
-                        'parts':[{
-                            'text':text
-                    },
-                    {
-                        'inline_data':{
-                            'mime_type':'image/jpeg',
-                            'data': image
-                        }
-                    }]
-                })
-            elif isinstance(message,SystemMessage):
-                system_instruct={
-                    'parts':{
-                        'text': self.structured(message,model) if model else message.content
-                    }
-                }
-            else:
-                raise Exception("Invalid Message")
-
-        payload={
-            'contents': contents,
-            'generationConfig':{
-                'temperature': temperature,
-                'responseMimeType':'application/json' if json or model else 'text/plain',
-                'responseModalities': [self.modality]
-            }
-        }
-        if self.tools:
-            payload['tools']=[
-                {
-                    'function_declarations':[
-                        {
-                            'name': tool.name,
-                            'description': tool.description,
-                            'parameters': tool.schema
-                        }
-                    for tool in self.tools]
-                }
-            ]
-        if system_instruct:
-            payload['system_instruction']=system_instruct
-        try:
-            with Client() as client:
-                response=client.post(url=url,headers=headers,json=payload,params=params,timeout=None)
-            json_obj=response.json()
-            # print(json_obj)
-            if json_obj.get('error'):
-                raise Exception(json_obj['error']['message'])
-            message=json_obj['candidates'][0]['content']['parts'][0]
-            usage_metadata=json_obj['usageMetadata']
-            input,output,total=usage_metadata['promptTokenCount'],usage_metadata['candidatesTokenCount'],usage_metadata['totalTokenCount']
-            self.tokens=Token(input=input,output=output,total=total)
-            # print(message)
-            if model:
-                return model.model_validate_json(message['text'])
-            if json:
-                content=loads(message['text'])
-                return AIMessage(content)
-            if message['text']:
-                content=message['text']
-                return AIMessage(content)
-            else:
-                tool_call=message['functionCall']
-                return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['args'])
-                
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    async def async_invoke(self, messages: list[BaseMessage],json=False,model:BaseModel=None) -> AIMessage|ToolMessage|BaseModel:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
-        params={'key':self.api_key}
+    def payload(self,messages:list[BaseMessage],json:bool=False,model:BaseModel|None=None)->dict:
         contents=[]
         system_instruction=None
         for message in messages:
@@ -149,7 +55,7 @@ class ChatGemini(BaseInference):
                     },
                     {
                         'inline_data':{
-                            'mime_type':'image/jpeg',
+                            'mime_type':message.mime_type,
                             'data': image
                         }
                     }]
@@ -166,7 +72,7 @@ class ChatGemini(BaseInference):
         payload={
             'contents': contents,
             'generationConfig':{
-                'temperature': temperature,
+                'temperature': self.temperature,
                 'responseMimeType':'application/json' if json or model else 'text/plain',
                 'responseModalities': [self.modality]
             }
@@ -176,63 +82,237 @@ class ChatGemini(BaseInference):
                 {
                     'function_declarations':[
                         {
-                            'name': tool.name,
+                            'name': tool.function_name,
                             'description': tool.description,
-                            'parameters': tool.schema
+                            'parameters': function_parameters(tool.json_schema())
                         }
                     for tool in self.tools]
                 }
             ]
         if system_instruction:
             payload['system_instruction']=system_instruction
+        return payload
+
+    def prefix(self,payload:dict)->tuple[str,dict]|None:
+        '''The part of a request that stays the same from step to step and its hash, None when too short to cache'''
+        prefix={key:payload[key] for key in ('system_instruction','tools') if key in payload}
+        text=dumps(prefix,sort_keys=True)
+        if len(text)//4<MIN_CACHE_TOKENS:
+            return None
+        return sha256(f'{self.model}{text}'.encode()).hexdigest(),prefix
+
+    def lookup_cache(self,key:str)->str|None:
+        entry=self.cached_contents.get(key)
+        if entry is None:
+            return None
+        name,expires=entry
+        if monotonic()>=expires:
+            del self.cached_contents[key]
+            return None
+        return name
+
+    def cache_request(self,prefix:dict)->tuple[str,dict,dict]:
+        url=f"https://generativelanguage.googleapis.com/{self.api_version}/cachedContents"
+        body={'model':f'models/{self.model}','ttl':f'{self.prompt_cache_ttl}s',**prefix}
+        return url,body,{'key':self.api_key}
+
+    def cache_created(self,key:str,error:Exception=None,name:str=None)->str|None:
+        if error is not None:
+            # A model without caching or a refused prefix is sent in full from now on, other errors are tried again
+            if isinstance(error,InferenceError) and error.status_code is not None and error.status_code<500:
+                self.uncacheable.add(key)
+            return None
+        # Expired entries are dropped as new ones come in
+        now=monotonic()
+        self.cached_contents={cache_key:entry for cache_key,entry in self.cached_contents.items() if entry[1]>now}
+        self.cached_contents[key]=(name,now+self.prompt_cache_ttl-CACHE_RENEW_MARGIN)
+        return name
+
+    def cached_content(self,payload:dict)->str|None:
+        '''The cached content holding the prefix of the request, created on first use'''
+        prefix=self.prefix(payload)
+        if prefix is None:
+            return None
+        key,prefix=prefix
+        if key in self.uncacheable:
+            return None
+        if name:=self.lookup_cache(key):
+            return name
+        url,body,params=self.cache_request(prefix)
         try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,headers=headers,json=payload,params=params,timeout=None)
-            json_obj=response.json()
-            # print(json_obj)
-            if json_obj.get('error'):
-                raise Exception(json_obj['error']['message'])
-            message=json_obj['candidates'][0]['content']['parts'][0]
-            usage_metadata=json_obj['usageMetadata']
-            input,output,total=usage_metadata['promptTokenCount'],usage_metadata['candidatesTokenCount'],usage_metadata['totalTokenCount']
-            self.tokens=Token(input=input,output=output,total=total)
-            if model:
-                return model.model_validate_json(message['text'])
-            if json:
-                content=loads(message['text'])
-                return AIMessage(content)
-            if message['text']:
-                content=message['text']
-                return AIMessage(content)
-            else:
-                tool_call=message['functionCall']
-                return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['args'])
-                
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+            response=self.client.post(url=url,headers=self.headers,json=body,params=params)
+            name=self.check(response)['name']
+        except (InferenceError,HTTPError) as error:
+            return self.cache_created(key,error=error)
+        return self.cache_created(key,name=name)
+
+    async def async_cached_content(self,payload:dict)->str|None:
+        '''The cached content holding the prefix of the request, created on first use'''
+        prefix=self.prefix(payload)
+        if prefix is None:
+            return None
+        key,prefix=prefix
+        if key in self.uncacheable:
+            return None
+        if name:=self.lookup_cache(key):
+            return name
+        url,body,params=self.cache_request(prefix)
+        try:
+            response=await self.async_client.post(url=url,headers=self.headers,json=body,params=params)
+            name=self.check(response)['name']
+        except (InferenceError,HTTPError) as error:
+            return self.cache_created(key,error=error)
+        return self.cache_created(key,name=name)
+
+    def use_cache(self,payload:dict,name:str)->dict:
+        '''The request with its prefix replaced by the cached content'''
+        payload={key:value for key,value in payload.items() if key not in ('system_instruction','tools')}
+        payload['cachedContent']=name
+        return payload
+
+    def cache_missing(self,response:Response)->bool:
+        '''Whether a request failed because its cached content is gone, e.g. deleted or expired early.
+        Any other error (429, 5xx) is left to the retries, resending the full prompt would only add to the load'''
+        if response.status_code==404:
+            return True
+        return response.status_code in (400,403) and 'cached' in response.text.lower()
+
+    def drop_cache(self,name:str):
+        self.cached_contents={key:entry for key,entry in self.cached_contents.items() if entry[0]!=name}
+
+    def response(self,parts:list[dict],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        # A function call can follow a part with the reasoning of the model
+        for part in parts:
+            if 'functionCall' in part:
+                tool_call=part['functionCall']
+                return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call.get('args',{}))
+        text=''.join(part.get('text','') for part in parts)
+        if model:
+            return model.model_validate_json(text)
+        if json:
+            return AIMessage(loads(text))
+        return AIMessage(text)
+
+    @limited
+    @tracked
+    @retried
+    def invoke(self, messages: list[BaseMessage],json=False,model:BaseModel|None=None) -> AIMessage|ToolMessage|BaseModel:
+        headers=self.headers
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:generateContent"
+        params={'key':self.api_key}
+        payload=self.payload(messages,json=json,model=model)
+        if self.prompt_cache and (name:=self.cached_content(payload)):
+            response=self.client.post(url=url,headers=headers,json=self.use_cache(payload,name),params=params)
+            if self.cache_missing(response):
+                # The request is sent in full, the cached content is created again on the next one
+                self.drop_cache(name)
+                response=self.client.post(url=url,headers=headers,json=payload,params=params)
+        else:
+            response=self.client.post(url=url,headers=headers,json=payload,params=params)
+        json_obj=self.check(response)
+        parts=json_obj['candidates'][0]['content']['parts']
+        self.tokens=gemini_usage(json_obj['usageMetadata'])
+        return self.response(parts,json=json,model=model)
+
+    @limited
+    @tracked
+    @retried
+    async def async_invoke(self, messages: list[BaseMessage],json=False,model:BaseModel=None) -> AIMessage|ToolMessage|BaseModel:
+        headers=self.headers
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:generateContent"
+        params={'key':self.api_key}
+        payload=self.payload(messages,json=json,model=model)
+        if self.prompt_cache and (name:=await self.async_cached_content(payload)):
+            response=await self.async_client.post(url=url,headers=headers,json=self.use_cache(payload,name),params=params)
+            if self.cache_missing(response):
+                # The request is sent in full, the cached content is created again on the next one
+                self.drop_cache(name)
+                response=await self.async_client.post(url=url,headers=headers,json=payload,params=params)
+        else:
+            response=await self.async_client.post(url=url,headers=headers,json=payload,params=params)
+        json_obj=self.check(response)
+        parts=json_obj['candidates'][0]['content']['parts']
+        self.tokens=gemini_usage(json_obj['usageMetadata'])
+        return self.response(parts,json=json,model=model)
     
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def stream(self, query:str):
+    @limited
+    @tracked
+    def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        headers=self.headers
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:streamGenerateContent"
+        params={'key':self.api_key,'alt':'sse'}
+        payload=self.payload(messages,json=json)
+        name=self.cached_content(payload) if self.prompt_cache else None
+        if name:
+            payload=self.use_cache(payload,name)
+        with self.client.stream('POST',url=url,headers=headers,json=payload,params=params) as response:
+            if response.is_error:
+                response.read()
+                if name and self.cache_missing(response):
+                    # Recreated on the next request
+                    self.drop_cache(name)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith('data: '):
+                    continue
+                json_obj=loads(line.removeprefix('data: '))
+                usage_metadata=json_obj.get('usageMetadata')
+                if usage_metadata and 'candidatesTokenCount' in usage_metadata:
+                    self.tokens=gemini_usage(usage_metadata)
+                parts=json_obj['candidates'][0].get('content',{}).get('parts',[])
+                yield ''.join(part.get('text','') for part in parts)
+
+    @limited
+    @tracked
+    async def async_stream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
         headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:streamGenerateContent"
+        params={'key':self.api_key,'alt':'sse'}
+        payload=self.payload(messages,json=json)
+        name=await self.async_cached_content(payload) if self.prompt_cache else None
+        if name:
+            payload=self.use_cache(payload,name)
+        async with self.async_client.stream('POST',url=url,headers=headers,json=payload,params=params) as response:
+            if response.is_error:
+                await response.aread()
+                if name and self.cache_missing(response):
+                    # Recreated on the next request
+                    self.drop_cache(name)
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith('data: '):
+                    continue
+                json_obj=loads(line.removeprefix('data: '))
+                usage_metadata=json_obj.get('usageMetadata')
+                if usage_metadata and 'candidatesTokenCount' in usage_metadata:
+                    self.tokens=gemini_usage(usage_metadata)
+                parts=json_obj['candidates'][0].get('content',{}).get('parts',[])
+                yield ''.join(part.get('text','') for part in parts)
     
     def available_models(self):
         url='https://generativelanguage.googleapis.com/v1beta/models'
         headers=self.headers
         params={'key':self.api_key}
-        try:
-            response=get(url=url,headers=headers,params=params)
-            response.raise_for_status()
-            json_obj=response.json()
-            models=json_obj['models']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
-        return [model['displayName'] for model in models]
\ No newline at end of file
+        response=self.client.get(url=url,headers=headers,params=params)
+        json_obj=self.check(response)
+        models=json_obj['models']
+        return [model['displayName'] for model in models]
+
+def gemini_usage(usage_metadata:dict)->Token:
+    return Token(
+        input=usage_metadata['promptTokenCount'],
+        output=usage_metadata['candidatesTokenCount'],
+        total=usage_metadata['totalTokenCount'],
+        cached=usage_metadata.get('cachedContentTokenCount',0)
+    )
+
+SCHEMA_KEYS={'type','format','description','nullable','enum','properties','required','items','minItems','maxItems'}
+
+def function_parameters(schema:dict)->dict:
+    '''Keep the part of a JSON schema that the function declarations of Gemini accept'''
+    parameters={key:value for key,value in schema.items() if key in SCHEMA_KEYS}
+    if 'properties' in parameters:
+        parameters['properties']={name:function_parameters(property) for name,property in parameters['properties'].items()}
+    if 'items' in parameters:
+        parameters['items']=function_parameters(parameters['items'])
+    return parameters
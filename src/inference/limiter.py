@@ -0,0 +1,187 @@
+from inspect import iscoroutinefunction,isasyncgenfunction,isgeneratorfunction
+from dataclasses import dataclass
+from functools import wraps
+from threading import Lock
+from hashlib import sha256
+from time import monotonic,sleep
+import asyncio
+
+@dataclass
+class RateLimit:
+    requests_per_minute:float=15
+    # None when the provider does not limit the tokens
+    tokens_per_minute:float|None=None
+    # Tokens expected in the response, added to the estimate of the prompt before the usage is known
+    expected_output_tokens:int=500
+
+@dataclass
+class Headroom:
+    '''What can be sent right now without waiting.'''
+    requests:float
+    tokens:float|None
+    # Seconds until the next request would be admitted
+    wait:float
+
+class RateLimiter:
+    '''Token buckets for the requests and the tokens per minute of a provider.
+
+    Each call reserves a request and its estimated tokens up front, so the buckets can go negative
+    and every caller waits for the deficit ahead of it to refill. The callers are admitted in the order
+    they arrived, from threads or from any event loop, and an async caller only sleeps its own task.
+    The estimate is replaced by the real usage once the response reports it.'''
+    def __init__(self,rate_limit:RateLimit=None):
+        self.rate_limit=rate_limit if rate_limit else RateLimit()
+        self.request_rate=self.rate_limit.requests_per_minute/60
+        self.token_rate=self.rate_limit.tokens_per_minute/60 if self.rate_limit.tokens_per_minute else None
+        self.requests=self.rate_limit.requests_per_minute
+        self.tokens=self.rate_limit.tokens_per_minute or 0
+        self.updated=monotonic()
+        self.lock=Lock()
+
+    def refill(self,now:float):
+        elapsed=now-self.updated
+        self.updated=now
+        self.requests=min(self.rate_limit.requests_per_minute,self.requests+elapsed*self.request_rate)
+        if self.token_rate:
+            self.tokens=min(self.rate_limit.tokens_per_minute,self.tokens+elapsed*self.token_rate)
+
+    def deficit(self,requests:float,tokens:float)->float:
+        '''Seconds until the buckets refill up to the given levels'''
+        wait=max(0,-requests/self.request_rate)
+        if self.token_rate:
+            wait=max(wait,-tokens/self.token_rate)
+        return wait
+
+    def reserve(self,tokens:int=0)->float:
+        '''Take a request and the tokens from the buckets and return the seconds to wait before sending it'''
+        with self.lock:
+            self.refill(monotonic())
+            self.requests-=1
+            if self.token_rate:
+                self.tokens-=tokens
+            return self.deficit(self.requests,self.tokens)
+
+    def refund(self,tokens:int=0,requests:int=1):
+        '''Give back a reservation that was not used, e.g. when the caller was cancelled while waiting'''
+        with self.lock:
+            self.refill(monotonic())
+            self.requests=min(self.rate_limit.requests_per_minute,self.requests+requests)
+            if self.token_rate:
+                self.tokens=min(self.rate_limit.tokens_per_minute,self.tokens+tokens)
+
+    def reconcile(self,estimated:int,actual:int):
+        '''Correct the tokens taken by the estimate with the usage reported by the provider'''
+        if not self.token_rate:
+            return
+        with self.lock:
+            self.tokens=min(self.rate_limit.tokens_per_minute,self.tokens+estimated-actual)
+
+    def acquire(self,tokens:int=0):
+        wait=self.reserve(tokens)
+        if wait>0:
+            sleep(wait)
+
+    async def async_acquire(self,tokens:int=0):
+        wait=self.reserve(tokens)
+        if wait>0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.refund(tokens)
+                raise
+
+    def headroom(self)->Headroom:
+        with self.lock:
+            self.refill(monotonic())
+            return Headroom(
+                requests=max(0,self.requests),
+                tokens=max(0,self.tokens) if self.token_rate else None,
+                wait=self.deficit(self.requests-1,self.tokens)
+            )
+
+    def estimate(self,messages)->int:
+        '''Rough token count of a prompt, four characters per token'''
+        if isinstance(messages,str):
+            characters=len(messages)
+        else:
+            characters=0
+            for message in messages:
+                content=getattr(message,'content',message)
+                # The image messages hold (text, image), only the text is counted
+                if isinstance(content,tuple):
+                    content=content[0]
+                characters+=len(str(content))
+        return characters//4+self.rate_limit.expected_output_tokens
+
+limiters:dict[tuple[str,str],RateLimiter]={}
+limiters_lock=Lock()
+
+def get_limiter(provider:str,api_key:str='',rate_limit:RateLimit=None)->RateLimiter:
+    '''The limiter shared by every instance of a provider using the same API key.
+
+    The first instance to ask for it sets its limits.'''
+    key=(provider,sha256((api_key or '').encode()).hexdigest())
+    with limiters_lock:
+        limiter=limiters.get(key)
+        if limiter is None:
+            limiter=limiters[key]=RateLimiter(rate_limit)
+        return limiter
+
+def limited(function):
+    '''Wait for the rate limiter of the provider before calling it.
+
+    Works on the sync, async, generator and async generator methods of `BaseInference`
+    and reconciles the estimated tokens with `self.tokens` once the call is done.'''
+    def prepare(self,args,kwargs):
+        limiter=self.limiter
+        messages=args[0] if args else kwargs.get('messages',kwargs.get('query',''))
+        return limiter,limiter.estimate(messages),self.tokens
+
+    def finish(self,limiter:RateLimiter,estimated:int,tokens):
+        # The usage is only known when the provider reported a new one during this call
+        if self.tokens is not tokens:
+            limiter.reconcile(estimated,self.tokens.total)
+
+    if isasyncgenfunction(function):
+        @wraps(function)
+        async def async_generator_wrapper(self,*args,**kwargs):
+            limiter,estimated,tokens=prepare(self,args,kwargs)
+            await limiter.async_acquire(estimated)
+            stream=function(self,*args,**kwargs)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                # Closing the provider's stream cancels the generation when the consumer stops early
+                await stream.aclose()
+                finish(self,limiter,estimated,tokens)
+        return async_generator_wrapper
+    if iscoroutinefunction(function):
+        @wraps(function)
+        async def async_wrapper(self,*args,**kwargs):
+            limiter,estimated,tokens=prepare(self,args,kwargs)
+            await limiter.async_acquire(estimated)
+            try:
+                return await function(self,*args,**kwargs)
+            finally:
+                finish(self,limiter,estimated,tokens)
+        return async_wrapper
+    if isgeneratorfunction(function):
+        @wraps(function)
+        def generator_wrapper(self,*args,**kwargs):
+            limiter,estimated,tokens=prepare(self,args,kwargs)
+            limiter.acquire(estimated)
+            try:
+                yield from function(self,*args,**kwargs)
+            finally:
+                finish(self,limiter,estimated,tokens)
+        return generator_wrapper
+    @wraps(function)
+    def wrapper(self,*args,**kwargs):
+        limiter,estimated,tokens=prepare(self,args,kwargs)
+        limiter.acquire(estimated)
+        try:
+            return function(self,*args,**kwargs)
+        finally:
+            finish(self,limiter,estimated,tokens)
+    return wrapper
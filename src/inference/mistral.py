@@ -1,214 +1,149 @@
 from src.message import AIMessage,BaseMessage,SystemMessage,ImageMessage,HumanMessage,ToolMessage
-from requests import RequestException,HTTPError,ConnectionError
-from tenacity import retry,stop_after_attempt,retry_if_exception_type
-from ratelimit import limits,sleep_and_retry
-from src.inference import BaseInference,Token
-from httpx import Client,AsyncClient
+from src.metrics import tracked
+from src.inference.limiter import limited
+from src.inference import BaseInference,retried,openai_usage,tool_message
 from pydantic import BaseModel
-from typing import Generator
+from typing import Generator,AsyncGenerator
 from json import loads
-from uuid import uuid4
-import requests
 
 class ChatMistral(BaseInference):
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
-        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "https://api.mistral.ai/v1/chat/completions"
+    def payload(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None,stream:bool=False)->dict:
         contents=[]
         for message in messages:
             if isinstance(message,SystemMessage):
-                if model:
-                    message.content=self.structured(message,model) 
-                contents.append(message.to_dict())
+                contents.append({'role':'system','content':self.structured(message,model) if model else message.content})
             if isinstance(message,(HumanMessage,AIMessage)):
                 contents.append(message.to_dict())
             if isinstance(message,ImageMessage):
                 text,image_data=message.content
-                contents.append([
-                    {
-                        'role':'user',
-                        'content':{
-                            {
-                                'type':'text',
-                                'text':text
-                            },
-                            {
-                                'type':'image_url',
-                                'image_url':image_data
-                            }
+                contents.append({
+                    'role':'user',
+                    'content':[
+                        {
+                            'type':'text',
+                            'text':text
+                        },
+                        {
+                            'type':'image_url',
+                            'image_url':f'data:{message.mime_type};base64,{image_data}'
                         }
-                    }
-                ])
+                    ]
+                })
 
         payload={
             "model": self.model,
             "messages": contents,
-            "temperature": temperature,
+            "temperature": self.temperature,
             "response_format": {
                 "type": "json_object" if json or model else "text"
             },
-            "stream":False,
+            "stream":stream,
         }
         if self.tools:
             payload["tools"]=[{
                 'type':'function',
                 'function':{
-                    'name':tool.name,
+                    'name':tool.function_name,
                     'description':tool.description,
-                    'parameters':tool.schema
+                    'parameters':tool.json_schema()
                 }
             } for tool in self.tools]
-        try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
-            json_object=response.json()
-            # print(json_object)
-            if json_object.get('error'):
-                raise Exception(json_object['error']['message'])
-            message=json_object['choices'][0]['message']
-            usage_metadata=json_object['usage']
-            input,output,total=usage_metadata['prompt_tokens'],usage_metadata['completion_tokens'],usage_metadata['total_tokens']
-            self.tokens=Token(input=input,output=output,total=total)
-            if model:
-                return model.model_validate_json(message.get('content'))
-            if json:
-                return AIMessage(loads(message.get('content')))
-            if message.get('content'):
-                return AIMessage(message.get('content'))
-            else:
-                tool_call=message.get('tool_calls')[0]['function']
-                return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['arguments']) 
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-    
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    async def async_invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        return payload
+
+    @limited
+    @tracked
+    @retried
+    def invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "https://api.mistral.ai/v1/chat/completions"
-        contents=[]
-        for message in messages:
-            if isinstance(message,SystemMessage):
-                if model:
-                    message.content=self.structured(message,model) 
-                contents.append(message.to_dict())
-            if isinstance(message,(HumanMessage,AIMessage)):
-                contents.append(message.to_dict())
-            if isinstance(message,ImageMessage):
-                text,image_data=message.content
-                contents.append([
-                    {
-                        'role':'user',
-                        'content':{
-                            {
-                                'type':'text',
-                                'text':text
-                            },
-                            {
-                                'type':'image_url',
-                                'image_url':image_data
-                            }
-                        }
-                    }
-                ])
+        payload=self.payload(messages,json=json,model=model)
+        response=self.client.post(url=url,json=payload,headers=headers)
+        json_object=self.check(response)
+        message=json_object['choices'][0]['message']
+        usage_metadata=json_object['usage']
+        self.tokens=openai_usage(usage_metadata)
+        if model:
+            return model.model_validate_json(message.get('content'))
+        if json:
+            return AIMessage(loads(message.get('content')))
+        if tool_call:=tool_message(message):
+            return tool_call
+        return AIMessage(message.get('content') or '')
 
-        payload={
-            "model": self.model,
-            "messages": contents,
-            "temperature": temperature,
-            "response_format": {
-                "type": "json_object" if json or model else "text"
-            },
-            "stream":False,
-        }
-        if self.tools:
-            payload["tools"]=[{
-                'type':'function',
-                'function':{
-                    'name':tool.name,
-                    'description':tool.description,
-                    'parameters':tool.schema
-                }
-            } for tool in self.tools]
-        try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,json=payload,headers=headers,timeout=None)
-            json_object=response.json()
-            # print(json_object)
-            if json_object.get('error'):
-                raise Exception(json_object['error']['message'])
-            message=json_object['choices'][0]['message']
-            usage_metadata=json_object['usage']
-            input,output,total=usage_metadata['prompt_tokens'],usage_metadata['completion_tokens'],usage_metadata['total_tokens']
-            self.tokens=Token(input=input,output=output,total=total)
-            if model:
-                return model.model_validate_json(message.get('content'))
-            if json:
-                return AIMessage(loads(message.get('content')))
-            if message.get('content'):
-                return AIMessage(message.get('content'))
-            else:
-                tool_call=message.get('tool_calls')[0]['function']
-                return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['arguments']) 
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+    @limited
+    @tracked
+    @retried
+    async def async_invoke(self, messages: list[BaseMessage],json=False,model:BaseModel=None) -> AIMessage|ToolMessage|BaseModel:
+        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
+        headers=self.headers
+        url=self.base_url or "https://api.mistral.ai/v1/chat/completions"
+        payload=self.payload(messages,json=json,model=model)
+        response=await self.async_client.post(url=url,json=payload,headers=headers)
+        json_object=self.check(response)
+        message=json_object['choices'][0]['message']
+        usage_metadata=json_object['usage']
+        self.tokens=openai_usage(usage_metadata)
+        if model:
+            return model.model_validate_json(message.get('content'))
+        if json:
+            return AIMessage(loads(message.get('content')))
+        if tool_call:=tool_message(message):
+            return tool_call
+        return AIMessage(message.get('content') or '')
     
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+    @limited
+    @tracked
     def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "https://api.groq.com/openai/v1/chat/completions"
-        messages=[message.to_dict() for message in messages]
-        payload={
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "stream":True,
-        }
-        if json:
-            payload["response_format"]={
-                "type": "json_object"
-            }
-        try:
-            response=requests.post(url=url,json=payload,headers=headers,timeout=None)
+        url=self.base_url or "https://api.mistral.ai/v1/chat/completions"
+        payload=self.payload(messages,json=json,stream=True)
+        with self.client.stream('POST',url=url,json=payload,headers=headers) as response:
+            if response.is_error:
+                response.read()
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith('data: '):
+                    continue
+                chunk=line.removeprefix('data: ')
+                if chunk=='[DONE]':
+                    break
+                json_object=loads(chunk)
+                usage_metadata=json_object.get('usage')
+                if usage_metadata:
+                    self.tokens=openai_usage(usage_metadata)
+                if json_object['choices']:
+                    yield json_object['choices'][0]['delta'].get('content') or ''
+
+    @limited
+    @tracked
+    async def async_stream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
+        headers=self.headers
+        url=self.base_url or "https://api.mistral.ai/v1/chat/completions"
+        payload=self.payload(messages,json=json,stream=True)
+        async with self.async_client.stream('POST',url=url,json=payload,headers=headers) as response:
+            if response.is_error:
+                await response.aread()
             response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            for chunk in chunks:
-                chunk=chunk.replace('data: ','')
-                if chunk and chunk!='[DONE]':
-                    delta=loads(chunk)['choices'][0]['delta']
-                    yield delta.get('content','')
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+            async for line in response.aiter_lines():
+                if not line.startswith('data: '):
+                    continue
+                chunk=line.removeprefix('data: ')
+                if chunk=='[DONE]':
+                    break
+                json_object=loads(chunk)
+                usage_metadata=json_object.get('usage')
+                if usage_metadata:
+                    self.tokens=openai_usage(usage_metadata)
+                if json_object['choices']:
+                    yield json_object['choices'][0]['delta'].get('content') or ''
     
     def available_models(self):
         url="https://api.mistral.ai/v1/models"
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
-        response=requests.get(url=url,headers=headers)
-        response.raise_for_status()
-        models=response.json()
+        response=self.client.get(url=url,headers=headers)
+        models=self.check(response)
         return [model['id'] for model in models['data']]
\ No newline at end of file
@@ -0,0 +1,239 @@
+'''
+A local stand-in for the OpenAI compatible and Ollama chat APIs, to run the agents offline.
+
+Point a provider at it through `base_url`:
+    ChatGroq, ChatOpenRouter, ChatMistral -> f'{server.base_url}/v1/chat/completions'
+    ChatOllama -> f'{server.base_url}/api/chat'
+    Ollama -> f'{server.base_url}/api/generate'
+
+Usage: python -m src.inference.mock --port 8008 --latency 0.5 --responses responses.json
+'''
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from dataclasses import dataclass,field
+from typing import Callable
+from threading import Thread,Lock
+from itertools import cycle
+from time import sleep,time
+from uuid import uuid4
+import argparse
+import json
+
+DEFAULT_RESPONSE='''<Option>
+  <Thought>The task is done.</Thought>
+  <Final-Answer>This is a mock response.</Final-Answer>
+  <Route>Final</Route>
+</Option>'''
+
+@dataclass
+class MockConfig:
+    host:str='127.0.0.1'
+    # 0 picks a free port
+    port:int=0
+    # Seconds before the first byte of a response, the time to first token of a stream
+    latency:float=0.0
+    # Seconds between the chunks of a stream
+    chunk_delay:float=0.0
+    chunk_size:int=16
+    # Served in turn, the default response when empty. A {'name':...,'arguments':{...}} response is a tool call
+    responses:list[str|dict]=field(default_factory=list)
+
+class MockServer:
+    '''Answers the chat requests with canned responses, or with `responder(messages)` when given.'''
+    def __init__(self,config:MockConfig=None,responder:Callable[[list[dict]],str|dict]=None):
+        self.config=config if config else MockConfig()
+        self.responder=responder
+        self.responses=cycle(self.config.responses) if self.config.responses else None
+        self.requests:list[dict]=[]
+        self.lock=Lock()
+        self.server:ThreadingHTTPServer=None
+        self.thread:Thread=None
+
+    @property
+    def base_url(self)->str:
+        host,port=self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def respond(self,payload:dict)->str|dict:
+        messages=payload.get('messages') or [{'role':'user','content':payload.get('prompt','')}]
+        with self.lock:
+            self.requests.append(payload)
+            if self.responder:
+                return self.responder(messages)
+            return next(self.responses) if self.responses else DEFAULT_RESPONSE
+
+    def usage(self,payload:dict,content:str|dict)->tuple[int,int]:
+        '''Token counts at four characters per token'''
+        prompt=json.dumps(payload.get('messages') or payload.get('prompt',''))
+        if isinstance(content,dict):
+            content=json.dumps(content)
+        return len(prompt)//4,len(content)//4
+
+    def chunks(self,content:str)->list[str]:
+        size=self.config.chunk_size
+        return [content[i:i+size] for i in range(0,len(content),size)] or ['']
+
+    def start(self)->'MockServer':
+        server=self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version='HTTP/1.1'
+            # The headers and the body are written separately, Nagle would hold the body back
+            disable_nagle_algorithm=True
+
+            def log_message(self,format,*args):
+                pass
+
+            def do_GET(self):
+                if self.path.endswith('/models'):
+                    self.send_json({'object':'list','data':[{'id':'mock','object':'model','active':True}]})
+                elif self.path.endswith('/api/tags'):
+                    self.send_json({'models':[{'name':'mock'}]})
+                else:
+                    self.send_json({'error':{'message':f'Unknown path {self.path}'}},status=404)
+
+            def do_POST(self):
+                length=int(self.headers.get('Content-Length',0))
+                payload=json.loads(self.rfile.read(length) or b'{}')
+                if self.path.endswith('/chat/completions'):
+                    kind='openai'
+                elif self.path.endswith('/api/chat'):
+                    kind='ollama'
+                elif self.path.endswith('/api/generate'):
+                    kind='generate'
+                else:
+                    self.send_json({'error':{'message':f'Unknown path {self.path}'}},status=404)
+                    return
+                content=server.respond(payload)
+                sleep(server.config.latency)
+                if isinstance(content,dict) and (not payload.get('tools') or payload.get('stream')):
+                    # Without tools in the request, or in a stream, the call comes back as text
+                    content=json.dumps(content)
+                if payload.get('stream'):
+                    self.send_stream(kind,payload,content)
+                else:
+                    self.send_json(self.completion(kind,payload,content))
+
+            def completion(self,kind:str,payload:dict,content:str|dict)->dict:
+                input,output=server.usage(payload,content)
+                if isinstance(content,dict):
+                    return self.tool_call(kind,payload,content,input,output)
+                if kind=='openai':
+                    return {
+                        'id':f'chatcmpl-{uuid4().hex}',
+                        'object':'chat.completion',
+                        'created':int(time()),
+                        'model':payload.get('model','mock'),
+                        'choices':[{'index':0,'message':{'role':'assistant','content':content},'finish_reason':'stop'}],
+                        'usage':{'prompt_tokens':input,'completion_tokens':output,'total_tokens':input+output}
+                    }
+                body={'model':payload.get('model','mock'),'done':True,'prompt_eval_count':input,'eval_count':output}
+                if kind=='ollama':
+                    body['message']={'role':'assistant','content':content}
+                else:
+                    body['response']=content
+                return body
+
+            def tool_call(self,kind:str,payload:dict,call:dict,input:int,output:int)->dict:
+                if kind=='openai':
+                    # The OpenAI compatible APIs send the arguments as a JSON string
+                    function={'name':call['name'],'arguments':json.dumps(call.get('arguments',{}))}
+                    return {
+                        'id':f'chatcmpl-{uuid4().hex}',
+                        'object':'chat.completion',
+                        'created':int(time()),
+                        'model':payload.get('model','mock'),
+                        'choices':[{'index':0,'message':{'role':'assistant','content':None,'tool_calls':[{'id':f'call_{uuid4().hex[:8]}','type':'function','function':function}]},'finish_reason':'tool_calls'}],
+                        'usage':{'prompt_tokens':input,'completion_tokens':output,'total_tokens':input+output}
+                    }
+                function={'name':call['name'],'arguments':call.get('arguments',{})}
+                return {'model':payload.get('model','mock'),'done':True,'prompt_eval_count':input,'eval_count':output,'message':{'role':'assistant','content':'','tool_calls':[{'function':function}]}}
+
+            def send_json(self,body:dict,status:int=200):
+                data=json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError,ConnectionResetError):
+                    # The client gave up on the request, e.g. a hedged request that lost the race
+                    self.close_connection=True
+
+            def send_stream(self,kind:str,payload:dict,content:str):
+                self.send_response(200)
+                self.send_header('Content-Type','text/event-stream' if kind=='openai' else 'application/x-ndjson')
+                self.send_header('Transfer-Encoding','chunked')
+                self.end_headers()
+                input,output=server.usage(payload,content)
+                try:
+                    chunks=server.chunks(content)
+                    for index,chunk in enumerate(chunks):
+                        last=index==len(chunks)-1
+                        if kind=='openai':
+                            body={'id':'mock','object':'chat.completion.chunk','choices':[{'index':0,'delta':{'content':chunk},'finish_reason':'stop' if last else None}]}
+                            if last:
+                                usage={'prompt_tokens':input,'completion_tokens':output,'total_tokens':input+output}
+                                # Groq reports the usage under x_groq, the others at the top level
+                                body['usage']=usage
+                                body['x_groq']={'usage':usage}
+                            line=f'data: {json.dumps(body)}\n\n'
+                        else:
+                            body={'model':payload.get('model','mock'),'done':last}
+                            if kind=='ollama':
+                                body['message']={'role':'assistant','content':chunk}
+                            else:
+                                body['response']=chunk
+                            if last:
+                                body.update({'prompt_eval_count':input,'eval_count':output})
+                            line=json.dumps(body)+'\n'
+                        self.write_chunk(line)
+                        if not last:
+                            sleep(server.config.chunk_delay)
+                    if kind=='openai':
+                        self.write_chunk('data: [DONE]\n\n')
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError,ConnectionResetError):
+                    # The client stopped reading, e.g. when the agent cuts the stream short
+                    self.close_connection=True
+
+            def write_chunk(self,text:str):
+                data=text.encode()
+                self.wfile.write(f'{len(data):X}\r\n'.encode()+data+b'\r\n')
+                self.wfile.flush()
+
+        self.server=ThreadingHTTPServer((self.config.host,self.config.port),Handler)
+        self.server.daemon_threads=True
+        self.thread=Thread(target=self.server.serve_forever,name='mock-server',daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server=None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.stop()
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Mock OpenAI compatible and Ollama chat server')
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=8008)
+    parser.add_argument('--latency',type=float,default=0.0)
+    parser.add_argument('--chunk-delay',type=float,default=0.0)
+    parser.add_argument('--responses',help='JSON file with a list of responses served in turn')
+    args=parser.parse_args()
+    responses=[]
+    if args.responses:
+        with open(args.responses,encoding='utf-8') as file:
+            responses=json.load(file)
+    server=MockServer(MockConfig(host=args.host,port=args.port,latency=args.latency,chunk_delay=args.chunk_delay,responses=responses)).start()
+    print(f'Mock server listening on {server.base_url}')
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
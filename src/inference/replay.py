@@ -0,0 +1,163 @@
+from src.inference.cache import request_key,output_mode,encode_response,decode_response
+from src.message import AIMessage,BaseMessage,ToolMessage
+from src.inference import BaseInference,Token
+from src.tool import Tool
+from copy import copy
+from typing import Generator,AsyncGenerator,Literal
+from collections import defaultdict,deque
+from time import perf_counter,sleep
+from pydantic import BaseModel
+from threading import Lock
+from pathlib import Path
+import asyncio
+import json
+
+class ReplayInference(BaseInference):
+    '''Records the calls to an inference provider to a trace file and replays them without the provider.
+
+    In `record` mode every call goes to `llm` and its response, token usage and latency are appended to the
+    trace, one JSON line per call. In `replay` mode the responses are served from the trace by the hash of
+    the request, the identical requests in the order they were recorded, so an agent run is reproduced
+    deterministically. `latency_scale` replays the recorded latencies, 0 answers at once and 1 as recorded.'''
+    def __init__(self,path:str,llm:BaseInference=None,mode:Literal['record','replay']='replay',latency_scale:float=0.0,strict:bool=True):
+        if mode=='record' and llm is None:
+            raise ValueError('Recording needs the llm to record')
+        if llm:
+            super().__init__(llm.model,api_key=llm.api_key,base_url=llm.base_url,tools=llm.tools,temperature=llm.temperature,client_pool=llm.client_pool,rate_limit=llm.rate_limit)
+        else:
+            super().__init__('replay')
+        self.path=Path(path)
+        self.llm=llm
+        self.mode=mode
+        self.latency_scale=latency_scale
+        # Without a recorded response for a request the next recorded one is served, unless strict
+        self.strict=strict
+        self.lock=Lock()
+        self.entries:dict[str,deque]=defaultdict(deque)
+        self.sequence:deque=deque()
+        if mode=='replay':
+            self.load()
+        else:
+            self.path.parent.mkdir(parents=True,exist_ok=True)
+
+    def load(self):
+        with self.path.open('r',encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry=json.loads(line)
+                self.entries[entry['key']].append(entry)
+                self.sequence.append(entry)
+
+    def key(self,messages:list[BaseMessage],mode:str)->str:
+        # The model is left out, so a trace can be replayed without the provider it was recorded with, and the
+        # current date and time the agents add to the task is ignored, so a run can be replayed at any time
+        return request_key(None,None,messages,mode,normalize=True,tools=self.tools)
+
+    def record(self,key:str,mode:str,latency:float,response:str=None,chunks:list[str]=None):
+        tokens=self.llm.tokens
+        entry={'key':key,'mode':mode,'latency':round(latency,4),'tokens':tokens.model_dump()}
+        if chunks is not None:
+            entry['chunks']=chunks
+        else:
+            entry['response']=response
+        with self.lock:
+            with self.path.open('a',encoding='utf-8') as file:
+                file.write(json.dumps(entry,separators=(',',':'))+'\n')
+        self.tokens=tokens
+
+    def next_entry(self,key:str)->dict:
+        with self.lock:
+            entries=self.entries.get(key)
+            if entries:
+                entry=entries.popleft()
+                self.sequence.remove(entry)
+            elif self.strict or not self.sequence:
+                raise KeyError(f'No recorded response for the request {key[:12]} in {self.path}')
+            else:
+                entry=self.sequence.popleft()
+                self.entries[entry['key']].remove(entry)
+        self.tokens=Token(**entry['tokens'])
+        return entry
+
+    def invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        mode=output_mode(json,model)
+        key=self.key(messages,mode)
+        if self.mode=='record':
+            start=perf_counter()
+            response=self.llm.invoke(messages,json=json,model=model)
+            self.record(key,mode,perf_counter()-start,response=encode_response(response))
+            return response
+        entry=self.next_entry(key)
+        sleep(entry['latency']*self.latency_scale)
+        return decode_response(entry['response'],model)
+
+    async def async_invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        mode=output_mode(json,model)
+        key=self.key(messages,mode)
+        if self.mode=='record':
+            start=perf_counter()
+            response=await self.llm.async_invoke(messages,json=json,model=model)
+            self.record(key,mode,perf_counter()-start,response=encode_response(response))
+            return response
+        entry=self.next_entry(key)
+        await asyncio.sleep(entry['latency']*self.latency_scale)
+        return decode_response(entry['response'],model)
+
+    def stream(self,messages:list[BaseMessage],json:bool=False)->Generator[str,None,None]:
+        mode=output_mode(json,stream=True)
+        key=self.key(messages,mode)
+        if self.mode=='record':
+            start=perf_counter()
+            chunks=[]
+            stream=self.llm.stream(messages,json=json)
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            finally:
+                stream.close()
+                # A stream closed early by the consumer is recorded as far as it was read
+                self.record(key,mode,perf_counter()-start,chunks=chunks)
+            return
+        entry=self.next_entry(key)
+        chunks=entry['chunks']
+        delay=entry['latency']*self.latency_scale/max(len(chunks),1)
+        for chunk in chunks:
+            sleep(delay)
+            yield chunk
+
+    async def async_stream(self,messages:list[BaseMessage],json:bool=False)->AsyncGenerator[str,None]:
+        mode=output_mode(json,stream=True)
+        key=self.key(messages,mode)
+        if self.mode=='record':
+            start=perf_counter()
+            chunks=[]
+            stream=self.llm.async_stream(messages,json=json)
+            try:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            finally:
+                await stream.aclose()
+                # A stream closed early by the consumer is recorded as far as it was read
+                self.record(key,mode,perf_counter()-start,chunks=chunks)
+            return
+        entry=self.next_entry(key)
+        chunks=entry['chunks']
+        delay=entry['latency']*self.latency_scale/max(len(chunks),1)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+    def bind_tools(self,tools:list[Tool])->'ReplayInference':
+        '''The copy shares the trace, the tools are part of the key of a request'''
+        bound=copy(self)
+        if self.llm:
+            bound.llm=self.llm.bind_tools(tools)
+        bound.tools=tools
+        return bound
+
+    def close(self):
+        if self.llm:
+            self.llm.close()
@@ -1,16 +1,19 @@
 from abc import ABC,abstractmethod
 from src.inference import BaseInference
 from src.message import BaseMessage,SystemMessage
-import json
-import os
+from src.memory.storage import BaseStorage
+from src.memory.storage.sqlite import SQLiteStorage
+from pathlib import Path
 
 class BaseMemory(ABC):
-    def __init__(self,knowledge_base:str='knowledge_base.json',llm:BaseInference=None,verbose=False):
+    def __init__(self,knowledge_base:str='knowledge_base.json',llm:BaseInference=None,verbose=False,storage:BaseStorage=None):
         self.llm=llm
         self.verbose=verbose
         self.knowledge_base=knowledge_base
+        self.storage=storage
+        # The memories retrieved for the current task, the knowledge base stays in the storage
         self.memories=[]
-        self.__initialize_memory()
+        self.initialize_memory()
 
     @abstractmethod
     def store(self,conversation:list[BaseMessage])->None:
@@ -23,15 +26,31 @@ class BaseMemory(ABC):
     @abstractmethod
     def attach_prompt(self)->str:
         pass
+
+    def submit(self,conversation:list[BaseMessage],success:bool|None=None)->None:
+        '''Store a finished conversation, the memories with a background worker only queue it.
+        `success` tells whether the task that used the retrieved memories succeeded.'''
+        self.store(conversation)
+
+    def flush(self)->None:
+        '''Finish the storing still pending'''
+        pass
+
+    def close(self)->None:
+        self.flush()
+        if self.storage is not None:
+            self.storage.close()
+
+    def attach_memory(self,system_prompt:str)->str:
+        '''The system prompt with the retrieved memories after it, the prompt before them stays the same'''
+        return f'{system_prompt}\n{self.attach_prompt()}'
     
-    def __initialize_memory(self):
-        if not os.path.exists(f'./memory/{self.knowledge_base}'):
-            os.makedirs('./memory',exist_ok=True)
-            with open(f'./memory/{self.knowledge_base}','w') as f:
-                f.write(json.dumps(self.memories,indent=2))
-        else:
-            with open(f'./memory/{self.knowledge_base}','r') as f:
-                self.memories=json.loads(f.read())
+    def initialize_memory(self):
+        '''Open the storage of the knowledge base, a SQLite database next to the JSON file it replaces'''
+        if self.storage is None:
+            path=Path('./memory')/self.knowledge_base
+            self.storage=SQLiteStorage(path.with_suffix('.sqlite'),legacy=path)
+
     def conversation_to_text(self,conversation:list[BaseMessage]):
         conversation=list(self.__filter_conversation(conversation))
         return '\n'.join([f'{message.role}: {message.content}' for message in conversation])
@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+from typing import Literal
+import math
+import time
+
+EvictionPolicy=Literal['lru','lfu','score']
+
+@dataclass
+class CapacityConfig:
+    '''Bounds on a knowledge base. Past `max_memories` the least valuable memories are evicted down to
+    `low_watermark` of it, so eviction runs now and then rather than on every write.
+
+    `lru` evicts the memories used longest ago, `lfu` the ones retrieved the least and `score` weighs
+    the retrievals by the success rate of the tasks that used them and by how recently they were used,
+    halving every `half_life` seconds. A memory younger than `grace_period` seconds goes only after all
+    the older ones, it has had no chance to be used yet.
+    Compaction merges the memories whose embeddings are at least `duplicate_threshold` similar.'''
+    max_memories:int=1000
+    policy:EvictionPolicy='score'
+    low_watermark:float=0.9
+    half_life:float=14*24*3600
+    grace_period:float=24*3600
+    duplicate_threshold:float=0.92
+
+def memory_score(usage:dict,policy:EvictionPolicy,half_life:float,now:float)->float:
+    '''How much a memory is worth keeping, the lowest are evicted first'''
+    last_used=usage.get('last_used') or usage.get('created') or 0
+    if policy=='lru':
+        return last_used
+    if policy=='lfu':
+        return usage.get('hits') or 0
+    successes,failures=usage.get('successes') or 0,usage.get('failures') or 0
+    # Laplace smoothed, a memory without outcomes counts as a coin flip
+    success_rate=(successes+1)/(successes+failures+2)
+    recency=math.exp(-math.log(2)*max(now-last_used,0)/half_life)
+    return (1+(usage.get('hits') or 0))*success_rate*recency
+
+def select_evictions(usages:list[dict],config:CapacityConfig,now:float=None)->list[str]:
+    '''The ids to evict to bring the memories back under capacity'''
+    if len(usages)<=config.max_memories:
+        return []
+    now=now if now is not None else time.time()
+    target=int(config.max_memories*config.low_watermark)
+    ranked=sorted(usages,key=lambda usage:(now-(usage.get('created') or 0)<config.grace_period,memory_score(usage,config.policy,config.half_life,now)))
+    return [usage['id'] for usage in ranked[:len(usages)-target]]
@@ -1,19 +1,172 @@
 from src.memory.episodic.utils import read_markdown_file
 from src.message import SystemMessage,HumanMessage
 from src.message import BaseMessage
+from src.inference import BaseInference
+from src.embedding import BaseEmbedding
+from src.memory.index import VectorIndex
+from src.memory.storage import BaseStorage
+from src.memory.storage.queue import SQLiteQueue
+from src.memory.worker import MemoryWorker
+from src.memory.capacity import CapacityConfig,memory_score,select_evictions
+from contextlib import nullcontext
 from src.memory import BaseMemory
 from src.router import LLMRouter
 from termcolor import colored
+from pathlib import Path
 from uuid import uuid4
 import json
+import time
 
 with open('./src/memory/episodic/routes.json','r') as f:
     routes=json.load(f)
 
 class EpisodicMemory(BaseMemory):
+    '''Memories of past tasks. With an `embedding` the memories are kept in a vector index, a query is
+    matched against it and only the `top_k` memories scoring at least `threshold` reach the llm, which
+    picks the relevant ones when `rerank` is set. Without one the llm reads every memory.
+
+    With `background` the finished conversations are queued on disk and consolidated off the agent's
+    path, up to `batch_size` of them in one llm call once that many are pending or the oldest has waited
+    `max_delay` seconds.
+
+    The knowledge base is held to the bounds of `capacity`, the retrievals and task outcomes of each
+    memory decide which go first, and `compact` merges the near duplicates.'''
+    def __init__(self,knowledge_base:str='knowledge_base.json',llm:BaseInference=None,embedding:BaseEmbedding=None,index:VectorIndex=None,top_k:int=5,threshold:float|None=0.3,rerank:bool=True,verbose=False,storage:BaseStorage=None,background:bool=True,batch_size:int=4,max_delay:float=30,capacity:CapacityConfig=None):
+        super().__init__(knowledge_base=knowledge_base,llm=llm,verbose=verbose,storage=storage)
+        self.embedding=embedding
+        self.capacity=capacity if capacity else CapacityConfig()
+        self.route_classifier:LLMRouter=None
+        self.index=index if index is not None else VectorIndex()
+        self.top_k=top_k
+        self.threshold=threshold
+        self.rerank=rerank
+        if self.embedding is not None:
+            for memories in self.storage.scan():
+                self.index_memories(memories)
+        self.worker=None
+        if background:
+            queue=SQLiteQueue(Path('./memory')/f'{Path(knowledge_base).stem}.queue.sqlite')
+            self.worker=MemoryWorker(self.consolidate,queue,batch_size=batch_size,max_delay=max_delay)
+
+    def memory_text(self,memory:dict)->str:
+        return '\n'.join(f'{key}: {value}' for key,value in memory.items() if key!='id')
+
+    def index_memories(self,memories:list[dict]):
+        '''Embed the memories into the index, the vectors of the unchanged ones come from the embedding cache'''
+        if self.embedding is None or not memories:
+            return
+        vectors=self.embedding.embed_batch([self.memory_text(memory) for memory in memories])
+        self.index.add([memory['id'] for memory in memories],vectors)
+
+    def retrieved_ids(self)->list[str]:
+        return [memory.get('id') for memory in self.memories if isinstance(memory,dict) and memory.get('id')]
+
+    def submit(self,conversation:list[BaseMessage],success:bool|None=None):
+        if success is not None and self.retrieved_ids():
+            self.storage.record_outcome(self.retrieved_ids(),success)
+        if self.worker is None:
+            return self.store(conversation)
+        # The ids of the memories retrieved for the task travel with it, the queue outlives this object
+        self.worker.submit({
+            'conversation':self.conversation_to_text(conversation),
+            'memories':self.retrieved_ids()
+        })
+
+    def enforce_capacity(self):
+        '''Evict the least valuable memories once the knowledge base is over capacity'''
+        if len(self.storage)<=self.capacity.max_memories:
+            return
+        evicted=select_evictions(self.storage.usage(),self.capacity)
+        if self.verbose:
+            print(colored(f'Evicting {len(evicted)} memories from Knowledge Base',color='yellow',attrs=['bold']))
+        self.storage.delete(evicted)
+        self.index.remove(evicted)
+
+    def duplicates(self)->list[list[str]]:
+        '''Groups of memories whose embeddings are within the duplicate threshold of the first, the most
+        used memory of a group comes first and gives it its id'''
+        now=time.time()
+        usages=sorted(self.storage.usage(),key=lambda usage:memory_score(usage,'score',self.capacity.half_life,now),reverse=True)
+        grouped=set()
+        groups=[]
+        for usage in usages:
+            vector=self.index.vector(usage['id'])
+            if usage['id'] in grouped or vector is None:
+                continue
+            matches=self.index.search(vector,k=16,threshold=self.capacity.duplicate_threshold)
+            group=[usage['id']]+[id for id,_ in matches if id!=usage['id'] and id not in grouped]
+            grouped.update(group)
+            if len(group)>1:
+                groups.append(group)
+        return groups
+
+    def compact(self)->int:
+        '''Merge the near duplicate memories into one each, returns the number of memories removed.
+        Meant to run offline, it embeds nothing new but makes an llm call per group.'''
+        if self.embedding is None:
+            raise ValueError('Compaction needs an embedding to find the duplicate memories')
+        removed=0
+        # Keep the worker from consolidating memories that are being merged
+        with self.worker.running if self.worker is not None else nullcontext():
+            system_prompt=read_markdown_file('src/memory/episodic/prompt/merge.md')
+            for group in self.duplicates():
+                memories=self.storage.get(group)
+                if len(memories)<2:
+                    continue
+                messages=[SystemMessage(system_prompt),HumanMessage(f'### Memories:\n{json.dumps(memories,indent=2)}')]
+                merged:dict=self.llm.invoke(messages,json=True).content
+                self.storage.merge(group[0],group,merged)
+                self.index.remove(group)
+                self.index_memories([merged])
+                removed+=len(memories)-1
+        if self.verbose:
+            print(colored(f'Compacted {removed} duplicate memories in Knowledge Base',color='yellow',attrs=['bold']))
+        return removed
+
+    def flush(self):
+        if self.worker is not None:
+            self.worker.flush()
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.close()
+        if self.storage is not None:
+            self.storage.close()
+
+    def consolidate(self,items:list[dict]):
+        '''Turn a batch of finished conversations into added, updated and deleted memories in one llm call'''
+        relevant=self.storage.get(list(dict.fromkeys(id for item in items for id in item['memories'] if id)))
+        system_prompt=read_markdown_file('src/memory/episodic/prompt/consolidate.md')
+        conversations='\n'.join(f'### Conversation {index}:\n{item["conversation"]}' for index,item in enumerate(items,start=1))
+        user_prompt=f'### Revelant memories:\n{json.dumps(relevant,indent=2)}\n{conversations}'
+        messages=[SystemMessage(system_prompt),HumanMessage(user_prompt)]
+        changes:dict=self.llm.invoke(messages,json=True).content
+        if not isinstance(changes,dict):
+            raise ValueError(f'Expected the memory changes as a JSON object, got {type(changes).__name__}')
+        relevant_ids={memory['id'] for memory in relevant}
+        updates=[memory for memory in changes.get('update') or [] if isinstance(memory,dict)]
+        # Only the relevant memories may be changed, an update of any other id is added as a new memory
+        updated=[memory for memory in updates if memory.get('id') in relevant_ids]
+        added=[memory for memory in changes.get('add') or [] if isinstance(memory,dict) and memory not in updated]
+        added+=[memory for memory in updates if memory.get('id') not in relevant_ids]
+        for memory in added:
+            memory['id']=str(uuid4())
+        deleted=[id for id in changes.get('delete') or [] if id in relevant_ids]
+        if self.verbose:
+            print(colored('Consolidated memories into Knowledge Base:',color='yellow',attrs=['bold'])+'\n'+json.dumps({'add':added,'update':updated,'delete':deleted},indent=2))
+        if not (added or updated or deleted):
+            return
+        self.storage.replace(deleted,added+updated)
+        self.index.remove(deleted+[memory['id'] for memory in updated])
+        self.index_memories(added+updated)
+        self.enforce_capacity()
+
     def router(self,conversation:list[BaseMessage]):
-        router=LLMRouter(routes=routes,llm=self.llm,verbose=False)
-        route=router.invoke(f'### Revelant memories:\n{self.memories}\n### Conversation:\n{self.conversation_to_text(conversation)}')
+        # Kept across calls. Routed by the llm only: the route depends on how the memories relate to the
+        # conversation, not on its topic, and a wrong REPLACE deletes the retrieved memories
+        if self.route_classifier is None:
+            self.route_classifier=LLMRouter(routes=routes,llm=self.llm,verbose=False)
+        route=self.route_classifier.invoke(f'### Revelant memories:\n{self.memories}\n### Conversation:\n{self.conversation_to_text(conversation)}')
         return route
     
     def store(self, conversation: list[BaseMessage]):
@@ -41,11 +194,9 @@ class EpisodicMemory(BaseMemory):
         memory['id']=str(uuid4())
         if self.verbose:
             print(f'{colored(f'Adding memory to Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(memory,indent=2)}')
-        with open(f'./memory/{self.knowledge_base}','r+') as f:
-            knowledge_base:list[dict] = json.load(f)
-            knowledge_base.append(memory)
-            f.seek(0)
-            json.dump(knowledge_base, f, indent=2)
+        self.storage.upsert([memory])
+        self.index_memories([memory])
+        self.enforce_capacity()
 
     def update_memory(self,conversation:list[BaseMessage]):
         system_prompt=read_markdown_file('src/memory/episodic/prompt/update.md')
@@ -55,14 +206,11 @@ class EpisodicMemory(BaseMemory):
         memories:list[dict]=self.llm.invoke(messages,json=True).content
         if self.verbose:
             print(f'{colored(f'Updated memories from Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(memories,indent=2)}')
-        with open(f'./memory/{self.knowledge_base}','r+') as f:
-            knowledge_base:list[dict] = json.load(f)
-            memory_ids=[memory.get('id') for memory in self.memories]
-            updated_knowledge_base=list(filter(lambda memory:memory.get('id') not in memory_ids,knowledge_base))
-            updated_knowledge_base.extend(memories)
-            f.seek(0)
-            json.dump(updated_knowledge_base, f, indent=2)
-            f.truncate()
+        memory_ids=[memory.get('id') for memory in self.memories]
+        self.storage.replace(memory_ids,memories)
+        self.index.remove(memory_ids)
+        self.index_memories(memories)
+        self.enforce_capacity()
 
     def replace_memory(self,conversation:list[BaseMessage]):
         system_prompt=read_markdown_file('src/memory/episodic/prompt/replace.md')
@@ -73,25 +221,34 @@ class EpisodicMemory(BaseMemory):
         memory['id']=str(uuid4())
         if self.verbose:
             print(f'{colored(f'Replacing memory from Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(memory,indent=2)}')
-        with open(f'./memory/{self.knowledge_base}','r+') as f:
-            knowledge_base:list[dict] = json.load(f)
-            memory_ids=[memory.get('id') for memory in self.memories]
-            updated_knowledge_base=list(filter(lambda memory:memory.get('id') not in memory_ids,knowledge_base))
-            updated_knowledge_base.append(memory)
-            f.seek(0)
-            json.dump(updated_knowledge_base, f, indent=2)
-            f.truncate()
+        memory_ids=[memory.get('id') for memory in self.memories]
+        self.storage.replace(memory_ids,[memory])
+        self.index.remove(memory_ids)
+        self.index_memories([memory])
+        self.enforce_capacity()
+
+    def candidates(self,query:str)->list[dict]:
+        '''The memories closest to the query in the index, or all of them without an embedding'''
+        if self.embedding is None:
+            return self.storage.all()
+        vector=self.embedding.embed_batch([query])[0]
+        matches=self.index.search(vector,k=self.top_k,threshold=self.threshold)
+        return self.storage.get([memory_id for memory_id,_ in matches])
 
     def retrieve(self, query: str)->list[dict]:
-        memories=[memory for memory in self.memories]
-        system_prompt=read_markdown_file('src/memory/episodic/prompt/retrieve.md')
-        user_prompt=f'### Query: {query}\n Now, select the memories those are relevant to solve the query.'
-        messages=[SystemMessage(system_prompt.format(memories=memories)),HumanMessage(user_prompt)]
-        response=self.llm.invoke(messages,json=True)
-        self.memories=response.content
+        memories=self.candidates(query)
+        if memories and (self.embedding is None or (self.rerank and len(memories)>1)):
+            system_prompt=read_markdown_file('src/memory/episodic/prompt/retrieve.md')
+            user_prompt=f'### Query: {query}\n Now, select the memories those are relevant to solve the query.'
+            messages=[SystemMessage(system_prompt.format(memories=memories)),HumanMessage(user_prompt)]
+            response=self.llm.invoke(messages,json=True)
+            memories=response.content
+        self.memories=memories
+        if self.retrieved_ids():
+            self.storage.record_hits(self.retrieved_ids())
         if self.verbose:
-            print(f'{colored(f'Retrieved memories from Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(self.memories,indent=2)}')
-        return response.content
+            print(colored('Retrieved memories from Knowledge Base:',color='yellow',attrs=['bold'])+'\n'+json.dumps(self.memories,indent=2))
+        return memories
     
     def attach_prompt(self):
         prompt=read_markdown_file('src/memory/episodic/prompt/prompt.md')
@@ -0,0 +1,113 @@
+from threading import RLock
+import numpy as np
+
+class VectorIndex:
+    '''Exact nearest neighbour search by cosine similarity, a matrix multiply over every vector.
+
+    The vectors are normalized on the way in and kept in one float32 matrix that grows by doubling,
+    so adding and removing a vector does not rebuild the index.'''
+    def __init__(self,dim:int=None):
+        self.dim=dim
+        self.ids:list[str]=[]
+        self.positions:dict[str,int]={}
+        self.vectors=np.empty((0,dim or 0),dtype=np.float32)
+        self.lock=RLock()
+
+    def __len__(self)->int:
+        return len(self.ids)
+
+    def __contains__(self,id:str)->bool:
+        return id in self.positions
+
+    def vector(self,id:str)->np.ndarray|None:
+        with self.lock:
+            position=self.positions.get(id)
+            return None if position is None else self.vectors[position].copy()
+
+    def normalize(self,vectors:np.ndarray)->np.ndarray:
+        vectors=np.atleast_2d(np.asarray(vectors,dtype=np.float32))
+        norms=np.linalg.norm(vectors,axis=1,keepdims=True)
+        return vectors/np.maximum(norms,1e-12)
+
+    def reserve(self,size:int):
+        if len(self.vectors)>=size:
+            return
+        capacity=max(size,2*len(self.vectors),16)
+        vectors=np.empty((capacity,self.dim),dtype=np.float32)
+        vectors[:len(self.ids)]=self.vectors[:len(self.ids)]
+        self.vectors=vectors
+
+    def add(self,ids:list[str],vectors:np.ndarray):
+        '''Add the vectors, an id that is already in the index gets its vector replaced'''
+        vectors=self.normalize(vectors)
+        with self.lock:
+            if self.dim is None:
+                self.dim=vectors.shape[1]
+                self.vectors=np.empty((0,self.dim),dtype=np.float32)
+            if vectors.shape[1]!=self.dim:
+                raise ValueError(f'Expected vectors of dimension {self.dim}, got {vectors.shape[1]}')
+            self.reserve(len(self.ids)+len(ids))
+            for id,vector in zip(ids,vectors):
+                position=self.positions.get(id)
+                if position is None:
+                    position=self.positions[id]=len(self.ids)
+                    self.ids.append(id)
+                self.vectors[position]=vector
+                self.added(id,vector)
+
+    def remove(self,ids:list[str]):
+        with self.lock:
+            for id in ids:
+                position=self.positions.pop(id,None)
+                if position is None:
+                    continue
+                # The last vector takes the place of the removed one
+                last=len(self.ids)-1
+                if position!=last:
+                    moved=self.ids[last]
+                    self.ids[position]=moved
+                    self.vectors[position]=self.vectors[last]
+                    self.positions[moved]=position
+                self.ids.pop()
+                self.removed(id)
+
+    def added(self,id:str,vector:np.ndarray):
+        '''Called for every vector added, for the indexes that keep more structure'''
+        pass
+
+    def removed(self,id:str):
+        pass
+
+    def candidates(self,query:np.ndarray)->np.ndarray|None:
+        '''The positions to score for a query, None to score them all'''
+        return None
+
+    def search(self,vector:np.ndarray,k:int=5,threshold:float|None=None)->list[tuple[str,float]]:
+        '''The ids of the k most similar vectors and their cosine similarity, best first'''
+        query=self.normalize(vector)[0]
+        with self.lock:
+            if not self.ids:
+                return []
+            positions=self.candidates(query)
+            matrix=self.vectors[:len(self.ids)] if positions is None else self.vectors[positions]
+            scores=matrix@query
+            k=min(k,len(scores))
+            # Partial sort, only the top k are ordered
+            top=np.argpartition(-scores,k-1)[:k]
+            top=top[np.argsort(-scores[top])]
+            results=[]
+            for index in top:
+                score=float(scores[index])
+                if threshold is not None and score<threshold:
+                    break
+                position=index if positions is None else positions[index]
+                results.append((self.ids[position],score))
+            return results
+
+    def clear(self):
+        with self.lock:
+            for id in list(self.ids):
+                self.removed(id)
+            self.ids.clear()
+            self.positions.clear()
+            self.vectors=np.empty((0,self.dim or 0),dtype=np.float32)
@@ -0,0 +1,78 @@
+from src.memory.index import VectorIndex
+import numpy as np
+
+class IVFIndex(VectorIndex):
+    '''Approximate search for large stores, an inverted file over k-means clusters of the vectors.
+
+    A query is only scored against the vectors of its `nprobe` nearest clusters. Below `min_train`
+    vectors the search stays exact, the clusters are trained once there are enough and trained again
+    when the index has grown `retrain_factor` times since, the vectors added in between join their
+    nearest cluster.'''
+    def __init__(self,dim:int=None,nlist:int=64,nprobe:int=8,min_train:int=2048,retrain_factor:float=4.0,iterations:int=10,seed:int=0):
+        super().__init__(dim)
+        self.nlist=nlist
+        self.nprobe=nprobe
+        self.min_train=min_train
+        self.retrain_factor=retrain_factor
+        self.iterations=iterations
+        self.rng=np.random.default_rng(seed)
+        self.centroids:np.ndarray=None
+        self.assignments:dict[str,int]={}
+        self.lists:list[set[str]]=[]
+        self.trained_size=0
+
+    def train(self):
+        '''Spherical k-means over the vectors in the index'''
+        vectors=self.vectors[:len(self.ids)]
+        nlist=min(self.nlist,len(vectors))
+        centroids=vectors[self.rng.choice(len(vectors),nlist,replace=False)].copy()
+        for _ in range(self.iterations):
+            labels=np.argmax(vectors@centroids.T,axis=1)
+            for cluster in range(nlist):
+                members=vectors[labels==cluster]
+                if len(members):
+                    centroid=members.sum(axis=0)
+                    centroids[cluster]=centroid/max(np.linalg.norm(centroid),1e-12)
+        labels=np.argmax(vectors@centroids.T,axis=1)
+        self.centroids=centroids
+        self.lists=[set() for _ in range(nlist)]
+        self.assignments={}
+        for id,label in zip(self.ids,labels):
+            self.assignments[id]=int(label)
+            self.lists[label].add(id)
+        self.trained_size=len(self.ids)
+
+    def added(self,id:str,vector:np.ndarray):
+        if self.centroids is None:
+            return
+        self.removed(id)
+        label=int(np.argmax(self.centroids@vector))
+        self.assignments[id]=label
+        self.lists[label].add(id)
+
+    def removed(self,id:str):
+        label=self.assignments.pop(id,None)
+        if label is not None:
+            self.lists[label].discard(id)
+
+    def add(self,ids:list[str],vectors:np.ndarray):
+        with self.lock:
+            super().add(ids,vectors)
+            untrained=self.centroids is None and len(self.ids)>=self.min_train
+            if untrained or (self.trained_size and len(self.ids)>=self.retrain_factor*self.trained_size):
+                self.train()
+
+    def candidates(self,query:np.ndarray)->np.ndarray|None:
+        if self.centroids is None:
+            return None
+        nprobe=min(self.nprobe,len(self.centroids))
+        clusters=np.argpartition(-(self.centroids@query),nprobe-1)[:nprobe]
+        positions=[self.positions[id] for cluster in clusters for id in self.lists[cluster]]
+        return np.array(positions,dtype=np.int64) if positions else None
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self.centroids=None
+            self.lists=[]
+            self.trained_size=0
@@ -1,8 +1,57 @@
+from src.memory.semantic.utils import chunk_text,read_markdown_file
+from src.memory.semantic.store import ChunkStore
+from src.message import BaseMessage
+from src.inference import BaseInference
+from src.embedding import BaseEmbedding
 from src.memory import BaseMemory
+from termcolor import colored
+from datetime import datetime
+import json
 
 class SemanticMemory(BaseMemory):
-    def store(self, input: str):
-        pass
+    '''Facts and documents the agents look up again, such as the user's paths, app locations and site
+    details. The text is split into chunks that are embedded and appended to a ChunkStore under
+    `./memory/{knowledge_base}`, a query returns the `top_k` chunks scoring at least `threshold`.'''
+    def __init__(self,knowledge_base:str='semantic',embedding:BaseEmbedding=None,llm:BaseInference=None,top_k:int=5,threshold:float|None=0.3,chunk_size:int=800,chunk_overlap:int=100,verbose=False):
+        if embedding is None:
+            raise ValueError('SemanticMemory needs an embedding')
+        self.embedding=embedding
+        self.top_k=top_k
+        self.threshold=threshold
+        self.chunk_size=chunk_size
+        self.chunk_overlap=chunk_overlap
+        super().__init__(knowledge_base=knowledge_base,llm=llm,verbose=verbose)
 
-    def retrieve(self, input: str):
-        pass
\ No newline at end of file
+    def initialize_memory(self):
+        # The chunks stay on disk, nothing is loaded until a search returns it
+        self.chunks=ChunkStore(f'./memory/{self.knowledge_base}')
+
+    def store(self,input:str|list[BaseMessage],source:str='',metadata:dict=None)->int:
+        '''Chunk, embed and append the text or conversation, returns the number of chunks stored'''
+        text=self.conversation_to_text(input) if isinstance(input,list) else input
+        chunks=chunk_text(text,self.chunk_size,self.chunk_overlap)
+        if not chunks:
+            return 0
+        vectors=self.embedding.embed_batch(chunks)
+        created=datetime.now().isoformat(timespec='seconds')
+        records=[{'text':chunk,'source':source,'created':created,**(metadata or {})} for chunk in chunks]
+        self.chunks.append(records,vectors)
+        if self.verbose:
+            print(colored(f'Stored {len(chunks)} chunks in the Knowledge Base:',color='yellow',attrs=['bold'])+f' {source}')
+        return len(chunks)
+
+    def retrieve(self,query:str)->list[dict]:
+        vector=self.embedding.embed_batch([query])[0]
+        matches=self.chunks.search(vector,k=self.top_k,threshold=self.threshold)
+        facts=self.chunks.read([row for row,_ in matches])
+        for fact,(_,score) in zip(facts,matches):
+            fact['score']=round(score,4)
+        self.memories=facts
+        if self.verbose:
+            print(colored('Retrieved facts from Knowledge Base:',color='yellow',attrs=['bold'])+'\n'+json.dumps(facts,indent=2))
+        return facts
+
+    def attach_prompt(self)->str:
+        prompt=read_markdown_file('src/memory/semantic/prompt/prompt.md')
+        facts='\n'.join(f'- {fact["text"]}'+(f' (source: {fact["source"]})' if fact.get('source') else '') for fact in self.memories)
+        return prompt.format(facts=facts)
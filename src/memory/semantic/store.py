@@ -0,0 +1,124 @@
+from threading import Lock
+from pathlib import Path
+import numpy as np
+import json
+
+class ChunkStore:
+    '''Chunks of text and their normalized vectors in a directory, written append only.
+
+    `vectors.f32` holds the raw float32 rows and is read through a memory map, `chunks.jsonl` holds the
+    text and metadata of each chunk and `offsets.u64` the byte offset of each of its lines. Opening the
+    store maps the files and reads nothing else, a chunk is read from disk when a search returns it.
+    A row counts once both its offset and its vector are written, so a write cut short is dropped on
+    the next open.'''
+    def __init__(self,path:str,block_size:int=65536):
+        self.path=Path(path)
+        self.path.mkdir(parents=True,exist_ok=True)
+        self.block_size=block_size
+        self.lock=Lock()
+        self.dim:int=None
+        self.rows=0
+        self.vector_map:np.memmap=None
+        self.offset_map:np.memmap=None
+        self.load()
+
+    @property
+    def vectors_path(self)->Path:
+        return self.path/'vectors.f32'
+
+    @property
+    def offsets_path(self)->Path:
+        return self.path/'offsets.u64'
+
+    @property
+    def chunks_path(self)->Path:
+        return self.path/'chunks.jsonl'
+
+    @property
+    def meta_path(self)->Path:
+        return self.path/'meta.json'
+
+    def load(self):
+        if not self.meta_path.exists():
+            return
+        self.dim=json.loads(self.meta_path.read_text(encoding='utf-8'))['dim']
+        vector_rows=self.vectors_path.stat().st_size//(self.dim*4) if self.vectors_path.exists() else 0
+        offset_rows=self.offsets_path.stat().st_size//8 if self.offsets_path.exists() else 0
+        self.rows=min(vector_rows,offset_rows)
+        # Cut back the rows of an interrupted write so the next one lines up
+        for path,row_size in ((self.vectors_path,self.dim*4),(self.offsets_path,8)):
+            if path.exists() and path.stat().st_size!=self.rows*row_size:
+                with path.open('r+b') as file:
+                    file.truncate(self.rows*row_size)
+
+    def __len__(self)->int:
+        return self.rows
+
+    def maps(self)->tuple[np.memmap,np.memmap]:
+        '''The memory maps of the vectors and offsets, remapped when rows were added since'''
+        if self.vector_map is None or len(self.vector_map)<self.rows:
+            self.vector_map=np.memmap(self.vectors_path,dtype=np.float32,mode='r',shape=(self.rows,self.dim))
+            self.offset_map=np.memmap(self.offsets_path,dtype=np.uint64,mode='r',shape=(self.rows,))
+        return self.vector_map,self.offset_map
+
+    def append(self,chunks:list[dict],vectors:np.ndarray)->list[int]:
+        '''Append the chunks with their vectors, returns their rows'''
+        if not chunks:
+            return []
+        vectors=np.atleast_2d(np.asarray(vectors,dtype=np.float32))
+        vectors=vectors/np.maximum(np.linalg.norm(vectors,axis=1,keepdims=True),1e-12)
+        with self.lock:
+            if self.dim is None:
+                self.dim=vectors.shape[1]
+                self.meta_path.write_text(json.dumps({'dim':self.dim}),encoding='utf-8')
+            if vectors.shape[1]!=self.dim:
+                raise ValueError(f'Expected vectors of dimension {self.dim}, got {vectors.shape[1]}')
+            offsets=[]
+            with self.chunks_path.open('ab') as file:
+                offset=file.seek(0,2)
+                for chunk in chunks:
+                    line=(json.dumps(chunk,ensure_ascii=False)+'\n').encode('utf-8')
+                    file.write(line)
+                    offsets.append(offset)
+                    offset+=len(line)
+            with self.offsets_path.open('ab') as file:
+                file.write(np.asarray(offsets,dtype=np.uint64).tobytes())
+            with self.vectors_path.open('ab') as file:
+                file.write(np.ascontiguousarray(vectors).tobytes())
+            start=self.rows
+            self.rows+=len(chunks)
+        return list(range(start,start+len(chunks)))
+
+    def read(self,rows:list[int])->list[dict]:
+        '''The chunks at the rows'''
+        with self.lock:
+            _,offsets=self.maps()
+            chunks=[]
+            with self.chunks_path.open('rb') as file:
+                for row in rows:
+                    file.seek(int(offsets[row]))
+                    chunks.append(json.loads(file.readline()))
+        return chunks
+
+    def search(self,vector:np.ndarray,k:int=5,threshold:float|None=None)->list[tuple[int,float]]:
+        '''The rows of the k chunks most similar to the vector and their cosine similarity, best first.
+        The vectors are scored a block at a time, so only a block of them is in memory at once.'''
+        with self.lock:
+            if not self.rows:
+                return []
+            vectors,_=self.maps()
+            rows=self.rows
+        query=np.asarray(vector,dtype=np.float32)
+        query=query/max(float(np.linalg.norm(query)),1e-12)
+        best_rows=np.empty(0,dtype=np.int64)
+        best_scores=np.empty(0,dtype=np.float32)
+        for start in range(0,rows,self.block_size):
+            scores=vectors[start:start+self.block_size]@query
+            top=np.argpartition(-scores,min(k,len(scores))-1)[:k]
+            best_rows=np.concatenate([best_rows,top+start])
+            best_scores=np.concatenate([best_scores,scores[top]])
+            if len(best_rows)>k:
+                keep=np.argpartition(-best_scores,k-1)[:k]
+                best_rows,best_scores=best_rows[keep],best_scores[keep]
+        order=np.argsort(-best_scores)
+        return [(int(best_rows[i]),float(best_scores[i])) for i in order if threshold is None or best_scores[i]>=threshold]
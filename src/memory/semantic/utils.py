@@ -0,0 +1,36 @@
+import re
+
+def read_markdown_file(file_path: str) -> str:
+    with open(file_path, 'r',encoding='utf-8') as f:
+        markdown_content = f.read()
+    return markdown_content
+
+def chunk_text(text:str,chunk_size:int=800,chunk_overlap:int=100)->list[str]:
+    '''Split the text into chunks of up to `chunk_size` characters at paragraph, then sentence, then word
+    boundaries. Each chunk repeats the last `chunk_overlap` characters of the one before it.'''
+    pieces=[]
+    for paragraph in re.split(r'\n\s*\n',text.strip()):
+        paragraph=paragraph.strip()
+        if len(paragraph)<=chunk_size:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r'(?<=[.!?])\s+',paragraph):
+            if len(sentence)<=chunk_size:
+                pieces.append(sentence)
+                continue
+            pieces.extend(sentence.split())
+    chunks=[]
+    current=''
+    for piece in filter(None,pieces):
+        if current and len(current)+1+len(piece)>chunk_size:
+            chunks.append(current)
+            tail=current[-chunk_overlap:] if chunk_overlap else ''
+            # Start the overlap at a word boundary
+            current=tail[tail.find(' ')+1:] if ' ' in tail else ''
+        current=f'{current} {piece}' if current else piece
+        while len(current)>chunk_size:
+            chunks.append(current[:chunk_size])
+            current=current[chunk_size-chunk_overlap if chunk_overlap<chunk_size else chunk_size:]
+    if current:
+        chunks.append(current)
+    return chunks
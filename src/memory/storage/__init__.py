@@ -0,0 +1,58 @@
+from abc import ABC,abstractmethod
+from typing import Iterator
+
+class BaseStorage(ABC):
+    '''Where a memory keeps its entries, dicts keyed by their `id`. Writes are atomic upserts and
+    deletes by id, reads fetch the entries asked for rather than the whole store.'''
+    @abstractmethod
+    def get(self,ids:list[str])->list[dict]:
+        '''The entries with the ids that exist, in the order of the ids'''
+        pass
+
+    @abstractmethod
+    def scan(self,batch_size:int=1000)->Iterator[list[dict]]:
+        '''Every entry, a batch at a time'''
+        pass
+
+    @abstractmethod
+    def upsert(self,entries:list[dict]):
+        pass
+
+    @abstractmethod
+    def delete(self,ids:list[str]):
+        pass
+
+    @abstractmethod
+    def replace(self,ids:list[str],entries:list[dict]):
+        '''Delete the ids and upsert the entries in one transaction'''
+        pass
+
+    @abstractmethod
+    def record_hits(self,ids:list[str]):
+        '''Count a retrieval of the entries and mark them used now'''
+        pass
+
+    @abstractmethod
+    def record_outcome(self,ids:list[str],success:bool):
+        '''Count a task that used the entries as succeeded or failed'''
+        pass
+
+    @abstractmethod
+    def usage(self)->list[dict]:
+        '''The id, created, hits, last_used, successes and failures of every entry'''
+        pass
+
+    @abstractmethod
+    def merge(self,into:str,ids:list[str],entry:dict):
+        '''Replace the entries with `entry` under the id `into`, which keeps the usage of all of them'''
+        pass
+
+    @abstractmethod
+    def __len__(self)->int:
+        pass
+
+    def all(self)->list[dict]:
+        return [entry for batch in self.scan() for entry in batch]
+
+    def close(self):
+        pass
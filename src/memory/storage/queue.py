@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+from threading import Lock
+from pathlib import Path
+import sqlite3
+import json
+import time
+
+class SQLiteQueue:
+    '''A work queue on disk, items survive a crash until they are acknowledged. A taken item is leased
+    for `lease` seconds, when it is not acknowledged by then another worker can take it again. An item
+    that failed `max_attempts` times is moved to the `dead_items` table, so it stops blocking the queue.'''
+    def __init__(self,path:str='./memory/queue.sqlite',lease:float=300,timeout:float=30,max_attempts:int=3):
+        path=Path(path)
+        path.parent.mkdir(parents=True,exist_ok=True)
+        self.lease=lease
+        self.max_attempts=max_attempts
+        self.lock=Lock()
+        self.connection=sqlite3.connect(path,timeout=timeout,check_same_thread=False,isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS items(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL,
+                created REAL,
+                taken REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # Queues created before the attempts were counted
+        if 'attempts' not in [row[1] for row in self.connection.execute('PRAGMA table_info(items)')]:
+            self.connection.execute('ALTER TABLE items ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS dead_items(
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                created REAL,
+                failed REAL,
+                attempts INTEGER,
+                error TEXT
+            )
+        ''')
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def put(self,item:dict):
+        with self.transaction():
+            self.connection.execute('INSERT INTO items(data,created) VALUES (?,?)',(json.dumps(item),time.time()))
+
+    def take(self,size:int)->list[tuple[int,dict]]:
+        '''Lease up to `size` of the oldest items that are free. An item that failed before is taken on its
+        own, so the items it failed in a batch with are not held back by it.'''
+        now=time.time()
+        with self.transaction():
+            rows=self.connection.execute('SELECT id,data,attempts FROM items WHERE taken IS NULL OR taken<? ORDER BY id LIMIT ?',(now-self.lease,size)).fetchall()
+            failed=next((index for index,(_,_,attempts) in enumerate(rows) if attempts),None)
+            if failed is not None:
+                rows=rows[:max(failed,1)]
+            self.connection.executemany('UPDATE items SET taken=? WHERE id=?',[(now,id) for id,_,_ in rows])
+        return [(id,json.loads(data)) for id,data,_ in rows]
+
+    def ack(self,ids:list[int]):
+        with self.transaction():
+            self.connection.executemany('DELETE FROM items WHERE id=?',[(id,) for id in ids])
+
+    def release(self,ids:list[int]):
+        '''Hand the items back without waiting for their lease to run out'''
+        with self.transaction():
+            self.connection.executemany('UPDATE items SET taken=NULL WHERE id=?',[(id,) for id in ids])
+
+    def fail(self,ids:list[int],error:str='')->list[int]:
+        '''Hand back the items of a failed attempt, those out of attempts are moved to `dead_items`'''
+        now=time.time()
+        with self.transaction():
+            self.connection.executemany('UPDATE items SET taken=NULL,attempts=attempts+1 WHERE id=?',[(id,) for id in ids])
+            placeholders=','.join('?'*len(ids))
+            dead=[id for id,attempts in self.connection.execute(f'SELECT id,attempts FROM items WHERE id IN ({placeholders})',ids) if attempts>=self.max_attempts]
+            self.connection.executemany('INSERT OR REPLACE INTO dead_items SELECT id,data,created,?,attempts,? FROM items WHERE id=?',[(now,error,id) for id in dead])
+            self.connection.executemany('DELETE FROM items WHERE id=?',[(id,) for id in dead])
+        return dead
+
+    def oldest(self)->float|None:
+        '''When the oldest free item was put'''
+        with self.lock:
+            row=self.connection.execute('SELECT MIN(created) FROM items WHERE taken IS NULL OR taken<?',(time.time()-self.lease,)).fetchone()
+        return row[0]
+
+    def __len__(self)->int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
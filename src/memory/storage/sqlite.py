@@ -0,0 +1,131 @@
+from src.memory.storage import BaseStorage
+from contextlib import contextmanager
+from typing import Iterator
+from threading import Lock
+from pathlib import Path
+from uuid import uuid4
+import sqlite3
+import json
+import time
+
+class SQLiteStorage(BaseStorage):
+    '''Entries in a SQLite table in WAL mode. A write touches only its own rows, readers are not blocked
+    by a writer, and agents in other processes wait up to `timeout` seconds for the write lock instead
+    of corrupting the file. A new database imports the entries of the `legacy` JSON knowledge base.'''
+    def __init__(self,path:str='./memory/knowledge_base.sqlite',legacy:str=None,timeout:float=30):
+        path=Path(path)
+        path.parent.mkdir(parents=True,exist_ok=True)
+        self.lock=Lock()
+        # Autocommit, the transactions are opened explicitly with BEGIN IMMEDIATE
+        self.connection=sqlite3.connect(path,timeout=timeout,check_same_thread=False,isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            created=not self.connection.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='memories'").fetchone()
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS memories(
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created REAL,
+                    updated REAL
+                )
+            ''')
+            columns={row[1] for row in self.connection.execute('PRAGMA table_info(memories)')}
+            # Usage of each memory, added to the databases made before it was tracked
+            for column,kind in (('hits','INTEGER DEFAULT 0'),('last_used','REAL'),('successes','INTEGER DEFAULT 0'),('failures','INTEGER DEFAULT 0')):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE memories ADD COLUMN {column} {kind}')
+            if created and legacy and Path(legacy).exists():
+                with open(legacy,'r',encoding='utf-8') as f:
+                    self.write(json.load(f))
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            # Take the write lock up front so two processes never both hold a read lock they must upgrade
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def write(self,entries:list[dict]):
+        now=time.time()
+        for entry in entries:
+            entry.setdefault('id',str(uuid4()))
+        self.connection.executemany('''
+            INSERT INTO memories(id,data,created,updated) VALUES (?,?,?,?)
+            ON CONFLICT(id) DO UPDATE SET data=excluded.data,updated=excluded.updated
+        ''',[(entry['id'],json.dumps(entry),now,now) for entry in entries])
+
+    def get(self,ids:list[str])->list[dict]:
+        if not ids:
+            return []
+        with self.lock:
+            rows=self.connection.execute(f'SELECT id,data FROM memories WHERE id IN ({",".join("?"*len(ids))})',list(ids)).fetchall()
+        found={id:json.loads(data) for id,data in rows}
+        return [found[id] for id in ids if id in found]
+
+    def scan(self,batch_size:int=1000)->Iterator[list[dict]]:
+        last=''
+        while True:
+            with self.lock:
+                rows=self.connection.execute('SELECT id,data FROM memories WHERE id>? ORDER BY id LIMIT ?',(last,batch_size)).fetchall()
+            if not rows:
+                return
+            last=rows[-1][0]
+            yield [json.loads(data) for _,data in rows]
+
+    def upsert(self,entries:list[dict]):
+        with self.transaction():
+            self.write(entries)
+
+    def delete(self,ids:list[str]):
+        with self.transaction():
+            self.connection.executemany('DELETE FROM memories WHERE id=?',[(id,) for id in ids])
+
+    def replace(self,ids:list[str],entries:list[dict]):
+        with self.transaction():
+            self.connection.executemany('DELETE FROM memories WHERE id=?',[(id,) for id in ids])
+            self.write(entries)
+
+    def record_hits(self,ids:list[str]):
+        now=time.time()
+        with self.transaction():
+            self.connection.executemany('UPDATE memories SET hits=hits+1,last_used=? WHERE id=?',[(now,id) for id in ids])
+
+    def record_outcome(self,ids:list[str],success:bool):
+        column='successes' if success else 'failures'
+        with self.transaction():
+            self.connection.executemany(f'UPDATE memories SET {column}={column}+1 WHERE id=?',[(id,) for id in ids])
+
+    def usage(self)->list[dict]:
+        with self.lock:
+            rows=self.connection.execute('SELECT id,created,hits,last_used,successes,failures FROM memories').fetchall()
+        return [dict(zip(('id','created','hits','last_used','successes','failures'),row)) for row in rows]
+
+    def merge(self,into:str,ids:list[str],entry:dict):
+        entry['id']=into
+        others=[id for id in ids if id!=into]
+        with self.transaction():
+            placeholders=','.join('?'*len(others))
+            self.connection.execute(f'''
+                UPDATE memories SET
+                    hits=hits+(SELECT COALESCE(SUM(hits),0) FROM memories WHERE id IN ({placeholders})),
+                    successes=successes+(SELECT COALESCE(SUM(successes),0) FROM memories WHERE id IN ({placeholders})),
+                    failures=failures+(SELECT COALESCE(SUM(failures),0) FROM memories WHERE id IN ({placeholders})),
+                    last_used=MAX(COALESCE(last_used,0),(SELECT COALESCE(MAX(last_used),0) FROM memories WHERE id IN ({placeholders})))
+                WHERE id=?
+            ''',[*others,*others,*others,*others,into])
+            self.connection.executemany('DELETE FROM memories WHERE id=?',[(id,) for id in others])
+            self.write([entry])
+
+    def __len__(self)->int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM memories').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,76 @@
+from src.memory.storage.queue import SQLiteQueue
+from threading import Thread,Event,Lock
+from typing import Callable
+import logging
+import time
+
+logger=logging.getLogger(__name__)
+
+class MemoryWorker:
+    '''Consolidates the queued work of a memory on a background thread. The items wait in a queue on
+    disk until `batch_size` of them are pending or the oldest has waited `max_delay` seconds, then they
+    are handed to `consolidate` together. Items left over by a crash are picked up on the next start,
+    the items of a failed batch are retried until the queue moves them aside as dead.'''
+    def __init__(self,consolidate:Callable[[list[dict]],None],queue:SQLiteQueue,batch_size:int=4,max_delay:float=30,poll_interval:float=1):
+        self.consolidate=consolidate
+        self.queue=queue
+        self.batch_size=batch_size
+        self.max_delay=max_delay
+        self.poll_interval=poll_interval
+        self.wake=Event()
+        self.stopped=Event()
+        # Held while a batch is consolidated, so a flush waits for the batch in progress
+        self.running=Lock()
+        self.thread=Thread(target=self.run,name='memory-worker',daemon=True)
+        self.thread.start()
+
+    def submit(self,item:dict):
+        self.queue.put(item)
+        self.wake.set()
+
+    def due(self)->bool:
+        oldest=self.queue.oldest()
+        if oldest is None:
+            return False
+        return len(self.queue)>=self.batch_size or time.time()-oldest>=self.max_delay
+
+    def drain(self,force:bool=False):
+        '''Consolidate the pending items a batch at a time, all of them when forced'''
+        with self.running:
+            while force or self.due():
+                batch=self.queue.take(self.batch_size)
+                if not batch:
+                    return
+                ids=[id for id,_ in batch]
+                try:
+                    self.consolidate([item for _,item in batch])
+                except Exception as e:
+                    if dead:=self.queue.fail(ids,error=repr(e)):
+                        logger.error('Dropped the memory items %s after %d failed attempts, they are kept in dead_items',dead,self.queue.max_attempts)
+                    raise
+                self.queue.ack(ids)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception('Memory consolidation failed, the batch is retried later')
+                self.stopped.wait(self.max_delay)
+
+    def flush(self):
+        '''Consolidate everything pending now, in the calling thread'''
+        self.drain(force=True)
+
+    def close(self,flush:bool=True):
+        try:
+            if flush:
+                self.flush()
+        finally:
+            # The thread and the queue are closed even when the last batch fails, it stays queued for the next start
+            self.stopped.set()
+            self.wake.set()
+            self.thread.join()
+            self.queue.close()
@@ -0,0 +1,263 @@
+from inspect import iscoroutinefunction,isasyncgenfunction,isgeneratorfunction
+from src.metrics.views import CallRecord,Rollup
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict
+from functools import wraps
+from threading import Lock
+from time import perf_counter,time
+from uuid import uuid4
+import json
+import math
+
+# The labels of the code that is running (run, agent, node) and the call being measured
+current_labels:ContextVar[dict]=ContextVar('current_labels',default={})
+current_call:ContextVar[tuple[CallRecord,float]|None]=ContextVar('current_call',default=None)
+
+class MetricsCollector:
+    '''Collects a record per inference call and rolls them up per run, agent, node, provider or model.
+
+    With a `path` every record is also appended to it as a JSON line as soon as the call ends.
+    `prices` maps a model to its USD price per million prompt and completion tokens, and optionally
+    cached prompt tokens, e.g. {'gemini-2.0-flash':(0.1,0.4,0.025)}. Without it cached tokens cost the same as the prompt.'''
+    def __init__(self,path:str=None,prices:dict[str,tuple[float,...]]=None):
+        self.path=path
+        self.prices=prices if prices else {}
+        self.records:list[CallRecord]=[]
+        self.lock=Lock()
+
+    def add(self,record:CallRecord):
+        price=self.prices.get(record.model,(0.0,0.0))
+        prompt_price,completion_price=price[:2]
+        cached_price=price[2] if len(price)>2 else prompt_price
+        uncached_tokens=record.prompt_tokens-record.cached_tokens
+        record.cost=(uncached_tokens*prompt_price+record.cached_tokens*cached_price+record.completion_tokens*completion_price)/1_000_000
+        with self.lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path,'a',encoding='utf-8') as file:
+                    file.write(json.dumps(asdict(record))+'\n')
+
+    def filter(self,**labels)->list[CallRecord]:
+        '''The records whose fields match the given values, e.g. filter(run=run, agent='Web Agent')'''
+        with self.lock:
+            records=list(self.records)
+        return [record for record in records if all(getattr(record,key)==value for key,value in labels.items())]
+
+    def rollup(self,records:list[CallRecord])->Rollup:
+        latencies=[record.wall_time for record in records]
+        ttfbs=[record.ttfb for record in records if record.ttfb is not None]
+        return Rollup(
+            calls=len(records),
+            errors=sum(1 for record in records if record.error),
+            prompt_tokens=sum(record.prompt_tokens for record in records),
+            completion_tokens=sum(record.completion_tokens for record in records),
+            total_tokens=sum(record.total_tokens for record in records),
+            cached_tokens=sum(record.cached_tokens for record in records),
+            images=sum(record.images for record in records),
+            cost=sum(record.cost for record in records),
+            wall_time=sum(latencies),
+            latency=percentiles(latencies),
+            ttfb=percentiles(ttfbs)
+        )
+
+    def totals(self,by:str='agent',**labels)->dict[str,Rollup]:
+        '''Rollups grouped by a field of the records, e.g. totals(by='node',run=run)'''
+        groups:dict[str,list[CallRecord]]={}
+        for record in self.filter(**labels):
+            groups.setdefault(getattr(record,by),[]).append(record)
+        return {key:self.rollup(records) for key,records in groups.items()}
+
+    def export(self,path:str):
+        '''Write all the records to a JSON lines file'''
+        with self.lock:
+            records=list(self.records)
+        with open(path,'w',encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(asdict(record))+'\n')
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+def percentiles(values:list[float],points:tuple[int,...]=(50,90,99))->dict[str,float]:
+    '''Nearest rank percentiles'''
+    if not values:
+        return {}
+    values=sorted(values)
+    return {f'p{point}':values[max(0,math.ceil(point/100*len(values))-1)] for point in points}
+
+@contextmanager
+def scope(**labels):
+    '''Label the calls made inside, e.g. scope(agent='Web Agent').
+
+    The agents are nested into a path (Computer Agent/Web Agent) and the outermost scope starts a run.'''
+    parent=current_labels.get()
+    labels={**parent,**labels}
+    if parent.get('agent') and 'agent' in labels and labels['agent']!=parent['agent']:
+        labels['agent']=f'{parent["agent"]}/{labels["agent"]}'
+    if not labels.get('run'):
+        labels['run']=uuid4().hex[:12]
+    token=current_labels.set(labels)
+    try:
+        yield labels
+    finally:
+        current_labels.reset(token)
+
+def current_run()->str|None:
+    return current_labels.get().get('run')
+
+def graph_node()->str|None:
+    '''The node of the LangGraph graph the call is made from'''
+    try:
+        from langgraph.config import get_config
+        return get_config().get('metadata',{}).get('langgraph_node')
+    except Exception:
+        return None
+
+def record_usage(input:int,output:int,total:int,cached:int=0):
+    '''Attach the token usage reported by a provider to the call being measured'''
+    call=current_call.get()
+    if call is not None:
+        record,_=call
+        record.prompt_tokens,record.completion_tokens,record.total_tokens,record.cached_tokens=input,output,total,cached
+
+def mark_first_byte():
+    call=current_call.get()
+    if call is not None:
+        record,start=call
+        if record.ttfb is None:
+            record.ttfb=perf_counter()-start
+
+def on_response(response):
+    '''httpx response hook, called once the headers of the response arrive'''
+    mark_first_byte()
+
+async def async_on_response(response):
+    mark_first_byte()
+
+def count_characters(messages)->int:
+    if isinstance(messages,str):
+        return len(messages)
+    characters=0
+    for message in messages:
+        content=getattr(message,'content',message)
+        characters+=len(str(content[0] if isinstance(content,tuple) else content))
+    return characters
+
+def estimate_usage(record:CallRecord,messages,output:str):
+    '''Four characters per token, for the calls the provider did not report the usage of'''
+    record.prompt_tokens=count_characters(messages)//4
+    record.completion_tokens=len(output)//4
+    record.total_tokens=record.prompt_tokens+record.completion_tokens
+    record.estimated=True
+
+def count_images(messages)->int:
+    if isinstance(messages,str):
+        return 0
+    # Image messages hold (text, image) as content
+    return sum(1 for message in messages if isinstance(getattr(message,'content',None),tuple))
+
+def tracked(function):
+    '''Record the calls of a provider method to the default collector.
+
+    Works on the sync, async, generator and async generator methods, for streams
+    the time to first byte is taken at the first chunk if the response hook did not see it.'''
+    def messages(args,kwargs):
+        return args[0] if args else kwargs.get('messages',kwargs.get('query',''))
+
+    def begin(self,args,kwargs)->tuple[CallRecord,float,object]:
+        labels=current_labels.get()
+        record=CallRecord(
+            provider=type(self).__name__,
+            model=getattr(self,'model',''),
+            method=function.__name__,
+            images=count_images(messages(args,kwargs)),
+            run=labels.get('run'),
+            agent=labels.get('agent'),
+            node=labels.get('node') or graph_node(),
+            timestamp=time()
+        )
+        start=perf_counter()
+        token=current_call.set((record,start))
+        return record,start,token
+
+    def end(record:CallRecord,start:float,token,error:Exception=None,messages=None,output:str=None):
+        record.wall_time=perf_counter()-start
+        if output is not None and record.total_tokens==0:
+            estimate_usage(record,messages,output)
+        if error is not None:
+            record.error=f'{type(error).__name__}: {error}'
+        try:
+            current_call.reset(token)
+        except ValueError:
+            # A stream finished from another context than it started in
+            pass
+        default_collector.add(record)
+
+    if isasyncgenfunction(function):
+        @wraps(function)
+        async def async_generator_wrapper(self,*args,**kwargs):
+            record,start,token=begin(self,args,kwargs)
+            error=None
+            chunks=[]
+            stream=function(self,*args,**kwargs)
+            try:
+                async for chunk in stream:
+                    mark_first_byte()
+                    chunks.append(chunk)
+                    yield chunk
+            except BaseException as e:
+                error=e
+                raise
+            finally:
+                await stream.aclose()
+                end(record,start,token,error if isinstance(error,Exception) else None,messages(args,kwargs),''.join(chunks))
+        return async_generator_wrapper
+    if iscoroutinefunction(function):
+        @wraps(function)
+        async def async_wrapper(self,*args,**kwargs):
+            record,start,token=begin(self,args,kwargs)
+            error=None
+            try:
+                return await function(self,*args,**kwargs)
+            except Exception as e:
+                error=e
+                raise
+            finally:
+                end(record,start,token,error)
+        return async_wrapper
+    if isgeneratorfunction(function):
+        @wraps(function)
+        def generator_wrapper(self,*args,**kwargs):
+            record,start,token=begin(self,args,kwargs)
+            error=None
+            chunks=[]
+            stream=function(self,*args,**kwargs)
+            try:
+                for chunk in stream:
+                    mark_first_byte()
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                error=e
+                raise
+            finally:
+                stream.close()
+                end(record,start,token,error,messages(args,kwargs),''.join(chunks))
+        return generator_wrapper
+    @wraps(function)
+    def wrapper(self,*args,**kwargs):
+        record,start,token=begin(self,args,kwargs)
+        error=None
+        try:
+            return function(self,*args,**kwargs)
+        except Exception as e:
+            error=e
+            raise
+        finally:
+            end(record,start,token,error)
+    return wrapper
+
+# Process wide collector the providers report to
+default_collector=MetricsCollector()
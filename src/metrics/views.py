@@ -0,0 +1,42 @@
+from dataclasses import dataclass,field
+
+@dataclass
+class CallRecord:
+    '''One call to an inference provider.'''
+    provider:str
+    model:str
+    method:str
+    prompt_tokens:int=0
+    completion_tokens:int=0
+    total_tokens:int=0
+    # Prompt tokens served from the provider's prompt cache, included in the prompt tokens
+    cached_tokens:int=0
+    # True when the provider did not report the usage, e.g. a stream closed before its last chunk
+    estimated:bool=False
+    images:int=0
+    # Seconds from sending the request to the end of the response, and to its first byte
+    wall_time:float=0.0
+    ttfb:float|None=None
+    cost:float=0.0
+    # Labels of the scope the call was made in, e.g. run, agent and node
+    run:str|None=None
+    agent:str|None=None
+    node:str|None=None
+    timestamp:float=0.0
+    error:str|None=None
+
+@dataclass
+class Rollup:
+    '''Totals and percentiles of a group of calls.'''
+    calls:int=0
+    errors:int=0
+    prompt_tokens:int=0
+    completion_tokens:int=0
+    total_tokens:int=0
+    cached_tokens:int=0
+    images:int=0
+    cost:float=0.0
+    wall_time:float=0.0
+    # Percentiles of the wall time and of the time to first byte, e.g. {'p50':0.8,'p90':1.9,'p99':3.1}
+    latency:dict[str,float]=field(default_factory=dict)
+    ttfb:dict[str,float]=field(default_factory=dict)
@@ -1,20 +1,85 @@
 from src.message import HumanMessage,SystemMessage
 from src.router.utils import read_markdown_file
 from src.inference import BaseInference
+from src.embedding import BaseEmbedding
+from dataclasses import dataclass
+from threading import Lock
 from json import dumps
+import numpy as np
+
+@dataclass
+class RouterMetrics:
+    # Queries routed by the embedding classifier
+    fast:int=0
+    # Queries the classifier was not confident about, routed by the llm
+    fallback:int=0
+
+    @property
+    def hit_rate(self)->float:
+        routed=self.fast+self.fallback
+        return self.fast/routed if routed else 0.0
 
 class LLMRouter:
-    def __init__(self,instructions:list[str]=[],routes:list[dict]=[],llm:BaseInference=None,verbose=False):
+    '''Picks the route of a query. With an `embedding` the description and the labelled examples of each
+    route are embedded once into a centroid and a query goes to its nearest centroid, the llm is only
+    asked when the best similarity is below `threshold` or within `margin` of the runner up.
+
+    The examples come from the `examples` key of a route or from `examples`, a dict of route name to
+    example queries.'''
+    def __init__(self,instructions:list[str]=[],routes:list[dict]=[],llm:BaseInference=None,verbose=False,embedding:BaseEmbedding=None,examples:dict[str,list[str]]=None,threshold:float=0.6,margin:float=0.05):
         self.system_prompt=read_markdown_file('./src/router/prompt.md')
         self.instructions=self.__get_instructions(instructions)
-        self.routes=dumps(routes,indent=2)
+        self.routes=dumps([{key:value for key,value in route.items() if key!='examples'} for route in routes],indent=2)
         self.llm=llm
         self.verbose=verbose
+        self.embedding=embedding
+        self.threshold=threshold
+        self.margin=margin
+        self.route_names=[route.get('name') for route in routes]
+        self.examples={route.get('name'):[f'{route.get("name")}: {route.get("description","")}',*route.get('examples',[]),*(examples or {}).get(route.get('name'),[])] for route in routes}
+        self.centroids:np.ndarray=None
+        self.lock=Lock()
+        self.metrics=RouterMetrics()
 
     def __get_instructions(self,instructions):
         return '\n'.join([f'{i+1}. {instruction}' for i,instruction in enumerate(instructions)])
-    
+
+    def fit(self):
+        '''Embed the descriptions and examples into a normalized centroid per route'''
+        texts=[text for name in self.route_names for text in self.examples[name]]
+        vectors=self.embedding.embed_batch(texts)
+        vectors=vectors/np.maximum(np.linalg.norm(vectors,axis=1,keepdims=True),1e-12)
+        centroids=[]
+        start=0
+        for name in self.route_names:
+            centroid=vectors[start:start+len(self.examples[name])].mean(axis=0)
+            centroids.append(centroid/max(float(np.linalg.norm(centroid)),1e-12))
+            start+=len(self.examples[name])
+        self.centroids=np.stack(centroids)
+
+    def classify(self,query:str)->tuple[str,float,bool]:
+        '''The nearest route, its similarity and whether it is confident enough to skip the llm'''
+        with self.lock:
+            if self.centroids is None:
+                self.fit()
+        vector=self.embedding.embed_batch([query])[0]
+        scores=self.centroids@(vector/max(float(np.linalg.norm(vector)),1e-12))
+        order=np.argsort(-scores)
+        best=float(scores[order[0]])
+        runner_up=float(scores[order[1]]) if len(order)>1 else -1.0
+        return self.route_names[order[0]],best,best>=self.threshold and best-runner_up>=self.margin
+
     def invoke(self,query:str)->str:
+        if self.embedding is not None and self.route_names:
+            route,score,confident=self.classify(query)
+            if confident or self.llm is None:
+                with self.lock:
+                    self.metrics.fast+=1
+                if self.verbose:
+                    print(f"Going to {route.upper()} route (similarity {score:.2f})")
+                return route
+            with self.lock:
+                self.metrics.fallback+=1
         parameters={'instructions':self.instructions,'routes':self.routes}
         messages=[SystemMessage(self.system_prompt.format(**parameters)),HumanMessage(query)]
         response=self.llm.invoke(messages,json=True)
@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from inspect import getdoc
 from json import dumps
+import re
 
 class Tool:
     def __init__(self, name: str='', params: BaseModel|None=None):
@@ -41,6 +42,21 @@ class Tool:
         except Exception as e:
             return f"Error: {str(e)}"
         
+    @property
+    def function_name(self)->str:
+        '''The name in the form the function calling APIs accept, e.g. Shell Tool -> Shell_Tool'''
+        return re.sub(r'[^a-zA-Z0-9_-]','_',self.name)
+
+    def json_schema(self)->dict:
+        '''The JSON schema of the parameters as an object, the form the function calling APIs expect'''
+        if not self.params:
+            return {'type':'object','properties':{}}
+        return {
+            'type':'object',
+            'properties':self.schema,
+            'required':self.params.model_json_schema().get('required',[])
+        }
+
     def __repr__(self):
         return f"Tool(name={self.name}, description={self.description}, params={list(self.params.model_fields.keys())})"
     
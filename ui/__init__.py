@@ -15,8 +15,10 @@ class ChatUI(QWidget):
         self.speech=speech
         self.is_recording=False
         self.speech_thread=None
-        self.agent_thread=None
         super().__init__()
+        self.agent_thread=AgentThread(self.agent)
+        self.agent_thread.finished.connect(self.on_agent_finished)
+        self.agent_thread.start()
 
         self.setWindowTitle("Computer Agent")
         self.setFixedSize(470, 80)  # ✅ Set window size slightly larger for shadow effect
@@ -158,9 +160,7 @@ class ChatUI(QWidget):
             self.text_input.setText('')
             self.text_input.setPlaceholderText('Executing Task...')
             self.text_input.setDisabled(True)
-            self.agent_thread=AgentThread(self.agent,query)
-            self.agent_thread.finished.connect(self.on_agent_finished)
-            self.agent_thread.start()
+            self.agent_thread.submit(query)
         else:
             self.send_button.setDisabled(True)
 
@@ -190,5 +190,6 @@ def launch_app(agent:ComputerAgent=None,speech:Speech=None):
     app = QApplication([])
     app.setWindowIcon(QIcon('./ui/assets/icon.png'))
     window = ChatUI(agent=agent,speech=speech)
+    app.aboutToQuit.connect(window.agent_thread.stop)
     window.show()
     app.exec()
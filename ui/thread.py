@@ -3,6 +3,9 @@ import sys
 import os
 sys.path.append(os.path.dirname(__file__))
 from src.agent.computer import ComputerAgent
+from src.agent.loop import default_loop
+from concurrent.futures import Future
+from threading import Event
 from src.speech import Speech
 
 class SpeechThread(QThread):
@@ -16,12 +19,28 @@ class SpeechThread(QThread):
         self.finished.emit(response.content)
 
 class AgentThread(QThread):
+    '''Drives the event loop shared by the agents, the queries are submitted to it as tasks'''
     finished = pyqtSignal(str)
-    def __init__(self, agent:ComputerAgent=None,query:str=''):
+    def __init__(self, agent:ComputerAgent=None):
         super().__init__()
         self.agent = agent
-        self.query=query
+        self.ready = Event()
 
     def run(self):
-        response = self.agent.invoke(self.query)
-        self.finished.emit(response)
\ No newline at end of file
+        default_loop.drive(on_ready=self.ready.set)
+
+    def submit(self, query:str):
+        self.ready.wait()
+        future = default_loop.submit(self.agent.async_invoke(query))
+        future.add_done_callback(self.on_done)
+
+    def on_done(self, future:Future):
+        try:
+            response = future.result()
+        except Exception as e:
+            response = f'The task failed: {e}'
+        self.finished.emit(response)
+
+    def stop(self):
+        default_loop.stop()
+        self.wait()
\ No newline at end of file